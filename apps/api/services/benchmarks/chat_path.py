@@ -0,0 +1,100 @@
+"""Latency and throughput of the whole chat path, without a remote API.
+
+    python -m benchmarks.chat_path [streams] [query]
+
+Starts the API with the local synthetic LLM and opens the given number of
+concurrent /api/llm/chat connections, e.g. with query "?delta=true".
+Reports time to the first frame and to the end of the answer, and the
+frames and bytes received. LOCAL_LLM_* variables set the synthetic answer.
+"""
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "benchmark"
+ORIGIN = "localhost:3000"
+
+
+def _start_api() -> tuple:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = {
+        **os.environ,
+        "LLM": "local:synthetic",
+        "AUTH_TOKEN": TOKEN,
+        "ALLOWED_HOSTS": ORIGIN,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "unused"),
+        "WORKING_DIRECTORY": os.environ.get("WORKING_DIRECTORY", "/tmp"),
+        "INTERPRETER_TYPE": os.environ.get("INTERPRETER_TYPE", "python"),
+        "IPYTHON_PATH": os.environ.get("IPYTHON_PATH", "ipython"),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, port
+
+
+async def _chat(port: int, query: str) -> tuple:
+    url = f"ws://127.0.0.1:{port}/api/llm/chat{query}"
+    async with websockets.connect(url, origin=f"http://{ORIGIN}", max_size=None) as ws:
+        start = time.perf_counter()
+        await ws.send(TOKEN)
+        await ws.send(json.dumps([{"role": "user", "text": "Hello"}]))
+        first = None
+        frames = size = 0
+        async for frame in ws:
+            if first is None:
+                first = time.perf_counter() - start
+            frames += 1
+            size += len(frame)
+        return first, time.perf_counter() - start, frames, size
+
+
+def _percentiles(values: list) -> str:
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return f"p50 {statistics.median(values) * 1000:7.1f}ms p95 {p95 * 1000:7.1f}ms"
+
+
+async def _run(port: int, streams: int, query: str):
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_chat(port, query) for _ in range(streams)))
+    elapsed = time.perf_counter() - start
+    first, total, frames, size = zip(*results)
+    print(f"{streams} streams in {elapsed:.2f}s")
+    print(f"  first frame  {_percentiles(first)}")
+    print(f"  full answer  {_percentiles(total)}")
+    print(f"  {sum(frames) / streams:.0f} frames, {sum(size) / streams / 1024:.1f} KB per answer")
+
+
+def main():
+    streams = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    query = sys.argv[2] if len(sys.argv) > 2 else ""
+    process, port = _start_api()
+    try:
+        asyncio.run(_run(port, streams, query))
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Many interpreter sessions in one process.
+
+    python -m benchmarks.interpreter_sessions [sessions]
+
+Starts the given number of IPython interpreters, runs a cell printing many
+lines in all of them at once and measures the threads of this process, the
+latency of the cells and the CPU time this process uses while the sessions
+are idle, and after their processes died without being stopped.
+"""
+import asyncio
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ALLOWED_HOSTS", "localhost:3000")
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+os.environ.setdefault("WORKING_DIRECTORY", tempfile.mkdtemp())
+os.environ.setdefault("INTERPRETER_TYPE", "python")
+os.environ.setdefault("IPYTHON_PATH", shutil.which("ipython") or "ipython")
+
+CELL = "for i in range(2000):\n    print('line', i)\n"
+IDLE_SECONDS = 2
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _idle_cpu() -> float:
+    start = _cpu_seconds()
+    time.sleep(IDLE_SECONDS)
+    return (_cpu_seconds() - start) / IDLE_SECONDS
+
+
+async def _run_cells(interpreters) -> list[float]:
+    async def run(interpreter):
+        start = time.perf_counter()
+        await interpreter.arun_cell(CELL)
+        return time.perf_counter() - start
+
+    return await asyncio.gather(*(run(interpreter) for interpreter in interpreters))
+
+
+def main(sessions: int):
+    from services.interpreter import IPythonInterpreter
+
+    ipython_path = os.environ["IPYTHON_PATH"]
+    threads = threading.active_count()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(8) as executor:
+        interpreters = list(
+            executor.map(lambda _: IPythonInterpreter(ipython_path=ipython_path), range(sessions))
+        )
+    print(f"{sessions} sessions started in {time.perf_counter() - start:.1f}s, "
+          f"{threading.active_count() - threads} threads added")
+
+    latencies = sorted(asyncio.run(_run_cells(interpreters)))
+    print(f"cells: p50 {statistics.median(latencies) * 1000:.0f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms")
+    print(f"idle CPU: {_idle_cpu():.2f} cores")
+
+    for interpreter in interpreters:
+        interpreter._process.kill()
+        interpreter._process.wait()
+    print(f"idle CPU after the processes died: {_idle_cpu():.2f} cores")
+
+    for interpreter in interpreters:
+        interpreter.stop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
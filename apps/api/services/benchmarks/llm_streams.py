@@ -0,0 +1,97 @@
+"""Concurrent chat streams on one event loop, blocking versus async client.
+
+    python -m benchmarks.llm_streams [streams]
+
+Starts benchmarks.mock_openai on a free port and runs the given number of
+chats at once, first iterating the synchronous GPT.chat on the event loop
+like the chat handler used to, then with GPT.achat. Reports the total time
+and the longest the event loop was blocked.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _start_mock() -> subprocess.Popen:
+    """Run the mock server in its own process, so it does not compete for the GIL."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.mock_openai:app",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+    )
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{port}/v1"
+    return process
+
+
+async def _lag_monitor(interval: float, lags: list):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def _sync_chat(llm, history):
+    responses = 0
+    for _ in llm.chat(history):
+        responses += 1
+        await asyncio.sleep(0)
+    return responses
+
+
+async def _async_chat(llm, history):
+    responses = 0
+    async for _ in llm.achat(history):
+        responses += 1
+    return responses
+
+
+async def _run(chat, llm, history, streams: int):
+    lags = []
+    monitor = asyncio.create_task(_lag_monitor(0.005, lags))
+    start = time.perf_counter()
+    counts = await asyncio.gather(*(chat(llm, history) for _ in range(streams)))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    return elapsed, max(lags, default=0.0), sum(counts)
+
+
+def main():
+    streams = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    mock = _start_mock()
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    # importing services.llm also sets up the chat endpoint
+    os.environ.setdefault("ALLOWED_HOSTS", "localhost:3000")
+
+    from services.llm.gpt import GPTOpenAI
+    from services.llm.types import Message
+
+    llm = GPTOpenAI("mock")
+    history = [Message(role="user", text="Hello")]
+    try:
+        for name, chat in (("sync chat", _sync_chat), ("async achat", _async_chat)):
+            elapsed, lag, responses = asyncio.run(_run(chat, llm, history, streams))
+            print(
+                f"{name:12} {streams} streams: {elapsed:6.2f}s total, "
+                f"max loop lag {lag * 1000:7.1f}ms, {responses} responses"
+            )
+    finally:
+        mock.terminate()
+
+
+if __name__ == "__main__":
+    main()
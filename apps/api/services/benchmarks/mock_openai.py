@@ -0,0 +1,64 @@
+"""OpenAI compatible chat completions server which streams a canned answer.
+
+Used to benchmark the LLM service without network access or API costs:
+
+    uvicorn benchmarks.mock_openai:app --port 8200
+    OPENAI_API_BASE=http://127.0.0.1:8200/v1 LLM=gpt-openai:mock uvicorn main:app
+
+MOCK_TEXT_TOKENS and MOCK_CODE_TOKENS set how many chunks of text and of
+function call arguments are sent, MOCK_TOKEN_DELAY the seconds between them.
+"""
+import asyncio
+import json
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+TEXT_TOKENS = int(os.environ.get("MOCK_TEXT_TOKENS", "50"))
+CODE_TOKENS = int(os.environ.get("MOCK_CODE_TOKENS", "50"))
+TOKEN_DELAY = float(os.environ.get("MOCK_TOKEN_DELAY", "0.01"))
+
+app = FastAPI()
+
+
+def _chunk(delta: dict, finish_reason: str = None) -> str:
+    chunk = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "mock",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+def code_arguments(tokens: int) -> list[str]:
+    """The function call arguments, split into tokens chunks."""
+    code = "".join(f"x{i} <- {i}\n" for i in range(tokens))
+    arguments = json.dumps({"code": code})
+    size = max(1, len(arguments) // max(1, tokens))
+    return [arguments[i : i + size] for i in range(0, len(arguments), size)]
+
+
+async def _events(text_tokens: int, code_tokens: int, delay: float):
+    yield _chunk({"role": "assistant", "content": ""})
+    for i in range(text_tokens):
+        await asyncio.sleep(delay)
+        yield _chunk({"content": f"token{i} "})
+    if code_tokens:
+        yield _chunk({"function_call": {"name": "run_r_code", "arguments": ""}})
+        for part in code_arguments(code_tokens):
+            await asyncio.sleep(delay)
+            yield _chunk({"function_call": {"arguments": part}})
+    yield _chunk({}, "function_call" if code_tokens else "stop")
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def completions(request: Request):
+    await request.json()
+    return StreamingResponse(
+        _events(TEXT_TOKENS, CODE_TOKENS, TOKEN_DELAY),
+        media_type="text/event-stream",
+    )
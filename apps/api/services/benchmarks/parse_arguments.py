@@ -0,0 +1,71 @@
+"""Code extraction from streamed function call arguments.
+
+    python -m benchmarks.parse_arguments
+
+Feeds the arguments of generated R code blocks of a few KB in token sized
+chunks, once re-parsing the accumulated arguments on every chunk like
+the GPT stream used to, and once with the incremental ArgumentsParser.
+"""
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# importing services.llm also sets up the chat endpoint
+os.environ.setdefault("ALLOWED_HOSTS", "localhost:3000")
+os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+from services.llm.gpt.parsing import ArgumentsParser  # noqa: E402
+
+_LINE = 'df_{i} <- read.csv("data/file_{i}.csv")\nprint(summary(df_{i}$value))  # «{i}»\n'
+
+
+def _reparse(arguments: str):
+    # the previous approach: close the string and json.loads everything
+    if not re.sub(r"\s+", "", arguments).endswith('"}'):
+        arguments += '"}'
+    try:
+        return json.loads(arguments).get("code")
+    except json.JSONDecodeError:
+        return None
+
+
+def _run_reparse(chunks):
+    arguments = ""
+    code = None
+    for chunk in chunks:
+        arguments += chunk
+        code = _reparse(arguments) or code
+    return code
+
+
+def _run_incremental(chunks):
+    parser = ArgumentsParser("code")
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.value
+
+
+def main():
+    for size in (1_000, 4_000, 16_000):
+        lines = []
+        while sum(map(len, lines)) < size:
+            lines.append(_LINE.format(i=len(lines)))
+        code = "".join(lines)
+        arguments = json.dumps({"code": code})
+        # roughly one token per 4 characters
+        chunks = [arguments[i : i + 4] for i in range(0, len(arguments), 4)]
+
+        results = []
+        for name, run in (("reparse", _run_reparse), ("incremental", _run_incremental)):
+            start = time.perf_counter()
+            for _ in range(5):
+                assert run(chunks) == code
+            results.append(f"{name} {(time.perf_counter() - start) / 5 * 1000:8.2f}ms")
+        print(f"{len(code):6} chars, {len(chunks):5} chunks: " + ", ".join(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,36 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+from contextlib import AsyncExitStack, asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from services.agent import agent_router
 from services.auth import auth_router, welcome_lifespan
 from services.interpreter import interpreter_router
-from services.llm.service import llm_router
+from services.interpreter.service import pool_lifespan
+from services.interpreter.proxy import (
+    SUPERVISOR_URLS,
+    agent_proxy_router,
+    interpreter_proxy_router,
+)
+from services.llm.service import llm, llm_router
+from services.metrics import metrics_router
 from services.utils import get_env_var
 
 
-app = FastAPI(lifespan=welcome_lifespan)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await llm.prepare()
+    async with AsyncExitStack() as stack:
+        if not SUPERVISOR_URLS:
+            await stack.enter_async_context(pool_lifespan(app))
+        await stack.enter_async_context(welcome_lifespan(app))
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
 if get_env_var("ENABLE_CORS", "FALSE") == "TRUE":
     app.add_middleware(
         CORSMiddleware,
@@ -21,5 +41,12 @@ if get_env_var("ENABLE_CORS", "FALSE") == "TRUE":
     )
 
 app.include_router(auth_router, prefix="/api/auth")
-app.include_router(interpreter_router, prefix="/api/interpreter")
+if SUPERVISOR_URLS:
+    # interpreters live in separate supervisors, see services/interpreter/supervisor.py
+    app.include_router(interpreter_proxy_router, prefix="/api/interpreter")
+    app.include_router(agent_proxy_router, prefix="/api/agent")
+else:
+    app.include_router(interpreter_router, prefix="/api/interpreter")
+    app.include_router(agent_router, prefix="/api/agent")
 app.include_router(llm_router, prefix="/api/llm")
+app.include_router(metrics_router, prefix="/api/metrics")
@@ -0,0 +1,159 @@
+import asyncio
+import json
+
+from fastapi import APIRouter, WebSocket
+from pydantic import BaseModel
+
+from services.auth import verify_websocket
+from services.interpreter.service import (
+    INTERRUPT_MESSAGE,
+    STREAM_FLUSH_INTERVAL,
+    STREAM_FLUSH_SIZE,
+    TIMEOUT_MESSAGE,
+    sessions,
+)
+from services.interpreter.session import Session, ws_exceptions
+from services.llm import LLMException, Message, Response
+from services.llm.coalesce import coalesce
+from services.llm.scheduler import llm_client
+from services.llm.service import COALESCE_CHARS, COALESCE_WINDOW, client_key, llm
+from services.metrics import metrics
+from services.utils import get_env_var
+
+MAX_STEPS = int(get_env_var("AGENT_MAX_STEPS", "10"))
+
+
+agent_router = APIRouter()
+
+
+class Request(BaseModel):
+    history: list[Message]
+
+
+async def _model_turn(websocket: WebSocket, history: list[Message]) -> Response:
+    response = Response()
+    responses = coalesce(
+        llm.achat(history), window=COALESCE_WINDOW, max_chars=COALESCE_CHARS
+    )
+    try:
+        async for response in responses:
+            await websocket.send_text("_success_ " + response.json(exclude_none=True))
+    finally:
+        await responses.aclose()
+    return response
+
+
+async def _run_code(websocket: WebSocket, session: Session, code: str, stream: bool) -> str:
+    async def send_chunk(chunk: str):
+        try:
+            await websocket.send_text(f"_chunk_ {chunk}")
+        except (RuntimeError, *ws_exceptions):
+            # the client left, the cell still runs to the end
+            pass
+
+    async def run_cell():
+        async with session.lock:
+            # the memo does not know what this code changed
+            session.memo_state = None
+            try:
+                result = await session.interpreter.arun_cell(
+                    code,
+                    on_output=send_chunk if stream else None,
+                    flush_interval=STREAM_FLUSH_INTERVAL,
+                    flush_size=STREAM_FLUSH_SIZE,
+                )
+            except Exception as e:
+                return f"Error: {e}"
+            # streamed, the result only holds what was not sent yet,
+            # the model gets the whole output elided like without streaming
+            return result if result is None else session.interpreter.last_output
+
+    # a cell cancelled halfway would leave its output to the next cell
+    result = await asyncio.shield(asyncio.create_task(run_cell()))
+    return TIMEOUT_MESSAGE if result is None else result
+
+
+async def _agent_loop(websocket: WebSocket, session: Session, history: list[Message], stream: bool):
+    for _ in range(MAX_STEPS):
+        response = await _model_turn(websocket, history)
+        history.append(Message(role="model", text=response.text, code=response.code))
+        if not response.code:
+            return
+
+        metrics.increment("agent.steps")
+        result = await _run_code(websocket, session, response.code, stream)
+        # with ?stream=true, the output was sent in "_chunk_" frames before
+        await websocket.send_text("_result_ " + json.dumps({"code_result": result}))
+        history.append(Message(role="interpreter", code_result=result))
+    await websocket.send_text(f"_error_ Stopped after {MAX_STEPS} steps")
+
+
+async def _receive_interrupts(websocket: WebSocket, session: Session):
+    while True:
+        if await websocket.receive_text() == INTERRUPT_MESSAGE:
+            session.interrupt()
+
+
+@agent_router.websocket("/run")
+async def run(websocket: WebSocket):
+    """Chat with the model, running its code in the session right away.
+
+    After the token, the client sends the history like for /api/llm/chat.
+    The answers of the model arrive as "_success_" frames like there, the
+    output of each code it runs as "_result_ {"code_result": ...}", after
+    which the next answer follows. The socket is closed once the model
+    answers without code. "_interrupt_" stops the running code.
+    """
+    stream = websocket.query_params.get("stream", "").lower() == "true"
+    session_id = websocket.query_params.get("session")
+    llm_client.set(client_key(websocket))
+
+    await websocket.accept()
+    try:
+        if not await verify_websocket(websocket):
+            return
+        history = Request(history=json.loads(await websocket.receive_text())).history
+    except ws_exceptions:
+        return
+    except ValueError as e:
+        await websocket.send_text(f"_error_ {e}")
+        await websocket.close()
+        return
+
+    try:
+        session = await sessions.open(session_id)
+    except Exception as e:
+        try:
+            await websocket.send_text(f"_error_ {e}")
+            await websocket.close()
+        except ws_exceptions:
+            pass
+        return
+
+    receiver = None
+    try:
+        if session.persistent:
+            await websocket.send_text(f"_session_ {session.id}")
+        await session.attach(websocket, stream=stream)
+        receiver = asyncio.create_task(_receive_interrupts(websocket, session))
+        loop = asyncio.create_task(_agent_loop(websocket, session, history, stream))
+        # a disconnect ends the receiver, which then stops the loop
+        await asyncio.wait([receiver, loop], return_when=asyncio.FIRST_COMPLETED)
+        if not loop.done():
+            loop.cancel()
+        await asyncio.gather(loop, return_exceptions=True)
+        if loop.cancelled():
+            return
+        error = loop.exception()
+        if error is not None:
+            if isinstance(error, ws_exceptions):
+                return
+            message = str(error) if isinstance(error, LLMException) else "Internal error"
+            await websocket.send_text(f"_error_ {message}")
+        await websocket.close()
+    except ws_exceptions:
+        pass
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        await sessions.release(session, websocket)
@@ -1,4 +1,4 @@
 from .token import AUTH_TOKEN
-from .service import auth_router
+from .service import auth_router, verify_token
 from .websocket import verify_websocket, ALLOWED_HOSTS
 from .welcome import welcome_lifespan
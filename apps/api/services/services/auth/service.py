@@ -1,4 +1,7 @@
-from fastapi import APIRouter, HTTPException
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
 from pydantic import BaseModel
 
 from .token import AUTH_TOKEN
@@ -15,3 +18,10 @@ def verify(request: TokenRequest):
     if request.token == AUTH_TOKEN:
         return {"status": "success"}
     raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def verify_token(authorization: Optional[str] = Header(None)):
+    """Dependency of HTTP endpoints, which take "Authorization: Bearer <token>"."""
+    expected = f"Bearer {AUTH_TOKEN}"
+    if authorization is None or not secrets.compare_digest(authorization, expected):
+        raise HTTPException(status_code=401, detail="Invalid token")
@@ -1,2 +1,4 @@
+from .base import BaseInterpreter
 from .ipython_interpreter import IPythonInterpreter
+from .kernel_interpreter import KernelInterpreter
 from .service import interpreter_router
@@ -0,0 +1,346 @@
+import asyncio
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+from .channel import OutputChannel
+from .output import (
+    FLUSH_INTERVAL,
+    FLUSH_SIZE,
+    OutputCallback,
+    OutputCapture,
+    cell_capture,
+    stream_output,
+)
+from .reactor import get_reactor
+from .resources import CellUsage, ResourceLimits, UsageMeter
+from .tables import CellTable, parse_table_line
+
+
+class BaseInterpreter(ABC):
+    """A long-lived interpreter process which runs cells sent over stdin.
+
+    Subclasses provide the command line and how a cell is handed to the
+    process. The output of every cell is terminated by _END_MESSAGE on stdout.
+    Output beyond output_limit characters is elided, and the full output is
+    written to output.OUTPUT_DIR in the working directory. A timed out cell is
+    interrupted, the process is only restarted if that does not end it.
+    The process is started with the rlimits of limits, and the resources
+    used by the last cell are kept in last_usage, the tables it returned in
+    last_tables and its whole output, elided like without streaming, in
+    last_output. Its stdout and stderr are
+    read by the reactor shared by all interpreters, or by a thread per pipe
+    on Windows, where pipes cannot be selected.
+    """
+
+    _END_MESSAGE = "__ INTERPRETER END OF EXECUTION __"
+    _START_TIMEOUT = 10
+    _INTERRUPT_GRACE = 5
+    supports_tables = True
+
+    def __init__(
+        self,
+        *,
+        working_dir: Path = None,
+        timeout: int = None,
+        output_limit: int = None,
+        limits: ResourceLimits = None,
+    ):
+        self._working_dir = working_dir
+        self._timeout = timeout
+        self._output_limit = output_limit
+        self._limits = limits
+        self._running = False
+        self._busy = False
+        self._tables_dir = None
+        # the directory tables of the running cell go to, None without tables
+        self._cell_tables_dir = None
+        self._cell_tables = []
+        self.last_usage: Optional[CellUsage] = None
+        self.last_tables: list[CellTable] = []
+        self.last_output: Optional[str] = None
+
+    def __del__(self):
+        self.stop()
+
+    @abstractmethod
+    def _popen_args(self) -> dict:
+        """Arguments for subprocess.Popen, without the pipes."""
+
+    @abstractmethod
+    def _end_message_command(self) -> str:
+        """Code which makes the interpreter print _END_MESSAGE."""
+
+    @abstractmethod
+    def _cell_command(self, script: str, tables: Optional[str] = None) -> str:
+        """Code which runs the cell in-process, followed by _END_MESSAGE.
+        With tables, a tabular value is written to that directory instead
+        of printed in full, see services.interpreter.tables."""
+
+    def _setup_command(self) -> str:
+        """Code run once after start, e.g. to define helpers for _cell_command."""
+        return ""
+
+    def _process_stdout(self, stdout: str) -> str:
+        return stdout
+
+    def _spawn(self):
+        """Start the process, with text pipes for stdin, stdout and stderr."""
+        preexec_fn = None
+        if self._limits is not None and sys.platform != "win32":
+            preexec_fn = self._limits.preexec_fn()
+        return subprocess.Popen(
+            **self._popen_args(),
+            preexec_fn=preexec_fn,
+            text=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def _start(self):
+        self._process = self._spawn()
+        self._p_stdin = self._process.stdin
+
+        self._q_stdout = OutputChannel()
+        self._q_stderr = OutputChannel()
+        pipes = [(self._process.stdout, self._q_stdout), (self._process.stderr, self._q_stderr)]
+        self._reader_threads = []
+        if sys.platform == "win32":
+            for pipe, channel in pipes:
+                thread = threading.Thread(
+                    target=self._reader_thread, args=(pipe, channel), daemon=True
+                )
+                thread.start()
+                self._reader_threads.append(thread)
+        else:
+            for pipe, channel in pipes:
+                get_reactor().register(pipe, channel)
+
+        self._wait_till_started()
+        self._running = True
+
+    def stop(self):
+        if self._running:
+            self._process.kill()
+            self._running = False
+            for thread in self._reader_threads:
+                thread.join()
+            for pipe in (self._process.stdout, self._process.stderr):
+                if not self._reader_threads:
+                    get_reactor().unregister(pipe)
+                pipe.close()
+            self._process.wait()
+            if self._tables_dir is not None:
+                shutil.rmtree(self._tables_dir, ignore_errors=True)
+                self._tables_dir = None
+
+    def is_alive(self) -> bool:
+        return self._running and self._process.poll() is None
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._process.pid if self._running else None
+
+    def _restart(self):
+        self.stop()
+        self._start()
+
+    def interrupt(self) -> bool:
+        """Send SIGINT to a running cell, which then ends with the output so far.
+        Returns False if the interpreter cannot be interrupted."""
+        if not self._busy or not self.is_alive() or sys.platform == "win32":
+            return False
+        self._process.send_signal(signal.SIGINT)
+        return True
+
+    def _interrupt_or_restart(self):
+        """Interrupt a timed out cell, restart only if it does not finish in time."""
+        if not self.interrupt() or not self._read_stdout(
+            self._INTERRUPT_GRACE, OutputCapture()
+        ):
+            self._restart()
+
+    async def _ainterrupt_or_restart(self):
+        if not self.interrupt() or not await self._aread_stdout(
+            self._INTERRUPT_GRACE, OutputCapture()
+        ):
+            await asyncio.to_thread(self._restart)
+
+    def _reader_thread(self, pipe, q: OutputChannel):
+        # readline returns "" only at EOF, which the killed process reaches
+        for line in iter(pipe.readline, ""):
+            q.put(line)
+
+    def _new_capture(self, stream: bool = False) -> OutputCapture:
+        return cell_capture(self._working_dir, self._output_limit, stream)
+
+    def _read_stdout(self, timeout: Optional[int], capture: OutputCapture) -> bool:
+        """Write stdout to capture until _END_MESSAGE, False on timeout."""
+        start = time.time()
+        first = True
+        while True:
+            line = self._q_stdout.get(timeout=timeout)
+            if timeout is not None and time.time() - start > timeout:
+                line = None
+
+            if line is None:
+                return False
+
+            if self._END_MESSAGE in line:
+                return True
+            if first:
+                line = self._process_stdout(line)
+                first = False
+            if not self._take_table(line):
+                capture.write(line)
+
+    async def _aread_stdout(
+        self,
+        timeout: Optional[int],
+        capture: OutputCapture,
+        on_output: OutputCallback = None,
+        flush_interval: float = FLUSH_INTERVAL,
+        flush_size: int = FLUSH_SIZE,
+    ) -> bool:
+        """Like _read_stdout, but waits on the event loop.
+
+        With on_output, new output in the capture (including stderr) is passed
+        on whenever flush_size characters were collected or flush_interval
+        seconds passed."""
+        first = True
+
+        def handle(line: str) -> bool:
+            nonlocal first
+            if self._END_MESSAGE in line:
+                return True
+            if first:
+                line = self._process_stdout(line)
+                first = False
+            if not self._take_table(line):
+                capture.write(line)
+            return False
+
+        return await stream_output(
+            self._q_stdout.aget,
+            handle,
+            capture,
+            timeout,
+            on_output,
+            flush_interval,
+            flush_size,
+            collect=self._read_stderr,
+        )
+
+    def _take_table(self, line: str) -> bool:
+        """Keep the table of a marker line. Cells can print any marker, so
+        only tables in the directory of this cell are taken."""
+        if self._cell_tables_dir is None:
+            return False
+        table = parse_table_line(line)
+        if table is None:
+            return False
+        try:
+            path = table.path.resolve()
+        except (OSError, RuntimeError):
+            return False
+        if path.parent != self._cell_tables_dir:
+            return False
+        self._cell_tables.append(table.copy(update={"path": path}))
+        return True
+
+    def _tables_arg(self, tables: bool) -> Optional[str]:
+        self._cell_tables = []
+        self._cell_tables_dir = None
+        if not tables:
+            return None
+        if self._tables_dir is None:
+            self._tables_dir = tempfile.mkdtemp(prefix="rpilot-tables-")
+        self._cell_tables_dir = Path(self._tables_dir).resolve()
+        return self._tables_dir
+
+    def _read_stderr(self) -> str:
+        return "".join(self._q_stderr.drain())
+
+    def _write_stdin(self, text: str):
+        self._p_stdin.write(text)
+        self._p_stdin.flush()
+
+    def _wait_till_started(self):
+        self._write_stdin(self._setup_command() + self._end_message_command())
+        self._read_stdout(self._START_TIMEOUT, OutputCapture())
+
+    def _fetch_result(self) -> Optional[str]:
+        self.last_output = None
+        capture = self._new_capture()
+        try:
+            if not self._read_stdout(self._timeout, capture):
+                self._interrupt_or_restart()
+                return None
+
+            capture.write(self._read_stderr())
+            self.last_output = capture.getvalue()
+            return self.last_output
+        finally:
+            capture.close()
+
+    async def _afetch_result(self, **stream_args) -> Optional[str]:
+        self.last_output = None
+        stream = stream_args.get("on_output") is not None
+        capture = self._new_capture(stream)
+        try:
+            if not await self._aread_stdout(self._timeout, capture, **stream_args):
+                await self._ainterrupt_or_restart()
+                return None
+
+            capture.write(self._read_stderr())
+            self.last_output = capture.getvalue()
+            return capture.getvalue(skip_read=stream)
+        finally:
+            capture.close()
+
+    def run_cell(self, script: str, tables: bool = False) -> Optional[str]:
+        """Run the whole cell and return its output.
+        Returns None if the interpreter timed out. With tables, tabular
+        values are returned in last_tables, with a preview in the output."""
+        self._busy = True
+        meter = UsageMeter(self.pid)
+        try:
+            self._write_stdin(self._cell_command(script, self._tables_arg(tables)))
+            return self._fetch_result()
+        finally:
+            self._busy = False
+            self.last_usage = meter.finish(self.pid)
+            self.last_tables = self._cell_tables
+
+    async def arun_cell(
+        self,
+        script: str,
+        on_output: OutputCallback = None,
+        flush_interval: float = FLUSH_INTERVAL,
+        flush_size: int = FLUSH_SIZE,
+        tables: bool = False,
+    ) -> Optional[str]:
+        """Like run_cell, but waits for the output without blocking the event loop.
+        If on_output is given, all output is streamed to it while the cell
+        runs and only the output not streamed yet is returned."""
+        self._busy = True
+        meter = UsageMeter(self.pid)
+        try:
+            self._write_stdin(self._cell_command(script, self._tables_arg(tables)))
+            return await self._afetch_result(
+                on_output=on_output,
+                flush_interval=flush_interval,
+                flush_size=flush_size,
+            )
+        finally:
+            self._busy = False
+            self.last_usage = meter.finish(self.pid)
+            self.last_tables = self._cell_tables
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class OutputChannel:
+    """Thread-safe FIFO of output lines that can also be awaited from asyncio.
+
+    Producers call put() from any thread. Consumers either block in get() or
+    await aget(), which suspends on the event loop without holding a thread.
+    """
+
+    def __init__(self):
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._waiters = []
+
+    def put(self, item: str):
+        self.put_many([item])
+
+    def put_many(self, items: list[str]):
+        """Put several items at once, waking consumers only once."""
+        with self._cond:
+            self._items.extend(items)
+            self._cond.notify()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Return the next item, or None if none arrived within timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    async def aget(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Like get(), but waits on the running event loop."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._items:
+                    return self._items.popleft()
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            try:
+                if remaining is not None and remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                with self._cond:
+                    if (loop, future) in self._waiters:
+                        self._waiters.remove((loop, future))
+                    if self._items:
+                        return self._items.popleft()
+                return None
+
+    def drain(self) -> list[str]:
+        with self._cond:
+            items = list(self._items)
+            self._items.clear()
+            return items
@@ -2,17 +2,70 @@ import os
 import sys
 from pathlib import Path
 from typing import Optional
-import tempfile
-import time
-import queue
-import subprocess
-import threading
 
-
-class IPythonInterpreter:
-    _END_MESSAGE = "__ INTERPRETER END OF EXECUTION __"
+from .base import BaseInterpreter
+from .resources import ResourceLimits
+from .tables import PREVIEW_ROWS, TABLE_MARKER
+
+# Defined in the interpreter on start. Runs a cell in the user namespace and
+# prints the value of a trailing expression, like a notebook cell. With a
+# tables directory, a data frame value is written there as an Arrow IPC
+# stream if pyarrow is installed, and only a preview of it is printed.
+_RUN_CELL_HELPER = """
+def _INTERPRETER_table(value, directory):
+    kind = type(value)
+    if kind.__name__ not in ("DataFrame", "Table"):
+        return False
+    try:
+        import os, uuid
+        import pyarrow, pyarrow.ipc
+        if isinstance(value, pyarrow.Table):
+            table = value
+        elif kind.__module__.startswith("pandas"):
+            table = pyarrow.Table.from_pandas(value)
+        elif hasattr(value, "to_arrow"):
+            table = value.to_arrow()
+        else:
+            return False
+        path = os.path.join(directory, f"table_{uuid.uuid4().hex}.arrow")
+        with pyarrow.OSFile(path, "wb") as sink:
+            with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+    except Exception:
+        return False
+    print(f"TABLE_MARKER{table.num_rows} {table.num_columns} {path} __")
+    print(value.head(PREVIEW_ROWS) if hasattr(value, "head") else table.slice(0, PREVIEW_ROWS))
+    print(f"[{table.num_rows} rows x {table.num_columns} columns, sent to the user as a table]")
+    return True
+
+def _INTERPRETER_run_cell(length, code, tables=None):
+    import ast, linecache
+    if len(code) != length:
+        print(f"Error: received {len(code)} of {length} characters of the cell")
+        return
+    linecache.cache["<cell>"] = (len(code), None, code.splitlines(True), "<cell>")
+    try:
+        tree = ast.parse(code, "<cell>")
+        last = None
+        if tree.body and isinstance(tree.body[-1], ast.Expr):
+            last = ast.Expression(tree.body.pop().value)
+        exec(compile(tree, "<cell>", "exec"), globals())
+        if last is not None:
+            value = eval(compile(last, "<cell>", "eval"), globals())
+            if value is not None:
+                if tables is None or not _INTERPRETER_table(value, tables):
+                    print(value)
+    except SyntaxError:
+        get_ipython().showsyntaxerror()
+    except BaseException:
+        get_ipython().showtraceback(tb_offset=1)
+"""
+
+
+class IPythonInterpreter(BaseInterpreter):
+    language = "python"
     _INTERPRETER_PROMPT = ">>> "
-    _LAST_VAR = "_INTERPRETER_last_val"
+    _RUN_CELL = "_INTERPRETER_run_cell"
 
     def __init__(
         self,
@@ -21,20 +74,22 @@ class IPythonInterpreter:
         ipython_path: Path = None,
         timeout: int = None,
         deactivate_venv: bool = False,
+        output_limit: int = None,
+        limits: ResourceLimits = None,
     ):
-        self._working_dir = working_dir
+        super().__init__(
+            working_dir=working_dir,
+            timeout=timeout,
+            output_limit=output_limit,
+            limits=limits,
+        )
         if ipython_path is None:
             self._ipython_path = Path(sys.executable).parent / "ipython.exe"
         else:
             self._ipython_path = ipython_path
-        self._timeout = timeout
         self._deactivate_venv = deactivate_venv
-        self._running = False
         self._start()
 
-    def __del__(self):
-        self.stop()
-
     def _get_env(self):
         env = os.environ.copy()
         if self._deactivate_venv:
@@ -51,123 +106,29 @@ class IPythonInterpreter:
                 del env["_OLD_VIRTUAL_PATH"]
         return env
 
-    def _start(self):
-        env = self._get_env()
-        self._process = subprocess.Popen(
-            [str(self._ipython_path), "--classic"],
-            text=True,
-            cwd=self._working_dir,
-            env=env,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        self._p_stdin = self._process.stdin
-
-        self._stop_threads = False
-
-        self._q_stdout = queue.Queue()
-        self._t_stdout = threading.Thread(
-            target=self._reader_thread,
-            args=(self._process.stdout, self._q_stdout),
-            daemon=True,
-        )
-        self._t_stdout.start()
-
-        self._q_stderr = queue.Queue()
-        self._t_stderr = threading.Thread(
-            target=self._reader_thread,
-            args=(self._process.stderr, self._q_stderr),
-            daemon=True,
-        )
-        self._t_stderr.start()
-
-        self._wait_till_started()
-        self._running = True
-
-    def stop(self):
-        if self._running:
-            self._process.kill()
-            self._stop_threads = True
-            self._t_stdout.join()
-            self._t_stderr.join()
-            self._running = False
-
-    def _reader_thread(self, pipe, q):
-        while not self._stop_threads:
-            q.put(pipe.readline())
+    def _popen_args(self) -> dict:
+        return {
+            "args": [str(self._ipython_path), "--classic"],
+            "cwd": self._working_dir,
+            "env": self._get_env(),
+        }
 
-    def _read_stdout(self, timeout: Optional[int]) -> Optional[str]:
-        start = time.time()
-        stdout = ""
-        while True:
-            try:
-                line = self._q_stdout.get(timeout=timeout)
-            except queue.Empty:
-                line = None
-            if timeout is not None and time.time() - start > timeout:
-                line = None
-
-            if line is None:
-                return None
-
-            if self._END_MESSAGE in line:
-                break
-            stdout += line
+    def _end_message_command(self) -> str:
+        return f"'{self._END_MESSAGE}'\n"
 
+    def _process_stdout(self, stdout: str) -> str:
         return stdout[len(self._INTERPRETER_PROMPT) :]
 
-    def _read_stderr(self) -> str:
-        stderr = ""
-        while not self._q_stderr.empty():
-            stderr += self._q_stderr.get()
-        return stderr
-
-    def _write_stdin(self, text: str):
-        self._p_stdin.write(text)
-        self._p_stdin.flush()
-
-    def _wait_till_started(self):
-        self._write_stdin(f"'{self._END_MESSAGE}'\n")
-        self._read_stdout(timeout=10)
-
-    def _create_script(self, script: str) -> Path:
-        lines = script.splitlines()
-        if len(lines) > 0:
-            is_eval = True
-            try:
-                compile(lines[-1], "<stdin>", "eval")
-            except SyntaxError:
-                is_eval = False
-            if is_eval:
-                lines[-1] = f"{self._LAST_VAR} = ({lines[-1]})"
-                lines.append(f"if {self._LAST_VAR} is not None:")
-                lines.append(f"    print({self._LAST_VAR})")
-
-        script = "\n".join(lines) + "\n"
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as f:
-            f.write(script)
-
-        return Path(f.name)
-
-    def _run_script(self, script_path: Path):
-        self._write_stdin(f"%run -i {script_path}\n'{self._END_MESSAGE}'\n")
-
-    def _fetch_result(self) -> Optional[str]:
-        stdout = self._read_stdout(timeout=self._timeout)
-        if stdout is None:
-            self.stop()
-            self._start()
-            return None
-
-        stderr = self._read_stderr()
-        return stdout + stderr
-
-    def run_cell(self, script: str) -> Optional[str]:
-        """Run the whole cell and return the last result.
-        Returns None if the interpreter timed out."""
-        script_path = self._create_script(script)
-        self._run_script(script_path)
-        result = self._fetch_result()
-        script_path.unlink()
-        return result
+    def _setup_command(self) -> str:
+        helper = _RUN_CELL_HELPER.replace("TABLE_MARKER", TABLE_MARKER).replace(
+            "PREVIEW_ROWS", str(PREVIEW_ROWS)
+        )
+        return f"exec({helper!r})\n"
+
+    def _cell_command(self, script: str, tables: Optional[str] = None) -> str:
+        # the cell travels as one length-prefixed string literal on a single
+        # line, so no file is written and IPython sees one complete statement
+        return (
+            f"{self._RUN_CELL}({len(script)}, {script!r}, {tables!r})\n"
+            f"'{self._END_MESSAGE}'\n"
+        )
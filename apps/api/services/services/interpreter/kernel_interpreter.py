@@ -0,0 +1,256 @@
+import asyncio
+import base64
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from queue import Empty
+from typing import Optional
+
+from .channel import OutputChannel
+from .output import (
+    FLUSH_INTERVAL,
+    FLUSH_SIZE,
+    OUTPUT_DIR,
+    OUTPUT_LINK,
+    OutputCallback,
+    OutputCapture,
+    cell_capture,
+    stream_output,
+)
+from .resources import CellUsage, ResourceLimits, UsageMeter
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+
+class KernelInterpreter:
+    """Runs cells in a local Jupyter kernel over the Jupyter messaging protocol.
+
+    Output arrives as structured stream, result, display and error messages
+    in the order it was produced, and a timed out cell is interrupted instead
+    of restarting the kernel. Values are shown by the kernel, so cells return
+    no tables. Requires the optional jupyter-client package and a kernel,
+    e.g. ipykernel ("python3") or IRkernel ("ir").
+    """
+
+    _START_TIMEOUT = 30
+    _INTERRUPT_TIMEOUT = 5
+    supports_tables = False
+
+    def __init__(
+        self,
+        *,
+        working_dir: Path = None,
+        kernel_name: str = "python3",
+        timeout: int = None,
+        output_limit: int = None,
+        limits: ResourceLimits = None,
+    ):
+        self._running = False
+        self.last_usage: Optional[CellUsage] = None
+        self.last_tables = []
+        self.last_output: Optional[str] = None
+        try:
+            from jupyter_client import KernelManager
+        except ImportError:
+            raise RuntimeError(
+                "The kernel interpreter requires jupyter-client, "
+                "install it with: pip install jupyter-client ipykernel"
+            )
+        self._working_dir = working_dir
+        self._timeout = timeout
+        self._output_limit = output_limit
+        self._limits = limits
+        self._manager = KernelManager(kernel_name=kernel_name)
+        self._start()
+
+    def __del__(self):
+        self.stop()
+
+    def _start(self):
+        kernel_args = {}
+        if self._working_dir is not None:
+            kernel_args["cwd"] = str(self._working_dir)
+        preexec_fn = self._limits.preexec_fn() if self._limits is not None else None
+        if preexec_fn is not None:
+            kernel_args["preexec_fn"] = preexec_fn
+        self._manager.start_kernel(**kernel_args)
+
+        self._client = self._manager.client()
+        self._client.start_channels()
+        self._client.wait_for_ready(timeout=self._START_TIMEOUT)
+
+        self._stop_thread = False
+        self._q_messages = OutputChannel()
+        self._t_messages = threading.Thread(target=self._reader_thread, daemon=True)
+        self._t_messages.start()
+        self._running = True
+
+    def stop(self):
+        if self._running:
+            self._stop_thread = True
+            self._t_messages.join()
+            self._client.stop_channels()
+            self._manager.shutdown_kernel(now=True)
+            self._running = False
+
+    def is_alive(self) -> bool:
+        return self._running and self._manager.is_alive()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return getattr(self._manager.provisioner, "pid", None) if self._running else None
+
+    @property
+    def language(self) -> str:
+        return self._manager.kernel_spec.language.lower()
+
+    def _reader_thread(self):
+        while not self._stop_thread:
+            try:
+                msg = self._client.get_iopub_msg(timeout=0.5)
+            except Empty:
+                continue
+            self._q_messages.put(msg)
+
+    def _new_capture(self, stream: bool = False) -> OutputCapture:
+        return cell_capture(self._working_dir, self._output_limit, stream)
+
+    def _format_data(self, data: dict) -> str:
+        if "image/png" in data and self._working_dir is not None:
+            output_dir = Path(self._working_dir) / OUTPUT_DIR
+            output_dir.mkdir(parents=True, exist_ok=True)
+            path = output_dir / f"display_{uuid.uuid4().hex}.png"
+            path.write_bytes(base64.b64decode(data["image/png"]))
+            return f"[{path.name}]({OUTPUT_LINK}/{path.name})\n"
+        return data.get("text/plain", "") + "\n"
+
+    def _handle_message(self, msg: dict, capture: OutputCapture) -> bool:
+        """Write the output of msg to capture, True once the cell finished."""
+        msg_type = msg["msg_type"]
+        content = msg["content"]
+        if msg_type == "stream":
+            capture.write(content["text"])
+        elif msg_type in ("execute_result", "display_data"):
+            capture.write(self._format_data(content["data"]))
+        elif msg_type == "error":
+            traceback = "\n".join(content["traceback"])
+            capture.write(_ANSI_ESCAPE.sub("", traceback) + "\n")
+        elif msg_type == "status":
+            return content["execution_state"] == "idle"
+        return False
+
+    def _is_idle(self, msg: dict, msg_id: str) -> bool:
+        return (
+            msg["parent_header"].get("msg_id") == msg_id
+            and msg["msg_type"] == "status"
+            and msg["content"]["execution_state"] == "idle"
+        )
+
+    def _wait_idle(self, msg_id: str, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            msg = self._q_messages.get(timeout=deadline - time.time())
+            if msg is None:
+                break
+            if self._is_idle(msg, msg_id):
+                return True
+        return False
+
+    async def _await_idle(self, msg_id: str, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            msg = await self._q_messages.aget(timeout=deadline - time.time())
+            if msg is None:
+                break
+            if self._is_idle(msg, msg_id):
+                return True
+        return False
+
+    def interrupt(self) -> bool:
+        """Interrupt the running cell, which then ends with the output so far."""
+        if not self.is_alive():
+            return False
+        self._manager.interrupt_kernel()
+        return True
+
+    def _interrupt_or_restart(self, msg_id: str):
+        """Interrupt the running cell, restart the kernel if it does not react."""
+        self.interrupt()
+        if not self._wait_idle(msg_id, self._INTERRUPT_TIMEOUT):
+            self._manager.restart_kernel(now=True)
+
+    async def _ainterrupt_or_restart(self, msg_id: str):
+        self.interrupt()
+        if not await self._await_idle(msg_id, self._INTERRUPT_TIMEOUT):
+            await asyncio.to_thread(self._manager.restart_kernel, now=True)
+
+    def _execute(self, script: str, tables: bool) -> str:
+        if tables:
+            raise ValueError("The kernel interpreter does not return tables")
+        self.last_output = None
+        return self._client.execute(script, store_history=False, allow_stdin=False)
+
+    def _handle_cell_message(self, msg: dict, msg_id: str, capture: OutputCapture) -> bool:
+        if msg["parent_header"].get("msg_id") != msg_id:
+            return False
+        return self._handle_message(msg, capture)
+
+    def run_cell(self, script: str, tables: bool = False) -> Optional[str]:
+        """Run the whole cell and return its output.
+        Returns None if the interpreter timed out. Raises ValueError with
+        tables, see supports_tables."""
+        msg_id = self._execute(script, tables)
+        capture = self._new_capture()
+        meter = UsageMeter(self.pid)
+        try:
+            start = time.time()
+            while True:
+                wait = None if self._timeout is None else self._timeout - (time.time() - start)
+                msg = self._q_messages.get(timeout=wait)
+                if msg is None:
+                    self._interrupt_or_restart(msg_id)
+                    return None
+                if self._handle_cell_message(msg, msg_id, capture):
+                    break
+
+            self.last_output = capture.getvalue()
+            return self.last_output
+        finally:
+            capture.close()
+            self.last_usage = meter.finish(self.pid)
+
+    async def arun_cell(
+        self,
+        script: str,
+        on_output: OutputCallback = None,
+        flush_interval: float = FLUSH_INTERVAL,
+        flush_size: int = FLUSH_SIZE,
+        tables: bool = False,
+    ) -> Optional[str]:
+        """Like run_cell, but waits for the output without blocking the event loop.
+        If on_output is given, all output is streamed to it while the cell
+        runs and only the output not streamed yet is returned."""
+        msg_id = self._execute(script, tables)
+        capture = self._new_capture(on_output is not None)
+        meter = UsageMeter(self.pid)
+        try:
+            finished = await stream_output(
+                self._q_messages.aget,
+                lambda msg: self._handle_cell_message(msg, msg_id, capture),
+                capture,
+                self._timeout,
+                on_output,
+                flush_interval,
+                flush_size,
+            )
+            if not finished:
+                await self._ainterrupt_or_restart(msg_id)
+                return None
+
+            self.last_output = capture.getvalue()
+            return capture.getvalue(skip_read=on_output is not None)
+        finally:
+            capture.close()
+            self.last_usage = meter.finish(self.pid)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Optional
+
+from pydantic import BaseModel
+
+from services.metrics import metrics
+
+
+class MemoEntry(BaseModel):
+    output: str
+    wall_seconds: float
+
+
+class CellMemo:
+    """Outputs of cells on disk, keyed by everything the output depends on.
+
+    The key of a cell hashes its source, the contents of all files in the
+    workspace and the state fingerprint of the session, which is the key of
+    the cell before, so a cell only hits after the same cells on the same
+    files. Next to the output, an entry holds the state of the interpreter
+    after the cell, saved as a snapshot, which a hit loads instead of running
+    the cell. The least recently used entries beyond max_bytes are removed.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self._directory = Path(directory)
+        self._max_bytes = max_bytes
+        # the entries are loaded into interpreters, keep them from user code
+        self._directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # path -> (mtime_ns, size, digest), so unchanged files are hashed once
+        self._file_hashes = {}
+
+    def _file_hash(self, path: Path) -> Optional[str]:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._file_hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+        except OSError:
+            return None
+        with self._lock:
+            self._file_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        return digest.hexdigest()
+
+    def workspace_files(self, working_dir: Path, exclude: Iterable[str] = ()) -> dict:
+        """Content hashes of the files in working_dir by relative path.
+        Hidden files and directories are left out, and the directories in
+        exclude at the top of working_dir."""
+        working_dir = Path(working_dir)
+        exclude = set(exclude)
+        files = {}
+        for root, dirs, names in os.walk(working_dir):
+            dirs[:] = [
+                name
+                for name in dirs
+                if not name.startswith(".")
+                and not (name in exclude and Path(root) == working_dir)
+            ]
+            for name in names:
+                if name.startswith("."):
+                    continue
+                path = Path(root) / name
+                digest = self._file_hash(path)
+                if digest is not None:
+                    files[path.relative_to(working_dir).as_posix()] = digest
+        return files
+
+    def cell_key(self, state: str, interpreter: str, script: str, files: dict) -> str:
+        """Hash of the cell, the workspace files and the state it runs in.
+        interpreter describes what a fresh interpreter holds."""
+        key = {
+            "state": state,
+            "interpreter": interpreter,
+            "script": script,
+            "files": files,
+        }
+        encoded = json.dumps(key, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self._directory / f"{key}.json"
+
+    def state_path(self, key: str) -> Path:
+        """Where the state of the interpreter after the cell of key is saved."""
+        return self._directory / f"{key}.state"
+
+    def get(self, key: str) -> Optional[MemoEntry]:
+        path = self._path(key)
+        try:
+            entry = MemoEntry.parse_raw(path.read_text(encoding="utf-8"))
+            os.utime(path)
+            os.utime(self.state_path(key))
+        except (OSError, ValueError):
+            metrics.increment("interpreter_memo.misses")
+            return None
+        metrics.increment("interpreter_memo.hits")
+        metrics.observe("interpreter_memo.saved_seconds", entry.wall_seconds)
+        return entry
+
+    def put(self, key: str, entry: MemoEntry):
+        """Store entry, once its state was saved to state_path(key)."""
+        path = self._path(key)
+        partial = path.with_name(f"{path.name}.{os.getpid()}.partial")
+        try:
+            partial.write_text(entry.json(), encoding="utf-8")
+            os.replace(partial, path)
+        except OSError:
+            return
+        metrics.increment("interpreter_memo.stores")
+        self._evict()
+
+    def discard(self, key: str):
+        for path in (self._path(key), self.state_path(key)):
+            path.unlink(missing_ok=True)
+
+    def _evict(self):
+        # the output and the state of an entry are evicted together
+        entries = {}
+        try:
+            for path in self._directory.iterdir():
+                if path.suffix not in (".json", ".state"):
+                    continue
+                stat = path.stat()
+                mtime, size = entries.get(path.stem, (0.0, 0))
+                entries[path.stem] = (max(mtime, stat.st_mtime), size + stat.st_size)
+        except OSError:
+            return
+        total = sum(size for _, size in entries.values())
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1]):
+            if total <= self._max_bytes:
+                break
+            try:
+                self.discard(key)
+            except OSError:
+                continue
+            total -= size
+            metrics.increment("interpreter_memo.evictions")
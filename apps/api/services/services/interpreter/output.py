@@ -0,0 +1,200 @@
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+# directory in the workspace which interpreters write output to, e.g. the
+# full output of a cell beyond the limit
+OUTPUT_DIR = "outputs"
+# how clients link to files in OUTPUT_DIR
+OUTPUT_LINK = f"sandbox:/workspace/{OUTPUT_DIR}"
+
+OutputCallback = Optional[Callable[[str], Awaitable[None]]]
+
+FLUSH_INTERVAL = 0.1
+FLUSH_SIZE = 4096
+
+
+class OutputCapture:
+    """Collects the output of one cell while keeping at most limit characters.
+
+    The first and the last limit / 2 characters are kept, everything in
+    between is replaced by an elision marker. With a spill_dir, the complete
+    output is also written to a file there once the limit is exceeded, and
+    the value links to it. Output is kept as a list of chunks, so writing
+    many lines does not copy the whole output each time. With stream, all
+    output is also kept until handed out by read_new, elided or not.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = None,
+        *,
+        spill_dir: Path = None,
+        spill_link: str = None,
+        stream: bool = False,
+    ):
+        self._limit = limit
+        self._head_limit = None if limit is None else limit - limit // 2
+        self._tail_limit = None if limit is None else limit // 2
+        self._spill_dir = spill_dir
+        self._spill_link = spill_link
+        self._head = []
+        self._head_size = 0
+        self._stream = stream
+        self._unread = []
+        self._tail = deque()
+        self._tail_size = 0
+        self._size = 0
+        self._spill_file = None
+        self._spill_path = None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def truncated(self) -> bool:
+        return self._limit is not None and self._size > self._limit
+
+    @property
+    def spill_path(self) -> Optional[Path]:
+        return self._spill_path
+
+    def write(self, text: str):
+        if not text:
+            return
+        self._size += len(text)
+        if self._stream:
+            self._unread.append(text)
+        if self._spill_file is not None:
+            self._spill_file.write(text)
+
+        if self._head_limit is None:
+            self._append_head(text)
+            return
+
+        head_room = self._head_limit - self._head_size
+        if head_room > 0:
+            self._append_head(text[:head_room])
+            text = text[head_room:]
+        if text:
+            self._tail.append(text)
+            self._tail_size += len(text)
+
+        if self.truncated:
+            if self._spill_file is None and self._spill_dir is not None:
+                self._start_spill()
+            while self._tail and self._tail_size - len(self._tail[0]) >= self._tail_limit:
+                self._tail_size -= len(self._tail.popleft())
+
+    def read_new(self) -> str:
+        """Return the output written since the last read_new, with stream."""
+        new = "".join(self._unread)
+        self._unread = []
+        return new
+
+    def getvalue(self, *, skip_read: bool = False) -> str:
+        """Return the captured output, truncated if it exceeded the limit.
+
+        With skip_read, only the output not handed out by read_new yet is
+        returned, in full."""
+        if skip_read:
+            return self.read_new()
+        head = "".join(self._head)
+        tail = "".join(self._tail)
+        if not self.truncated:
+            return head + tail
+
+        tail = tail[len(tail) - self._tail_limit :]
+        omitted = self._size - self._head_size - len(tail)
+        value = f"{head}\n... [{omitted} characters omitted] ...\n{tail}"
+        if self._spill_path is not None:
+            self._close_spill()
+            link = f"{self._spill_link}/{self._spill_path.name}"
+            value += f"\n[Full output]({link})\n"
+        return value
+
+    def close(self):
+        self._close_spill()
+
+    def _append_head(self, text: str):
+        if text:
+            self._head.append(text)
+            self._head_size += len(text)
+
+    def _start_spill(self):
+        try:
+            self._spill_dir.mkdir(parents=True, exist_ok=True)
+            path = self._spill_dir / f"output_{uuid.uuid4().hex}.txt"
+            self._spill_file = open(path, "w", encoding="utf-8")
+        except OSError:
+            self._spill_dir = None
+            return
+        self._spill_path = path
+        self._spill_file.write("".join(self._head))
+        self._spill_file.write("".join(self._tail))
+
+    def _close_spill(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+
+def cell_capture(
+    working_dir: Optional[Path], limit: Optional[int], stream: bool = False
+) -> OutputCapture:
+    """Capture for the output of a cell, spilling to OUTPUT_DIR in working_dir."""
+    spill_dir = None if working_dir is None else Path(working_dir) / OUTPUT_DIR
+    return OutputCapture(limit, spill_dir=spill_dir, spill_link=OUTPUT_LINK, stream=stream)
+
+
+async def stream_output(
+    next_item: Callable[[Optional[float]], Awaitable[Any]],
+    handle: Callable[[Any], bool],
+    capture: OutputCapture,
+    timeout: Optional[float],
+    on_output: OutputCallback = None,
+    flush_interval: float = FLUSH_INTERVAL,
+    flush_size: int = FLUSH_SIZE,
+    collect: Callable[[], str] = None,
+) -> bool:
+    """Pass the items of a running cell to handle until it returns True.
+
+    next_item waits up to the given seconds for an item and returns None if
+    none arrived. handle writes the output of an item to capture. Returns
+    False once timeout seconds passed. With on_output, new output in the
+    capture is passed on whenever flush_size characters were collected or
+    flush_interval seconds passed, after writing what collect returns, e.g.
+    the output on stderr."""
+    start = time.time()
+    last_flush = start
+    flushed_size = 0
+    while True:
+        now = time.time()
+        wait = None if timeout is None else timeout - (now - start)
+        if on_output is not None and capture.size > flushed_size:
+            until_flush = flush_interval - (now - last_flush)
+            wait = until_flush if wait is None else min(wait, until_flush)
+        item = await next_item(wait)
+
+        if item is None:
+            if timeout is not None and time.time() - start >= timeout:
+                return False
+        elif handle(item):
+            return True
+
+        if on_output is None or capture.size == flushed_size:
+            continue
+        if (
+            capture.size - flushed_size >= flush_size
+            or time.time() - last_flush >= flush_interval
+        ):
+            if collect is not None:
+                capture.write(collect())
+            flushed_size = capture.size
+            last_flush = time.time()
+            chunk = capture.read_new()
+            if chunk:
+                await on_output(chunk)
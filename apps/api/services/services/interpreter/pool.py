@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from services.metrics import metrics
+
+
+class InterpreterPool:
+    """Keeps started interpreters ready, so a session does not wait for a cold start.
+
+    Between min_size and max_size idle interpreters are kept. Every miss raises
+    the target size by one (up to max_size); idle interpreters above min_size
+    are stopped once they were unused for idle_ttl seconds. Handed out
+    interpreters are never returned, each session gets a fresh process and a
+    replacement is started in the background.
+    """
+
+    _RETRY_DELAY = 5.0
+
+    def __init__(
+        self,
+        factory: Callable,
+        *,
+        min_size: int = 0,
+        max_size: int = None,
+        idle_ttl: float = 300.0,
+    ):
+        self._factory = factory
+        self._min_size = min_size
+        self._max_size = max(min_size, max_size if max_size is not None else min_size)
+        self._idle_ttl = idle_ttl
+        self._target = min_size
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def acquire(self):
+        """Return a started interpreter, spawning one if the pool is empty."""
+        self.start()
+        with self._lock:
+            interpreter = None
+            while self._idle and interpreter is None:
+                _, candidate = self._idle.popleft()
+                if candidate.is_alive():
+                    interpreter = candidate
+                else:
+                    candidate.stop()
+            if interpreter is None and self._target < self._max_size:
+                self._target += 1
+            self._update_gauges()
+        self._wakeup.set()
+
+        if interpreter is not None:
+            metrics.increment("interpreter_pool.hits")
+            return interpreter
+        metrics.increment("interpreter_pool.misses")
+        return self._spawn()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            while self._idle:
+                _, interpreter = self._idle.popleft()
+                interpreter.stop()
+            self._update_gauges()
+
+    def start(self):
+        """Start filling the pool in the background, call it at startup so
+        the first session finds a started interpreter."""
+        with self._lock:
+            if self._thread is not None or self._max_size == 0:
+                return
+            self._thread = threading.Thread(target=self._refill_loop, daemon=True)
+            self._thread.start()
+
+    def _spawn(self):
+        start = time.monotonic()
+        interpreter = self._factory()
+        metrics.observe("interpreter_pool.spawn_seconds", time.monotonic() - start)
+        return interpreter
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while len(self._idle) > self._min_size:
+                idle_since, interpreter = self._idle[0]
+                if now - idle_since < self._idle_ttl:
+                    break
+                self._idle.popleft()
+                expired.append(interpreter)
+            self._target = max(self._min_size, self._target - len(expired))
+            self._update_gauges()
+        for interpreter in expired:
+            metrics.increment("interpreter_pool.evictions")
+            interpreter.stop()
+
+    def _refill_loop(self):
+        while not self._closed:
+            self._wakeup.clear()
+            self._evict_expired()
+            with self._lock:
+                missing = self._target - len(self._idle)
+            if missing <= 0:
+                self._wakeup.wait(timeout=max(1.0, min(self._idle_ttl, 60.0)))
+                continue
+
+            try:
+                interpreter = self._spawn()
+            except Exception:
+                logging.exception("Could not start pooled interpreter")
+                self._wakeup.wait(timeout=self._RETRY_DELAY)
+                continue
+
+            with self._lock:
+                if self._closed:
+                    interpreter.stop()
+                    return
+                self._idle.append((time.monotonic(), interpreter))
+                self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set("interpreter_pool.idle", len(self._idle))
+        metrics.set("interpreter_pool.target", self._target)
@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import logging
+import random
+import uuid
+from typing import List, Optional
+from urllib.parse import urlencode
+
+import websockets
+from fastapi import APIRouter, WebSocket
+
+from services.interpreter.session import ws_exceptions
+from services.metrics import metrics
+from services.utils import get_env_var
+
+# Interpreter supervisors which own the interpreters, separated by spaces,
+# e.g. "ws://127.0.0.1:8101 ws://127.0.0.1:8102"
+SUPERVISOR_URLS = get_env_var("INTERPRETER_SUPERVISOR_URLS", "").split()
+
+interpreter_proxy_router = APIRouter()
+agent_proxy_router = APIRouter()
+
+
+def shard_url(urls: List[str], session_id: Optional[str]) -> str:
+    """Return the supervisor which owns session_id.
+
+    The hash is stable across processes, so every API worker routes the
+    same session to the same supervisor. Sessions without an ID end with
+    their connection and can go anywhere."""
+    if session_id is None:
+        return random.choice(urls)
+    digest = hashlib.sha1(session_id.encode()).digest()
+    return urls[int.from_bytes(digest[:8], "big") % len(urls)]
+
+
+async def _client_to_upstream(websocket: WebSocket, upstream):
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        if message.get("bytes") is not None:
+            await upstream.send(message["bytes"])
+        else:
+            await upstream.send(message["text"])
+
+
+async def _upstream_to_client(upstream, websocket: WebSocket):
+    async for message in upstream:
+        if isinstance(message, bytes):
+            await websocket.send_bytes(message)
+        else:
+            await websocket.send_text(message)
+
+
+async def _relay(websocket: WebSocket, path: str):
+    """Relay the connection to the supervisor owning its session.
+
+    Frames are passed through unchanged, including the token, so the
+    supervisor authenticates the client like a single process would."""
+    params = dict(websocket.query_params)
+    session_id = params.get("session")
+    if session_id == "new":
+        # pick the ID here, so reconnects are routed to the same supervisor
+        session_id = params["session"] = uuid.uuid4().hex
+    url = f"{shard_url(SUPERVISOR_URLS, session_id)}{path}"
+    if params:
+        url += f"?{urlencode(params)}"
+
+    await websocket.accept()
+    try:
+        upstream = await websockets.connect(
+            url, origin=websocket.headers.get("origin"), max_size=None
+        )
+    except (OSError, websockets.exceptions.InvalidHandshake) as e:
+        logging.warning(f"Could not connect to interpreter supervisor {url}: {e}")
+        metrics.increment("interpreter_proxy.connect_errors")
+        try:
+            await websocket.send_text("Interpreter supervisor unavailable")
+            await websocket.close()
+        except (RuntimeError, *ws_exceptions):
+            pass
+        return
+
+    metrics.increment("interpreter_proxy.connections")
+    tasks = [
+        asyncio.create_task(_client_to_upstream(websocket, upstream)),
+        asyncio.create_task(_upstream_to_client(upstream, websocket)),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await upstream.close()
+        try:
+            await websocket.close()
+        except (RuntimeError, *ws_exceptions):
+            pass
+
+
+@interpreter_proxy_router.websocket("/run")
+async def run(websocket: WebSocket):
+    await _relay(websocket, "/api/interpreter/run")
+
+
+@agent_proxy_router.websocket("/run")
+async def run_agent(websocket: WebSocket):
+    await _relay(websocket, "/api/agent/run")
@@ -0,0 +1,221 @@
+import errno
+import locale
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from .r_packages import RPackages
+from .resources import ResourceLimits
+
+# Run by the server. Attaches the packages given as arguments, then forks a
+# session for every line "<fifo dir>\t<working dir>" on stdin. A session
+# writes its pid to the directory, then talks over the FIFOs stdin, stdout
+# and stderr there with a small read-eval-print loop, as it cannot take over
+# the standard streams of the server. The loop reads each input as a line
+# with its number of lines followed by these lines, see frame_input, so an
+# input is parsed once however many lines it has.
+_SERVER_SCRIPT = r"""
+Sys.setenv(LANGUAGE = "en")
+for (package in commandArgs(trailingOnly = TRUE)) {
+    tryCatch(
+        suppressPackageStartupMessages(library(package, character.only = TRUE)),
+        error = function(e) message("Could not preload ", package, ": ", conditionMessage(e))
+    )
+}
+
+.rpilot_session <- function(dir, working_dir) {
+    pid_file <- file.path(dir, "pid.partial")
+    writeLines(as.character(Sys.getpid()), pid_file)
+    file.rename(pid_file, file.path(dir, "pid"))
+    input <- fifo(file.path(dir, "stdin"), "r", blocking = TRUE)
+    output <- fifo(file.path(dir, "stdout"), "w", blocking = TRUE)
+    messages <- fifo(file.path(dir, "stderr"), "w", blocking = TRUE)
+    sink(output)
+    sink(messages, type = "message")
+    setwd(working_dir)
+
+    repeat {
+        header <- tryCatch(readLines(input, n = 1, warn = FALSE), interrupt = function(e) "")
+        if (length(header) == 0) break
+        n <- suppressWarnings(as.integer(header))
+        if (is.na(n)) next
+        lines <- readLines(input, n = n, warn = FALSE)
+        if (length(lines) < n) break
+        exprs <- tryCatch(parse(text = lines, keep.source = FALSE), error = function(e) e)
+        if (inherits(exprs, "error")) {
+            message("Error: ", conditionMessage(exprs))
+            next
+        }
+        for (expr in exprs) {
+            result <- tryCatch(
+                withVisible(eval(expr, envir = globalenv())),
+                error = function(e) {
+                    message("Error: ", conditionMessage(e))
+                    NULL
+                },
+                interrupt = function(e) NULL
+            )
+            if (!is.null(result) && result$visible) print(result$value)
+        }
+        flush(output)
+    }
+}
+
+requests <- file("stdin", "r")
+repeat {
+    request <- readLines(requests, n = 1)
+    if (length(request) == 0) break
+    fields <- strsplit(request, "\t", fixed = TRUE)[[1]]
+    child <- parallel:::mcfork(estranged = TRUE)
+    if (inherits(child, "masterProcess")) {
+        close(requests)
+        tryCatch(.rpilot_session(fields[1], fields[2]), finally = parallel:::mcexit(0L))
+    }
+}
+"""
+
+
+def frame_input(code: str) -> str:
+    """Prefix code with its number of lines, as forked sessions read it."""
+    # R ends lines at "\r" too
+    code = code.replace("\r\n", "\n").replace("\r", "\n")
+    if not code.endswith("\n"):
+        code += "\n"
+    return f"{code.count(chr(10))}\n{code}"
+
+
+class ForkedProcess:
+    """The part of subprocess.Popen which BaseInterpreter uses, for a session
+    forked by the server. It is not our child, so there is no exit code."""
+
+    def __init__(self, pid: int, directory: Path, stdin, stdout, stderr):
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self._directory = directory
+
+    def poll(self) -> Optional[int]:
+        try:
+            os.kill(self.pid, 0)
+            with open(f"/proc/{self.pid}/stat") as stat:
+                # a zombie waits to be reaped by the server
+                state = stat.read().rpartition(")")[2].split()[0]
+        except ProcessLookupError:
+            return -1
+        except OSError:
+            return None
+        return -1 if state == "Z" else None
+
+    def send_signal(self, sig: int):
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def wait(self, timeout: float = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired(f"R session {self.pid}", timeout)
+            time.sleep(0.01)
+        shutil.rmtree(self._directory, ignore_errors=True)
+        return -1
+
+
+class RForkServer:
+    """An R process which attaches packages once and forks sessions from it.
+
+    Sessions share the memory of the server copy-on-write, so the packages
+    cost neither load time nor memory per session. The server starts with
+    the first session and is restarted if it died. Output which bypasses
+    R's connections, like printf from C code, is not captured. Not available
+    on Windows, which cannot fork.
+    """
+
+    _FORK_TIMEOUT = 60  # includes loading the packages on first use
+
+    def __init__(
+        self,
+        r_path: Path = None,
+        packages: list[str] = (),
+        limits: ResourceLimits = None,
+        r_packages: RPackages = None,
+    ):
+        self._r_path = r_path or Path("Rscript")
+        self._packages = list(packages)
+        self._limits = limits
+        # preloaded packages may come from the shared library
+        self._r_packages = r_packages or RPackages()
+        self._lock = threading.Lock()
+        self._process = None
+
+    def _ensure_started(self) -> subprocess.Popen:
+        if self._process is None or self._process.poll() is not None:
+            preexec_fn = self._limits.preexec_fn() if self._limits is not None else None
+            self._r_packages.prepare()
+            script = self._r_packages.setup_command() + _SERVER_SCRIPT
+            self._process = subprocess.Popen(
+                [str(self._r_path), "--vanilla", "--quiet", "--slave",
+                 "-e", script, "--args", *self._packages],
+                preexec_fn=preexec_fn,
+                text=True,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+            )
+        return self._process
+
+    def fork(self, working_dir: Path) -> ForkedProcess:
+        """Fork a session running in working_dir."""
+        directory = Path(tempfile.mkdtemp(prefix="rpilot-r-"))
+        for name in ("stdin", "stdout", "stderr"):
+            os.mkfifo(directory / name, 0o600)
+        with self._lock:
+            server = self._ensure_started()
+            server.stdin.write(f"{directory}\t{Path(working_dir).resolve()}\n")
+            server.stdin.flush()
+
+        try:
+            stdin_fd = self._open_stdin(directory / "stdin", server)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        # the session opens its FIFOs in this order, so these opens finish
+        encoding = locale.getpreferredencoding(False)
+        stdin = open(stdin_fd, "w", encoding=encoding)
+        stdout = open(directory / "stdout", encoding=encoding)
+        stderr = open(directory / "stderr", encoding=encoding)
+        pid = int((directory / "pid").read_text())
+        return ForkedProcess(pid, directory, stdin, stdout, stderr)
+
+    def _open_stdin(self, path: Path, server: subprocess.Popen) -> int:
+        """Open the stdin FIFO once the session opened it for reading."""
+        deadline = time.monotonic() + self._FORK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+            else:
+                os.set_blocking(fd, True)
+                return fd
+            if server.poll() is not None:
+                raise RuntimeError("The R fork server exited")
+            if time.monotonic() > deadline:
+                raise TimeoutError("The R fork server did not start a session")
+            time.sleep(0.01)
+
+    def stop(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
@@ -1,17 +1,94 @@
 import os
 import sys
 from pathlib import Path
-from typing import Optional
-import tempfile
-import time
-import queue
 import subprocess
-import threading
+from typing import Optional
 
+from .base import BaseInterpreter
+from .r_fork_server import RForkServer, frame_input
+from .r_packages import RPackages
+from .resources import ResourceLimits
+from .tables import PREVIEW_ROWS, TABLE_MARKER
+
+
+# Defined in the interpreter on start. Evaluates a cell in the global
+# environment and prints its last value. With a tables directory, a data
+# frame value is written there as an Arrow IPC stream if the arrow package
+# is installed, and only a preview of it is printed.
+_RUN_CELL_HELPER = """
+.rpilot_table <- function(value, directory) {
+    if (!is.data.frame(value) || !requireNamespace("arrow", quietly = TRUE)) {
+        return(FALSE)
+    }
+    path <- tempfile("table_", tmpdir = directory, fileext = ".arrow")
+    arrow::write_ipc_stream(value, path)
+    cat("TABLE_MARKER", nrow(value), " ", ncol(value), " ", path, " __\\n", sep = "")
+    print(utils::head(value, PREVIEW_ROWS))
+    cat("[", nrow(value), " rows x ", ncol(value),
+        " columns, sent to the user as a table]\\n", sep = "")
+    TRUE
+}
+
+.rpilot_run_cell <- function(length, chunks, tables = NULL) {
+    code <- paste0(chunks, collapse = "")
+    if (nchar(code, type = "chars") != length) {
+        cat("Error: received ", nchar(code, type = "chars"), " of ", length,
+            " characters of the cell\\n", sep = "")
+    } else {
+        # Suppress file connection warnings
+        options(warn = -1)
+        value <- tryCatch({
+            value <- NULL
+            for (expr in parse(text = code, keep.source = FALSE)) {
+                value <- eval(expr, envir = globalenv())
+            }
+            value
+        }, error = function(e) {
+            cat("Error: ", conditionMessage(e), "\\n", sep = "")
+            NULL
+        }, interrupt = function(e) {
+            cat("Interrupted\\n")
+            NULL
+        })
+        if (!is.null(value)) {
+            tryCatch({
+                if (is.null(tables) || !.rpilot_table(value, tables)) print(value)
+            }, error = function(e) {
+                cat("Error: ", conditionMessage(e), "\\n", sep = "")
+            })
+        }
+    }
+    cat("END_MESSAGE\\n")
+    invisible(NULL)
+}
+"""
+
+_R_ESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def _r_string(text: str) -> str:
+    """Quote text as an ASCII-only R string literal."""
+    escaped = []
+    for char in text:
+        if char in _R_ESCAPES:
+            escaped.append(_R_ESCAPES[char])
+        elif char == "\0":
+            continue  # R strings cannot contain NUL
+        elif " " <= char <= "~":
+            escaped.append(char)
+        else:
+            escaped.append(f"\\U{{{ord(char):x}}}")
+    return '"' + "".join(escaped) + '"'
+
+
+class RInterpreter(BaseInterpreter):
+    """R session, either its own Rscript process or forked by fork_server,
+    in which case limits are those of the server. packages configures where
+    install.packages installs from and to."""
 
-class RInterpreter:
-    _END_MESSAGE = "__ INTERPRETER END OF EXECUTION __"
-    _LAST_VAR = ".Last.value"
+    language = "r"
+    _RUN_CELL = ".rpilot_run_cell"
+    _CHUNK_SIZE = 256
 
     def __init__(
         self,
@@ -19,179 +96,79 @@ class RInterpreter:
         working_dir: Path = None,
         r_path: Path = None,
         timeout: int = None,
+        output_limit: int = None,
+        limits: ResourceLimits = None,
+        fork_server: RForkServer = None,
+        packages: RPackages = None,
     ):
         # Set working directory to the web public workspace directory
         if working_dir is None:
             root_dir = Path(__file__).parent.parent.parent.parent.parent.parent  # Up to project root
-            self._working_dir = root_dir / "apps" / "web" / "public" / "workspace"
-        else:
-            self._working_dir = working_dir
-            
+            working_dir = root_dir / "apps" / "web" / "public" / "workspace"
+        super().__init__(
+            working_dir=working_dir,
+            timeout=timeout,
+            output_limit=output_limit,
+            limits=limits,
+        )
+
         if r_path is None:
             # Default to system R installation
             self._r_path = Path("Rscript")
         else:
             self._r_path = r_path
-        self._timeout = timeout
-        self._running = False
+        self._fork_server = fork_server
+        self._packages = packages or RPackages()
+        self._packages.prepare()
         self._start()
 
-    def __del__(self):
-        self.stop()
+    def _spawn(self):
+        if self._fork_server is None:
+            return super()._spawn()
+        os.makedirs(self._working_dir, exist_ok=True)
+        return self._fork_server.fork(self._working_dir)
+
+    def _write_stdin(self, text: str):
+        if self._fork_server is not None:
+            text = frame_input(text)
+        super()._write_stdin(text)
 
-    def _start(self):
-        is_windows = sys.platform == "win32"
-        
+    def _popen_args(self) -> dict:
         # Ensure working directory exists
         os.makedirs(self._working_dir, exist_ok=True)
-        
+
         # Base Popen arguments that work on all platforms
         popen_args = {
             "args": [str(self._r_path), "--vanilla", "--quiet", "--slave"],
-            "text": True,
             "cwd": str(self._working_dir),  # Convert Path to string
             "env": os.environ.copy(),
-            "stdin": subprocess.PIPE,
-            "stdout": subprocess.PIPE,
-            "stderr": subprocess.PIPE
         }
-        
+
         # Add Windows-specific flags if needed
-        if is_windows:
+        if sys.platform == "win32":
             popen_args["creationflags"] = subprocess.CREATE_NO_WINDOW
-        
-        self._process = subprocess.Popen(**popen_args)
-        self._p_stdin = self._process.stdin
 
-        self._stop_threads = False
+        return popen_args
 
-        self._q_stdout = queue.Queue()
-        self._t_stdout = threading.Thread(
-            target=self._reader_thread,
-            args=(self._process.stdout, self._q_stdout),
-            daemon=True,
-        )
-        self._t_stdout.start()
+    def _end_message_command(self) -> str:
+        return f'cat("{self._END_MESSAGE}\\n")\n'
 
-        self._q_stderr = queue.Queue()
-        self._t_stderr = threading.Thread(
-            target=self._reader_thread,
-            args=(self._process.stderr, self._q_stderr),
-            daemon=True,
+    def _setup_command(self) -> str:
+        helper = (
+            _RUN_CELL_HELPER.replace("END_MESSAGE", self._END_MESSAGE)
+            .replace("TABLE_MARKER", TABLE_MARKER)
+            .replace("PREVIEW_ROWS", str(PREVIEW_ROWS))
+        )
+        return self._packages.setup_command() + helper
+
+    def _cell_command(self, script: str, tables: Optional[str] = None) -> str:
+        # the cell is sent as a length-prefixed vector of short string
+        # literals, so no file is written and no console line gets too long
+        pieces = [
+            _r_string(script[i : i + self._CHUNK_SIZE])
+            for i in range(0, len(script), self._CHUNK_SIZE)
+        ]
+        tables = "NULL" if tables is None else _r_string(tables)
+        return (
+            f"{self._RUN_CELL}({len(script)}, c(\n" + ",\n".join(pieces) + f"\n), {tables})\n"
         )
-        self._t_stderr.start()
-
-        self._wait_till_started()
-        self._running = True
-
-    def stop(self):
-        if self._running:
-            self._process.kill()
-            self._stop_threads = True
-            self._t_stdout.join()
-            self._t_stderr.join()
-            self._running = False
-
-    def _reader_thread(self, pipe, q):
-        while not self._stop_threads:
-            line = pipe.readline()
-            if line:
-                q.put(line)
-
-    def _read_stdout(self, timeout: Optional[int]) -> Optional[str]:
-        start = time.time()
-        stdout = ""
-        while True:
-            try:
-                line = self._q_stdout.get(timeout=timeout)
-            except queue.Empty:
-                line = None
-            if timeout is not None and time.time() - start > timeout:
-                line = None
-
-            if line is None:
-                return None
-
-            if self._END_MESSAGE in line:
-                break
-            stdout += line
-
-        return stdout
-
-    def _read_stderr(self) -> str:
-        stderr = ""
-        while not self._q_stderr.empty():
-            stderr += self._q_stderr.get()
-        return stderr
-
-    def _write_stdin(self, text: str):
-        self._p_stdin.write(text)
-        self._p_stdin.flush()
-
-    def _wait_till_started(self):
-        self._write_stdin(f'cat("{self._END_MESSAGE}\\n")\n')
-        self._read_stdout(timeout=10)
-
-    def _create_script(self, script: str) -> Path:
-        is_windows = sys.platform == "win32"
-        
-        # Create a temporary directory in the working directory
-        temp_dir = os.path.join(str(self._working_dir), "temp")
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Generate a unique filename
-        timestamp = str(int(time.time() * 1000))
-        filename = f"script_{timestamp}.R"
-        script_path = os.path.join(temp_dir, filename)
-        
-        # Write the script
-        with open(script_path, "w", encoding="utf-8") as f:
-            f.write(self._wrap_script(script))
-        
-        return Path(script_path)
-
-    def _wrap_script(self, script: str) -> str:
-        return f"""
-        # Suppress file connection warnings
-        options(warn = -1)
-        .Last.value <- tryCatch({{
-            {script}
-        }}, error = function(e) {{
-            cat("Error: ", e$message, "\\n", sep="")
-            NULL
-        }})
-        if (!is.null(.Last.value)) {{
-            print(.Last.value)
-        }}
-        cat("{self._END_MESSAGE}\\n")
-        """
-
-    def _run_script(self, script_path: Path):
-        # Convert path to a string with forward slashes
-        path_str = str(script_path).replace("\\", "/")
-        self._write_stdin(f'source("{path_str}")\n')
-
-    def _fetch_result(self) -> Optional[str]:
-        stdout = self._read_stdout(timeout=self._timeout)
-        if stdout is None:
-            self.stop()
-            self._start()
-            return None
-
-        stderr = self._read_stderr()
-        return stdout + stderr
-
-    def run_cell(self, script: str) -> Optional[str]:
-        """Run the R code and return the result.
-        Returns None if the interpreter timed out."""
-        script_path = self._create_script(script)
-        try:
-            self._run_script(script_path)
-            result = self._fetch_result()
-        finally:
-            try:
-                if script_path.exists():
-                    script_path.unlink()
-            except:
-                pass  # Ignore cleanup errors
-        return result
@@ -0,0 +1,90 @@
+import json
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel
+
+# Run in every R session. Attaches an install.packages which installs into
+# the shared library, skips packages installed already and keeps the
+# downloaded sources in the local repository, so the next install of them
+# needs no network access. Follows the definitions of site_library, contrib
+# and repository in local(), see RPackages.setup_command.
+_SHARED_SETUP = """
+    .libPaths(c(site_library, .libPaths()))
+    packages <- new.env()
+    packages$install.packages <- function(pkgs, lib = site_library,
+                                          repos = getOption("repos"),
+                                          destdir = contrib, ...,
+                                          force = FALSE) {
+        if (!force) {
+            installed <- pkgs %in% rownames(utils::installed.packages())
+            for (package in pkgs[installed]) {
+                message("Package '", package, "' is already installed")
+            }
+            pkgs <- pkgs[!installed]
+        }
+        if (length(pkgs) == 0) return(invisible(NULL))
+        repos <- c(local = repository, repos)
+        repos <- repos[!duplicated(unname(repos))]
+        utils::install.packages(pkgs, lib = lib, repos = repos, destdir = destdir, ...)
+        tools::write_PACKAGES(destdir, type = "source")
+        invisible(NULL)
+    }
+    if ("rpilot:packages" %in% search()) detach("rpilot:packages")
+    attach(packages, name = "rpilot:packages", warn.conflicts = FALSE)
+})
+"""
+
+
+def _r_quote(text: str) -> str:
+    return json.dumps(text, ensure_ascii=False)
+
+
+class RPackages(BaseModel):
+    """Where R sessions install packages from and to.
+
+    With a directory, packages are installed into its "library", shared by
+    all sessions, and their sources kept in "repository", a CRAN-like
+    repository which is searched before the mirror. Offline, only that
+    repository is used.
+    """
+
+    directory: Optional[Path] = None
+    mirror: str = "https://cloud.r-project.org"
+    offline: bool = False
+
+    @property
+    def library(self) -> Optional[Path]:
+        return None if self.directory is None else self.directory / "library"
+
+    @property
+    def repository(self) -> Optional[Path]:
+        return None if self.directory is None else self.directory / "repository"
+
+    def prepare(self):
+        """Create the library and an empty repository if they do not exist."""
+        if self.directory is None:
+            return
+        self.library.mkdir(parents=True, exist_ok=True)
+        contrib = self.repository / "src" / "contrib"
+        contrib.mkdir(parents=True, exist_ok=True)
+        (contrib / "PACKAGES").touch()
+
+    def setup_command(self) -> str:
+        """R code which configures a session for these packages."""
+        repos = []
+        if self.directory is not None:
+            repos.append(f"local = {_r_quote(self.repository.resolve().as_uri())}")
+        if not self.offline:
+            repos.append(f"CRAN = {_r_quote(self.mirror)}")
+        command = f"options(repos = c({', '.join(repos)}))\n"
+        if self.directory is not None:
+            contrib = self.repository.resolve() / "src" / "contrib"
+            command += (
+                "local({\n"
+                f"    site_library <- {_r_quote(str(self.library.resolve()))}\n"
+                f"    contrib <- {_r_quote(str(contrib))}\n"
+                f"    repository <- {_r_quote(self.repository.resolve().as_uri())}"
+                + _SHARED_SETUP
+            )
+        return command
@@ -0,0 +1,146 @@
+import codecs
+import io
+import locale
+import logging
+import os
+import selectors
+import threading
+from typing import Callable
+
+from .channel import OutputChannel
+
+_READ_SIZE = 65536
+_UNREGISTER_TIMEOUT = 1.0
+
+
+class _PipeReader:
+    """Splits what arrives on one pipe into lines for its channel.
+
+    Decoding and newline translation match a text mode pipe. An incomplete
+    last line is kept until the rest of it arrives or the pipe ends."""
+
+    def __init__(self, channel: OutputChannel):
+        self._channel = channel
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(
+            errors="replace"
+        )
+        self._decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+        self._partial = ""
+
+    def feed(self, data: bytes):
+        text = self._partial + self._decoder.decode(data, final=not data)
+        lines = text.splitlines(keepends=True)
+        self._partial = ""
+        if data and lines and not lines[-1].endswith("\n"):
+            self._partial = lines.pop()
+        if lines:
+            self._channel.put_many(lines)
+
+
+class PipeReactor:
+    """One thread which reads the output pipes of all interpreters.
+
+    Pipes are non-blocking and read in large chunks whenever the selector
+    (epoll on Linux) reports them readable, the lines go to the channel of
+    each pipe. A pipe is unregistered at EOF, so a dead process costs
+    nothing. Registration from other threads goes through a wake-up pipe,
+    unregister returns once the reactor no longer touches the pipe.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name="pipe-reactor", daemon=True)
+        self._thread.start()
+
+    @property
+    def registered(self) -> int:
+        return len(self._selector.get_map()) - 1
+
+    def register(self, pipe, channel: OutputChannel):
+        """Put the lines of pipe into channel until it ends."""
+        fd = pipe.fileno()
+        os.set_blocking(fd, False)
+        reader = _PipeReader(channel)
+        self._submit(lambda: self._selector.register(fd, selectors.EVENT_READ, reader))
+
+    def unregister(self, pipe):
+        """Stop reading pipe, the caller may close it afterwards."""
+        fd = pipe.fileno()
+        done = threading.Event()
+
+        def remove():
+            try:
+                self._selector.unregister(fd)
+            except (KeyError, ValueError):
+                pass  # already at EOF
+            done.set()
+
+        if threading.current_thread() is self._thread or not self._thread.is_alive():
+            remove()
+            return
+        self._submit(remove)
+        if not done.wait(_UNREGISTER_TIMEOUT):
+            # the reactor is a daemon thread, which no longer runs while the
+            # process exits, so nothing reads the pipe anymore
+            remove()
+
+    def _submit(self, operation: Callable[[], None]):
+        with self._lock:
+            self._pending.append(operation)
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass  # a wake-up is pending anyway
+
+    def _run_pending(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for operation in pending:
+            try:
+                operation()
+            except Exception:
+                logging.exception("Pipe reactor operation failed")
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.fd == self._wake_r:
+                    self._run_pending()
+                    continue
+                if self._selector.get_map().get(key.fd) is not key:
+                    continue  # unregistered by a pending operation, maybe closed
+                reader: _PipeReader = key.data
+                try:
+                    data = os.read(key.fd, _READ_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+                if not data:
+                    self._selector.unregister(key.fd)
+                # at EOF, the last line is passed on even without a newline
+                reader.feed(data)
+
+
+_reactor = None
+_reactor_lock = threading.Lock()
+
+
+def get_reactor() -> PipeReactor:
+    """The reactor of this process, started on first use."""
+    global _reactor
+    with _reactor_lock:
+        if _reactor is None:
+            _reactor = PipeReactor()
+        return _reactor
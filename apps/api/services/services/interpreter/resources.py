@@ -0,0 +1,111 @@
+import os
+import time
+from typing import Callable, Optional
+
+from pydantic import BaseModel
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class ResourceLimits(BaseModel):
+    """rlimits applied to an interpreter process, None means unlimited.
+
+    cpu_seconds is the CPU time of the whole interpreter process, not of one
+    cell, and processes counts all processes of the user the API runs as.
+    """
+
+    memory: Optional[int] = None  # bytes of address space
+    cpu_seconds: Optional[int] = None
+    processes: Optional[int] = None
+    open_files: Optional[int] = None
+
+    def preexec_fn(self) -> Optional[Callable[[], None]]:
+        """A function for subprocess.Popen which applies the limits in the child."""
+        if resource is None:
+            return None
+        limits = [
+            (resource.RLIMIT_AS, self.memory),
+            (resource.RLIMIT_CPU, self.cpu_seconds),
+            (resource.RLIMIT_NPROC, self.processes),
+            (resource.RLIMIT_NOFILE, self.open_files),
+        ]
+        limits = [(kind, value) for kind, value in limits if value]
+        if not limits:
+            return None
+
+        def apply():
+            for kind, value in limits:
+                resource.setrlimit(kind, (value, value))
+
+        return apply
+
+
+class CellUsage(BaseModel):
+    wall_seconds: float
+    cpu_seconds: Optional[float] = None
+    peak_rss: Optional[int] = None  # bytes, over the lifetime of the process
+
+
+def _cpu_seconds(pid: Optional[int]) -> Optional[float]:
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # the command name may contain spaces, the fields follow its ")"
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    # utime and stime are fields 14 and 15 of the whole line
+    return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+
+
+def _peak_rss(pid: Optional[int]) -> Optional[int]:
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class UsageMeter:
+    """Measures the resources one cell used, from /proc where available."""
+
+    def __init__(self, pid: Optional[int]):
+        self._pid = pid
+        self._start = time.monotonic()
+        self._cpu_start = _cpu_seconds(pid)
+
+    def finish(self, pid: Optional[int]) -> CellUsage:
+        usage = CellUsage(wall_seconds=time.monotonic() - self._start)
+        # a restarted interpreter has a new process, its CPU time is not comparable
+        if pid == self._pid:
+            cpu_end = _cpu_seconds(pid)
+            if cpu_end is not None and self._cpu_start is not None:
+                usage.cpu_seconds = cpu_end - self._cpu_start
+            usage.peak_rss = _peak_rss(pid)
+        return usage
+
+
+class SessionUsage(BaseModel):
+    cells: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss: Optional[int] = None
+
+    def add(self, usage: CellUsage):
+        self.cells += 1
+        self.wall_seconds += usage.wall_seconds
+        if usage.cpu_seconds is not None:
+            self.cpu_seconds += usage.cpu_seconds
+        if usage.peak_rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, usage.peak_rss)
@@ -1,32 +1,108 @@
+import asyncio
+import json
+import logging
+import sys
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Union
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from websockets.exceptions import ConnectionClosedError
+from fastapi import APIRouter, FastAPI, WebSocket
 
 from services.interpreter import IPythonInterpreter
+from services.interpreter.base import BaseInterpreter
+from services.interpreter.kernel_interpreter import KernelInterpreter
+from services.interpreter.memo import CellMemo, MemoEntry
+from services.interpreter.output import OUTPUT_DIR
+from services.interpreter.r_fork_server import RForkServer
 from services.interpreter.r_interpreter import RInterpreter
+from services.interpreter.r_packages import RPackages
+from services.interpreter.pool import InterpreterPool
+from services.interpreter.resources import ResourceLimits
+from services.interpreter.session import Session, SessionRegistry, ws_exceptions
+from services.interpreter.snapshot import load_snapshot, save_snapshot
+from services.interpreter.tables import TABLE_FORMAT, CellTable
+from services.metrics import metrics
 from services.utils import get_env_var
 from services.auth import verify_websocket
 
 
 WORKING_DIRECTORY = Path(get_env_var("WORKING_DIRECTORY"))
-INTERPRETER_TYPE = get_env_var("INTERPRETER_TYPE", "r").lower()  # "r" or "python", defaults to "r"
+INTERPRETER_TYPE = get_env_var("INTERPRETER_TYPE", "r").lower()  # "r", "python" or "kernel", defaults to "r"
 R_PATH = Path(get_env_var("R_PATH")) if INTERPRETER_TYPE == "r" else None
 IPYTHON_PATH = Path(get_env_var("IPYTHON_PATH")) if INTERPRETER_TYPE == "python" else None
+KERNEL_NAME = get_env_var("KERNEL_NAME", "python3")  # Jupyter kernel used by the "kernel" type
 TIMEOUT = int(get_env_var("INTERPRETER_TIMEOUT", "120"))  # Default timeout increased to 120 seconds
 TIMEOUT_MESSAGE = "ERROR: TIMEOUT REACHED"
+INTERRUPT_MESSAGE = "_interrupt_"
+SNAPSHOT_MESSAGE = "_snapshot_"
+OUTPUT_LIMIT = int(get_env_var("INTERPRETER_OUTPUT_LIMIT", "20000"))
+POOL_MIN_SIZE = int(get_env_var("INTERPRETER_POOL_MIN_SIZE", "0"))
+POOL_MAX_SIZE = int(get_env_var("INTERPRETER_POOL_MAX_SIZE", str(POOL_MIN_SIZE)))
+POOL_IDLE_TTL = float(get_env_var("INTERPRETER_POOL_IDLE_TTL", "300"))
+STREAM_FLUSH_INTERVAL = float(get_env_var("INTERPRETER_STREAM_FLUSH_INTERVAL", "0.1"))
+STREAM_FLUSH_SIZE = int(get_env_var("INTERPRETER_STREAM_FLUSH_SIZE", "4096"))
+SESSION_IDLE_TTL = float(get_env_var("INTERPRETER_SESSION_IDLE_TTL", "600"))
+SESSION_REPLAY_LIMIT = int(get_env_var("INTERPRETER_SESSION_REPLAY_LIMIT", "1000000"))
+# rlimits of every interpreter process, 0 means unlimited
+MEMORY_LIMIT_MB = int(get_env_var("INTERPRETER_MEMORY_LIMIT_MB", "0"))
+CPU_LIMIT = int(get_env_var("INTERPRETER_CPU_LIMIT", "0"))
+PROCESS_LIMIT = int(get_env_var("INTERPRETER_PROCESS_LIMIT", "0"))
+OPEN_FILES_LIMIT = int(get_env_var("INTERPRETER_OPEN_FILES_LIMIT", "0"))
+ENABLE_SNAPSHOTS = get_env_var("INTERPRETER_SNAPSHOTS", "FALSE") == "TRUE"
+# outside the workspace, snapshots are loaded into interpreters
+SNAPSHOT_DIR = Path(
+    get_env_var("INTERPRETER_SNAPSHOT_DIR", str(Path.home() / ".rpilot" / "snapshots"))
+)
+# tables larger than this are only shown as their preview
+TABLE_MAX_BYTES = int(get_env_var("INTERPRETER_TABLE_MAX_BYTES", str(256 * 1024 * 1024)))
+# fork R sessions from one process with these packages attached, not on Windows
+R_FORK_SERVER = get_env_var("R_FORK_SERVER", "FALSE") == "TRUE" and sys.platform != "win32"
+R_PRELOAD_PACKAGES = get_env_var("R_PRELOAD_PACKAGES", "").split()
+# library and package repository shared by all R sessions, e.g. /var/lib/rpilot/r
+R_PACKAGE_DIR = get_env_var("R_PACKAGE_DIR", "")
+R_CRAN_MIRROR = get_env_var("R_CRAN_MIRROR", "https://cloud.r-project.org")
+R_PACKAGES_OFFLINE = get_env_var("R_PACKAGES_OFFLINE", "FALSE") == "TRUE"
+# answer cells run before in the same state on the same files from a cache
+ENABLE_MEMO = get_env_var("INTERPRETER_MEMO", "FALSE") == "TRUE"
+# outside the workspace, as hits load the interpreter state saved there
+MEMO_DIR = Path(get_env_var("INTERPRETER_MEMO_DIR", str(Path.home() / ".rpilot" / "memo")))
+MEMO_MAX_MB = int(get_env_var("INTERPRETER_MEMO_MAX_MB", "512"))
+# cells which run faster than this are not worth keeping
+MEMO_MIN_SECONDS = float(get_env_var("INTERPRETER_MEMO_MIN_SECONDS", "1"))
 
 
 interpreter_router = APIRouter()
 
+limits = ResourceLimits(
+    memory=MEMORY_LIMIT_MB * 1024 * 1024 or None,
+    cpu_seconds=CPU_LIMIT or None,
+    processes=PROCESS_LIMIT or None,
+    open_files=OPEN_FILES_LIMIT or None,
+)
 
-def get_interpreter() -> Union[IPythonInterpreter, RInterpreter]:
+r_packages = RPackages(
+    directory=Path(R_PACKAGE_DIR) if R_PACKAGE_DIR else None,
+    mirror=R_CRAN_MIRROR,
+    offline=R_PACKAGES_OFFLINE,
+)
+
+r_fork_server = (
+    RForkServer(R_PATH, R_PRELOAD_PACKAGES, limits, r_packages)
+    if INTERPRETER_TYPE == "r" and R_FORK_SERVER
+    else None
+)
+
+
+def get_interpreter() -> Union[BaseInterpreter, KernelInterpreter]:
     if INTERPRETER_TYPE == "r":
         interpreter = RInterpreter(
             working_dir=WORKING_DIRECTORY,
             r_path=R_PATH,
             timeout=TIMEOUT,
+            output_limit=OUTPUT_LIMIT,
+            limits=limits,
+            fork_server=r_fork_server,
+            packages=r_packages,
         )
     elif INTERPRETER_TYPE == "python":
         interpreter = IPythonInterpreter(
@@ -34,15 +110,203 @@ def get_interpreter() -> Union[IPythonInterpreter, RInterpreter]:
             ipython_path=IPYTHON_PATH,
             deactivate_venv=True,
             timeout=TIMEOUT,
+            output_limit=OUTPUT_LIMIT,
+            limits=limits,
+        )
+    elif INTERPRETER_TYPE == "kernel":
+        interpreter = KernelInterpreter(
+            working_dir=WORKING_DIRECTORY,
+            kernel_name=KERNEL_NAME,
+            timeout=TIMEOUT,
+            output_limit=OUTPUT_LIMIT,
+            limits=limits,
         )
     else:
         raise ValueError(f"Unsupported interpreter type: {INTERPRETER_TYPE}")
     return interpreter
 
 
+memo = CellMemo(MEMO_DIR, MEMO_MAX_MB * 1024 * 1024) if ENABLE_MEMO else None
+# what a fresh interpreter holds, part of every memo key
+MEMO_INTERPRETER = " ".join([INTERPRETER_TYPE, KERNEL_NAME, *R_PRELOAD_PACKAGES])
+
+interpreter_pool = InterpreterPool(
+    get_interpreter,
+    min_size=POOL_MIN_SIZE,
+    max_size=POOL_MAX_SIZE,
+    idle_ttl=POOL_IDLE_TTL,
+)
+
+
+@asynccontextmanager
+async def pool_lifespan(app: FastAPI):
+    """Fill the interpreter pool while the app runs, then stop the
+    interpreters of the pool and of the sessions kept alive."""
+    interpreter_pool.start()
+    try:
+        yield
+    finally:
+        await sessions.close()
+        await asyncio.to_thread(interpreter_pool.close)
+
+
+def _workspace_files() -> dict:
+    # cells write spilled output and plots there, which would change every key
+    return memo.workspace_files(WORKING_DIRECTORY, exclude=(OUTPUT_DIR,))
+
+
+async def run_cell(session: Session, script: str):
+    if script == SNAPSHOT_MESSAGE:
+        await session.send(await take_snapshot(session))
+        return
+
+    files = key = None
+    if memo is not None and session.memo and session.memo_state is not None:
+        files = await asyncio.to_thread(_workspace_files)
+        key = memo.cell_key(session.memo_state, MEMO_INTERPRETER, script, files)
+        entry = await asyncio.to_thread(memo.get, key)
+        if entry is not None:
+            await restore_memo(session, key, entry)
+            return
+
+    session.memo_state = None
+    interrupts = session.interrupts
+
+    async def send_chunk(chunk: str):
+        await session.send(f"_chunk_ {chunk}")
+
+    output = None
+    try:
+        output = await session.interpreter.arun_cell(
+            script,
+            on_output=send_chunk if session.stream else None,
+            flush_interval=STREAM_FLUSH_INTERVAL,
+            flush_size=STREAM_FLUSH_SIZE,
+            tables=session.tables and session.interpreter.supports_tables,
+        )
+        result = TIMEOUT_MESSAGE if output is None else output
+        response = f"_success_ {result}"
+    except Exception as e:
+        response = f"_error_ {e}"
+
+    tables = session.interpreter.last_tables if session.tables else []
+    for table in tables:
+        await send_table(session, table)
+
+    usage = session.interpreter.last_usage
+    entry = None
+    if key is not None and output is not None and session.interrupts == interrupts:
+        session.memo_state = key
+        # tables are sent once, their files are gone
+        if not tables and usage is not None and usage.wall_seconds >= MEMO_MIN_SECONDS:
+            entry = MemoEntry(
+                output=session.interpreter.last_output, wall_seconds=usage.wall_seconds
+            )
+
+    if usage is not None:
+        session.usage.add(usage)
+        metrics.observe("interpreter_cells.wall_seconds", usage.wall_seconds)
+        if usage.cpu_seconds is not None:
+            metrics.observe("interpreter_cells.cpu_seconds", usage.cpu_seconds)
+        if session.meta:
+            meta = {"cell": usage.dict(), "session": session.usage.dict()}
+            await session.send(f"_meta_ {json.dumps(meta)}")
+    await session.send(response)
+    if entry is not None:
+        await store_memo(session, key, files, entry)
+
+
+async def store_memo(session: Session, key: str, files: dict, entry: MemoEntry):
+    """Keep entry together with the state of the interpreter after the cell."""
+    if await asyncio.to_thread(_workspace_files) != files:
+        # a hit would not write the files the cell wrote
+        metrics.increment("interpreter_memo.uncacheable")
+        return
+    try:
+        info = await save_snapshot(session.interpreter, memo.state_path(key))
+    except Exception as e:
+        logging.warning(f"Could not save the state of a memoized cell: {e}")
+        info = None
+    if info is None or info.skipped:
+        # a hit would miss the values which could not be saved
+        metrics.increment("interpreter_memo.uncacheable")
+        await asyncio.to_thread(memo.discard, key)
+        return
+    await asyncio.to_thread(memo.put, key, entry)
+
+
+async def restore_memo(session: Session, key: str, entry: MemoEntry):
+    """Answer a cell from the memo, loading the state it left."""
+    try:
+        await load_snapshot(session.interpreter, memo.state_path(key))
+    except Exception as e:
+        # the state may be loaded in part, later cells must not hit
+        session.memo_state = None
+        metrics.increment("interpreter_memo.restore_failed")
+        await session.send(f"_error_ Could not restore the state of the memoized cell: {e}")
+        return
+    session.memo_state = key
+    await session.send(f"_memo_ {json.dumps({'saved_seconds': entry.wall_seconds})}")
+    await session.send(f"_success_ {entry.output}")
+
+
+async def send_table(session: Session, table: CellTable):
+    """Send "_table_ {...}" and the Arrow IPC stream of table as a binary frame."""
+    try:
+        size = table.path.stat().st_size
+        if size > TABLE_MAX_BYTES:
+            metrics.increment("interpreter_tables.too_large")
+            return
+        data = await asyncio.to_thread(table.path.read_bytes)
+    except OSError:
+        return
+    finally:
+        table.path.unlink(missing_ok=True)
+    info = {"format": TABLE_FORMAT, "rows": table.rows, "columns": table.columns, "bytes": size}
+    metrics.increment("interpreter_tables.sent")
+    metrics.increment("interpreter_tables.bytes", size)
+    await session.send(f"_table_ {json.dumps(info)}")
+    await session.send(data)
+
+
+async def take_snapshot(session: Session) -> str:
+    # cells run under session.lock already, see Session._run_cells
+    try:
+        info = await sessions.save_snapshot(session)
+    except Exception as e:
+        return f"_error_ {e}"
+    return f"_snapshot_ {info.json()}"
+
+
+sessions = SessionRegistry(
+    interpreter_pool.acquire,
+    run_cell,
+    idle_ttl=SESSION_IDLE_TTL,
+    replay_limit=SESSION_REPLAY_LIMIT,
+    snapshot_dir=SNAPSHOT_DIR if ENABLE_SNAPSHOTS else None,
+)
+
+
 @interpreter_router.websocket("/run")
 async def run(websocket: WebSocket):
-    ws_exceptions = WebSocketDisconnect, ConnectionClosedError
+    # clients opting in with ?stream=true receive "_chunk_" frames while a
+    # cell runs, the final "_success_" frame then only holds the remainder
+    stream = websocket.query_params.get("stream", "").lower() == "true"
+    # clients opting in with ?session=new (or a previous ID) receive
+    # "_session_ <id>" before "_ready_"; the interpreter then survives a
+    # disconnect and can be reattached with ?session=<id>
+    session_id = websocket.query_params.get("session")
+    # clients opting in with ?meta=true receive "_meta_ {...}" with the
+    # resources used by the cell and the session before each result
+    meta = websocket.query_params.get("meta", "").lower() == "true"
+    # clients opting in with ?tables=true receive data frame values as
+    # "_table_ {...}" followed by a binary frame with their Arrow IPC stream,
+    # the result then only holds a preview
+    tables = websocket.query_params.get("tables", "").lower() == "true"
+    # clients opting in with ?memo=true get the output of a cell which ran
+    # before in the same state on the same files from INTERPRETER_MEMO,
+    # announced by "_memo_ {"saved_seconds": ...}" before the result
+    memo_cells = websocket.query_params.get("memo", "").lower() == "true"
 
     await websocket.accept()
     try:
@@ -52,7 +316,7 @@ async def run(websocket: WebSocket):
         return
 
     try:
-        interpreter = get_interpreter()
+        session = await sessions.open(session_id)
     except Exception as e:
         try:
             await websocket.send_text(str(e))
@@ -61,23 +325,25 @@ async def run(websocket: WebSocket):
         return
 
     try:
+        if session.persistent:
+            await websocket.send_text(f"_session_ {session.id}")
         await websocket.send_text("_ready_")
-    except ws_exceptions:
-        interpreter.stop()
-        return
+        await session.attach(
+            websocket, stream=stream, meta=meta, tables=tables, memo=memo_cells
+        )
 
-    try:
+        # "_interrupt_" stops the running cell, other messages are cells
+        # which the session runs one after another; "_snapshot_" is queued
+        # like a cell and saves the session state with INTERPRETER_SNAPSHOTS
         while True:
-            script = await websocket.receive_text()
-            try:
-                result = interpreter.run_cell(script)
-                if result is None:
-                    result = TIMEOUT_MESSAGE
-                response = f"_success_ {result}"
-            except Exception as e:
-                response = f"_error_ {e}"
-            await websocket.send_text(response)
+            message = await websocket.receive_text()
+            if not session.is_attached(websocket):
+                break
+            if message == INTERRUPT_MESSAGE:
+                session.interrupt()
+            else:
+                session.submit(message)
     except ws_exceptions:
         pass
-
-    interpreter.stop()
+    finally:
+        await sessions.release(session, websocket)
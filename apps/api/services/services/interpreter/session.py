@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+from websockets.exceptions import ConnectionClosedError
+
+from services.metrics import metrics
+from .resources import SessionUsage
+from .snapshot import SnapshotInfo, load_snapshot, save_snapshot
+
+ws_exceptions = WebSocketDisconnect, ConnectionClosedError
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# runs one cell of the session, sending its frames with session.send
+CellRunner = Callable[["Session", str], Awaitable[None]]
+
+
+async def _send_frame(websocket: WebSocket, message: Union[str, bytes]):
+    if isinstance(message, bytes):
+        await websocket.send_bytes(message)
+    else:
+        await websocket.send_text(message)
+
+
+class Session:
+    """An interpreter together with the state that outlives one WebSocket.
+
+    Cells are run one after another by a background task, so a cell keeps
+    running when the socket drops. Frames sent while no socket is attached
+    are buffered, up to replay_limit characters or bytes, and replayed on
+    reattach.
+    """
+
+    def __init__(
+        self,
+        session_id: Optional[str],
+        interpreter,
+        runner: CellRunner,
+        *,
+        replay_limit: int,
+    ):
+        self.id = session_id
+        self.interpreter = interpreter
+        self.stream = False
+        self.meta = False
+        self.tables = False
+        self.memo = False
+        # key of the last memoized cell, which stands for the state of the
+        # interpreter; "fresh" for a new one, None once the state is unknown
+        self.memo_state: Optional[str] = "fresh"
+        self.interrupts = 0
+        self.usage = SessionUsage()
+        self.detached_since = time.monotonic()
+        self._runner = runner
+        self._replay_limit = replay_limit
+        self._replay = deque()
+        self._replay_size = 0
+        self._websocket = None
+        self._send_lock = asyncio.Lock()
+        # held while a cell runs, so snapshots do not interleave with cells
+        self.lock = asyncio.Lock()
+        self._scripts = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run_cells())
+
+    @property
+    def persistent(self) -> bool:
+        return self.id is not None
+
+    def is_attached(self, websocket: WebSocket) -> bool:
+        return self._websocket is websocket
+
+    async def attach(
+        self,
+        websocket: WebSocket,
+        *,
+        stream: bool,
+        meta: bool = False,
+        tables: bool = False,
+        memo: bool = False,
+    ):
+        """Replay frames buffered while detached, then send to websocket."""
+        async with self._send_lock:
+            previous, self._websocket = self._websocket, None
+            if previous is not None:
+                try:
+                    await previous.close()
+                except (RuntimeError, *ws_exceptions):
+                    pass
+            while self._replay:
+                await _send_frame(websocket, self._replay[0])
+                self._replay_size -= len(self._replay.popleft())
+            self.stream = stream
+            self.meta = meta
+            self.tables = tables
+            self.memo = memo
+            self._websocket = websocket
+            self.detached_since = None
+
+    def detach(self, websocket: WebSocket):
+        if self._websocket is websocket:
+            self._websocket = None
+            self.detached_since = time.monotonic()
+
+    def interrupt(self):
+        """Stop the running cell, after which the state is unknown."""
+        self.interrupts += 1
+        self.interpreter.interrupt()
+
+    def submit(self, script: str):
+        self._scripts.put_nowait(script)
+
+    @property
+    def busy(self) -> bool:
+        """Whether a cell runs or waits to run."""
+        return not self._scripts.empty() or self.lock.locked()
+
+    async def send(self, message: Union[str, bytes]):
+        async with self._send_lock:
+            websocket = self._websocket
+            if websocket is not None:
+                try:
+                    await _send_frame(websocket, message)
+                    return
+                except ws_exceptions:
+                    self.detach(websocket)
+
+            self._replay.append(message)
+            self._replay_size += len(message)
+            while self._replay_size > self._replay_limit and len(self._replay) > 1:
+                self._replay_size -= len(self._replay.popleft())
+                metrics.increment("interpreter_sessions.replay_dropped")
+
+    async def _run_cells(self):
+        while True:
+            script = await self._scripts.get()
+            try:
+                async with self.lock:
+                    await self._runner(self, script)
+            except Exception:
+                logging.exception("Could not run cell")
+            if self._websocket is None:
+                # the client has idle_ttl from now to fetch the result
+                self.detached_since = time.monotonic()
+
+    async def close(self):
+        self._worker.cancel()
+        await asyncio.to_thread(self.interpreter.stop)
+
+
+class SessionRegistry:
+    """Keeps persistent sessions alive between connections for idle_ttl seconds.
+
+    Connections without a session ID get a session which is closed as soon
+    as they disconnect, like before sessions existed. With a snapshot_dir,
+    the state of expiring sessions is saved there and restored when the
+    session is reopened. It should be private, as snapshots are loaded into
+    interpreters.
+    """
+
+    def __init__(
+        self,
+        acquire: Callable,
+        runner: CellRunner,
+        *,
+        idle_ttl: float = 600.0,
+        replay_limit: int = 1_000_000,
+        snapshot_dir: Path = None,
+    ):
+        self._acquire = acquire
+        self._runner = runner
+        self._idle_ttl = idle_ttl
+        self._replay_limit = replay_limit
+        self._snapshot_dir = snapshot_dir
+        self._sessions = {}
+        self._reaper = None
+
+    async def open(self, session_id: Optional[str]) -> Session:
+        """Return the session with session_id, or a new one.
+
+        "new" or an unknown ID start a new persistent session, None starts a
+        session which ends with the connection."""
+        self._ensure_reaper()
+        if session_id is not None and session_id != "new":
+            if not _SESSION_ID.match(session_id):
+                raise ValueError("Invalid session ID")
+            session = self._sessions.get(session_id)
+            if session is not None and session.interpreter.is_alive():
+                metrics.increment("interpreter_sessions.reattached")
+                return session
+            if session is not None:
+                await self._close(session)
+        elif session_id == "new":
+            session_id = uuid.uuid4().hex
+
+        interpreter = await asyncio.to_thread(self._acquire)
+        session = Session(
+            session_id, interpreter, self._runner, replay_limit=self._replay_limit
+        )
+        if session.persistent:
+            self._sessions[session.id] = session
+            self._update_gauges()
+            await self._restore(session)
+        return session
+
+    def _snapshot_path(self, session: Session) -> Optional[Path]:
+        if self._snapshot_dir is None or not session.persistent:
+            return None
+        # the session ID lets clients reattach, it must not be readable from a name
+        name = hashlib.sha256(session.id.encode()).hexdigest()
+        return self._snapshot_dir / f"{name}.snapshot"
+
+    async def save_snapshot(self, session: Session) -> SnapshotInfo:
+        """Save the state of session. The caller must hold session.lock."""
+        path = self._snapshot_path(session)
+        if path is None:
+            raise ValueError("Snapshots are not enabled for this session")
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        info = await save_snapshot(session.interpreter, path)
+        metrics.observe("interpreter_snapshots.save_seconds", info.save_seconds)
+        metrics.set("interpreter_snapshots.last_size", info.size)
+        return info
+
+    async def _restore(self, session: Session):
+        path = self._snapshot_path(session)
+        if path is None or not path.exists():
+            return
+        try:
+            async with session.lock:
+                info = await load_snapshot(session.interpreter, path)
+        except Exception as e:
+            logging.warning(f"Could not restore snapshot {path}: {e}")
+            return
+        session.memo_state = None
+        metrics.observe("interpreter_snapshots.load_seconds", info.load_seconds)
+        # buffered until the client attaches
+        await session.send(f"_restored_ {info.json()}")
+
+    async def release(self, session: Session, websocket: WebSocket):
+        """Detach websocket, closing the session if it is not persistent."""
+        session.detach(websocket)
+        if not session.persistent:
+            await session.close()
+        self._update_gauges()
+
+    async def _close(self, session: Session):
+        self._sessions.pop(session.id, None)
+        await session.close()
+        self._update_gauges()
+
+    async def close(self):
+        """Close all persistent sessions, e.g. at shutdown."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+        sessions = list(self._sessions.values())
+        await asyncio.gather(*(self._close(session) for session in sessions))
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(max(1.0, min(self._idle_ttl, 30.0)))
+            now = time.monotonic()
+            for session in list(self._sessions.values()):
+                detached_since = session.detached_since
+                if detached_since is None or session.busy:
+                    continue  # a running cell keeps the session, however long
+                if now - detached_since > self._idle_ttl:
+                    metrics.increment("interpreter_sessions.expired")
+                    if self._snapshot_dir is not None:
+                        try:
+                            async with session.lock:
+                                await self.save_snapshot(session)
+                        except Exception as e:
+                            logging.warning(f"Could not snapshot session {session.id}: {e}")
+                    await self._close(session)
+
+    def _update_gauges(self):
+        detached = sum(
+            1 for session in self._sessions.values() if session.detached_since is not None
+        )
+        metrics.set("interpreter_sessions.persistent", len(self._sessions))
+        metrics.set("interpreter_sessions.detached", detached)
@@ -0,0 +1,150 @@
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+from pydantic import BaseModel
+
+from .r_interpreter import _r_string
+
+_DONE_MESSAGE = "__ INTERPRETER SNAPSHOT DONE __"
+
+# put into the user namespace by IPython
+_IPYTHON_NAMES = ("In", "Out", "exit", "quit", "get_ipython", "open")
+
+# Values which cannot be serialized are skipped and reported, modules are
+# stored by name and imported again on load. Loading removes the values
+# which are not in the snapshot, so the state is the saved one.
+_PYTHON_SAVE = """
+import pickle as _snapshot_pickle
+try:
+    import dill as _snapshot_pickle
+except ImportError:
+    pass
+_snapshot_state = {{"values": {{}}, "modules": {{}}}}
+_snapshot_skipped = []
+for _snapshot_name, _snapshot_value in list(globals().items()):
+    if _snapshot_name.startswith("_") or _snapshot_name in {ipython_names!r}:
+        continue
+    if type(_snapshot_value).__name__ == "module":
+        _snapshot_state["modules"][_snapshot_name] = _snapshot_value.__name__
+        continue
+    try:
+        _snapshot_pickle.dumps(_snapshot_value)
+    except Exception:
+        _snapshot_skipped.append(_snapshot_name)
+        continue
+    _snapshot_state["values"][_snapshot_name] = _snapshot_value
+with open({path!r}, "wb") as _snapshot_file:
+    _snapshot_pickle.dump(_snapshot_state, _snapshot_file)
+if _snapshot_skipped:
+    print("Skipped:", ", ".join(_snapshot_skipped))
+print({done!r})
+"""
+
+_PYTHON_LOAD = """
+import importlib as _snapshot_importlib
+import pickle as _snapshot_pickle
+try:
+    import dill as _snapshot_pickle
+except ImportError:
+    pass
+with open({path!r}, "rb") as _snapshot_file:
+    _snapshot_state = _snapshot_pickle.load(_snapshot_file)
+for _snapshot_name, _snapshot_module in _snapshot_state["modules"].items():
+    globals()[_snapshot_name] = _snapshot_importlib.import_module(_snapshot_module)
+globals().update(_snapshot_state["values"])
+for _snapshot_name in [
+    _snapshot_name for _snapshot_name in globals()
+    if not _snapshot_name.startswith("_")
+    and _snapshot_name not in {ipython_names!r}
+    and _snapshot_name not in _snapshot_state["values"]
+    and _snapshot_name not in _snapshot_state["modules"]
+]:
+    del globals()[_snapshot_name]
+print({done!r})
+"""
+
+# save.image only saves the global environment, the attached packages are
+# saved with it and attached again on load, in the same search order
+_R_SAVE = """
+.rpilot_snapshot_packages <- (.packages())
+save.image(file = {path}, compress = FALSE)
+rm(.rpilot_snapshot_packages)
+cat({done}, "\\n", sep = "")
+"""
+
+_R_LOAD = """
+local({{
+    loaded <- load(file = {path}, envir = globalenv())
+    rm(list = setdiff(ls(globalenv(), all.names = TRUE), loaded), envir = globalenv())
+    if (exists(".rpilot_snapshot_packages", envir = globalenv(), inherits = FALSE)) {{
+        packages <- get(".rpilot_snapshot_packages", envir = globalenv())
+        rm(".rpilot_snapshot_packages", envir = globalenv())
+        for (package in rev(setdiff(packages, .packages()))) {{
+            library(package, character.only = TRUE)
+        }}
+    }}
+}})
+cat({done}, "\\n", sep = "")
+"""
+
+
+class SnapshotInfo(BaseModel):
+    path: str
+    size: int
+    skipped: list[str] = []
+    save_seconds: Optional[float] = None
+    load_seconds: Optional[float] = None
+
+
+class SnapshotError(Exception):
+    """Raised if the interpreter could not save or load a snapshot."""
+
+
+def _code(language: str, save: bool, path: Path) -> str:
+    if language == "python":
+        template = _PYTHON_SAVE if save else _PYTHON_LOAD
+        return template.format(
+            path=str(path), done=_DONE_MESSAGE, ipython_names=_IPYTHON_NAMES
+        )
+    if language == "r":
+        template = _R_SAVE if save else _R_LOAD
+        path_str = str(path).replace("\\", "/")
+        return template.format(path=_r_string(path_str), done=_r_string(_DONE_MESSAGE))
+    raise SnapshotError(f"Snapshots are not supported for {language}")
+
+
+async def _run(interpreter, code: str) -> Tuple[float, str]:
+    start = time.monotonic()
+    result = await interpreter.arun_cell(code)
+    if result is None or _DONE_MESSAGE not in result:
+        raise SnapshotError(result or "Timeout")
+    return time.monotonic() - start, result
+
+
+def _skipped(result: str) -> list[str]:
+    for line in result.splitlines():
+        if line.startswith("Skipped: "):
+            return line[len("Skipped: "):].split(", ")
+    return []
+
+
+async def save_snapshot(interpreter, path: Path) -> SnapshotInfo:
+    """Serialize the global state of interpreter to path."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(path.name + ".partial")
+    seconds, result = await _run(interpreter, _code(interpreter.language, True, partial_path))
+    os.replace(partial_path, path)
+    return SnapshotInfo(
+        path=str(path),
+        size=path.stat().st_size,
+        skipped=_skipped(result),
+        save_seconds=seconds,
+    )
+
+
+async def load_snapshot(interpreter, path: Path) -> SnapshotInfo:
+    """Restore global state saved by save_snapshot into interpreter."""
+    seconds, _ = await _run(interpreter, _code(interpreter.language, False, path))
+    return SnapshotInfo(path=str(path), size=path.stat().st_size, load_seconds=seconds)
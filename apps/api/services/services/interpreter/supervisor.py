@@ -0,0 +1,35 @@
+"""Standalone app which owns the interpreters of one shard.
+
+Run one or more supervisors next to the API workers, e.g.
+
+    uvicorn services.interpreter.supervisor:app --port 8101
+
+and list them in INTERPRETER_SUPERVISOR_URLS of the API, which can then run
+with several uvicorn workers. The agent endpoint runs here as well, next
+to the interpreters of its session. Each supervisor is a single process, so its
+sessions and interpreter pool are not split between workers.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+from services.agent import agent_router
+from services.interpreter.service import interpreter_router, pool_lifespan
+from services.llm.service import llm
+from services.metrics import metrics_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await llm.prepare()
+    async with pool_lifespan(app):
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(interpreter_router, prefix="/api/interpreter")
+app.include_router(agent_router, prefix="/api/agent")
+app.include_router(metrics_router, prefix="/api/metrics")
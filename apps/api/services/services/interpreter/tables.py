@@ -0,0 +1,30 @@
+import re
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel
+
+# printed by the cell helpers for a value written as a table, the preview follows
+TABLE_MARKER = "__ INTERPRETER TABLE "
+_TABLE_LINE = re.compile(r"^__ INTERPRETER TABLE (\d+) (\d+) (.*) __\n?$")
+
+TABLE_FORMAT = "arrow-ipc-stream"
+PREVIEW_ROWS = 10
+
+
+class CellTable(BaseModel):
+    """A tabular value of a cell, written to path as an Arrow IPC stream."""
+
+    path: Path
+    rows: int
+    columns: int
+
+
+def parse_table_line(line: str) -> Optional[CellTable]:
+    if not line.startswith(TABLE_MARKER):
+        return None
+    match = _TABLE_LINE.match(line)
+    if match is None:
+        return None
+    rows, columns, path = match.groups()
+    return CellTable(path=Path(path), rows=int(rows), columns=int(columns))
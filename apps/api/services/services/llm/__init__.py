@@ -1,4 +1,4 @@
 from .base import BaseLLM, LLMException
 from .types import Message, Response
-from .selector import get_llm
+from .selector import get_llm, register_llm
 from .service import llm_router
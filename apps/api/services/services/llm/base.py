@@ -1,14 +1,34 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 from services.llm.types import Message, Response
 
 
 class BaseLLM(ABC):
+    async def prepare(self):
+        """Load what requests need, called once at startup."""
+
     @abstractmethod
     def chat(self, history: list[Message]) -> Generator[Response, None, None]:
         """Given a chat history, return a generator which streams the response."""
 
+    async def achat(self, history: list[Message]) -> AsyncGenerator[Response, None]:
+        """Like chat, but without blocking the event loop.
+
+        The default runs chat in a worker thread, LLMs with an async client
+        should override it."""
+        generator = self.chat(history)
+        done = object()
+        try:
+            while True:
+                response = await asyncio.to_thread(next, generator, done)
+                if response is done:
+                    return
+                yield response
+        finally:
+            generator.close()
+
 
 class LLMException(Exception):
     """If an error occurs in the LLM, raise this exception, will be shown in UI."""
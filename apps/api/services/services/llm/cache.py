@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Generator, Optional
+
+from services.llm.types import Response
+from services.metrics import metrics
+from services.utils import get_env_var
+
+CACHE_BACKEND = get_env_var("LLM_CACHE", "").lower()  # "", "memory" or "disk"
+CACHE_SIZE = int(get_env_var("LLM_CACHE_SIZE", "256"))
+CACHE_TTL = float(get_env_var("LLM_CACHE_TTL", "86400"))
+CACHE_DIR = Path(get_env_var("LLM_CACHE_DIR", ".llm_cache"))
+
+
+def cache_key(request: dict) -> str:
+    """Hash of everything which determines the answer to request."""
+    canonical = {key: value for key, value in request.items() if key != "stream"}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class StreamRecorder:
+    """Records a response stream compactly, as appended text and code.
+
+    Each frame is [text, code] with what was appended, None while the field
+    is still None, or a dict with the full state if it did not just grow.
+    """
+
+    def __init__(self):
+        self.frames = []
+        self._text = None
+        self._code = None
+
+    def add(self, response: Response):
+        text, code = response.text, response.code
+        if _extends(self._text, text) and _extends(self._code, code):
+            self.frames.append([_appended(self._text, text), _appended(self._code, code)])
+        else:
+            self.frames.append({"text": text, "code": code})
+        self._text, self._code = text, code
+
+
+def _extends(old: Optional[str], new: Optional[str]) -> bool:
+    if old is None:
+        return True
+    return new is not None and new.startswith(old)
+
+
+def _appended(old: Optional[str], new: Optional[str]) -> Optional[str]:
+    if new is None:
+        return None
+    return new[len(old or "") :]
+
+
+def replay(frames: list) -> Generator[Response, None, None]:
+    """Rebuild the recorded responses, one per recorded response."""
+    text = code = None
+    for frame in frames:
+        if isinstance(frame, dict):
+            text, code = frame["text"], frame["code"]
+        else:
+            if frame[0] is not None:
+                text = (text or "") + frame[0]
+            if frame[1] is not None:
+                code = (code or "") + frame[1]
+        yield Response(text=text, code=code)
+
+
+class MemoryCache:
+    """Least recently used recordings, each kept for at most ttl seconds."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400.0):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[list]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored, frames = entry
+            if time.time() - stored > self._ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return frames
+
+    def put(self, key: str, frames: list):
+        with self._lock:
+            self._entries[key] = (time.time(), frames)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskCache:
+    """Recordings as JSON files in directory, shared by all workers.
+
+    The modification time of a file is its last use, files unused for ttl
+    seconds are expired and the least recently used beyond max_entries are
+    removed."""
+
+    def __init__(self, directory: Path, max_entries: int = 256, ttl: float = 86400.0):
+        self._directory = Path(directory)
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self._directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[list]:
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self._ttl:
+                path.unlink()
+                return None
+            frames = json.loads(path.read_text(encoding="utf-8"))
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return frames
+
+    def put(self, key: str, frames: list):
+        path = self._path(key)
+        partial = path.with_name(f"{path.name}.{os.getpid()}.partial")
+        try:
+            partial.write_text(json.dumps(frames), encoding="utf-8")
+            os.replace(partial, path)
+        except OSError:
+            return
+        self._evict()
+
+    def _evict(self):
+        try:
+            files = [(path.stat().st_mtime, path) for path in self._directory.glob("*.json")]
+        except OSError:
+            return
+        files.sort()
+        for _, path in files[: max(0, len(files) - self._max_entries)]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+class ResponseCache:
+    """Caches complete response streams by request, see cache_key."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+
+    def get(self, key: str) -> Optional[list]:
+        frames = self._backend.get(key)
+        with self._lock:
+            self._lookups += 1
+            if frames is not None:
+                self._hits += 1
+            hit_rate = self._hits / self._lookups
+        metrics.increment("llm_cache.hits" if frames is not None else "llm_cache.misses")
+        metrics.set("llm_cache.hit_rate", hit_rate)
+        return frames
+
+    def put(self, key: str, frames: list):
+        self._backend.put(key, frames)
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    if CACHE_BACKEND == "memory":
+        return ResponseCache(MemoryCache(CACHE_SIZE, CACHE_TTL))
+    if CACHE_BACKEND == "disk":
+        return ResponseCache(DiskCache(CACHE_DIR, CACHE_SIZE, CACHE_TTL))
+    if CACHE_BACKEND:
+        raise ValueError(f"Unknown LLM cache: {CACHE_BACKEND}")
+    return None
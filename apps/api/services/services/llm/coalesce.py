@@ -0,0 +1,78 @@
+import asyncio
+import time
+from typing import AsyncGenerator, AsyncIterator
+
+from services.llm.types import Response
+from services.metrics import metrics
+
+_END = object()
+
+
+def _size(response: Response) -> int:
+    return len(response.text or "") + len(response.code or "")
+
+
+async def coalesce(
+    responses: AsyncIterator[Response],
+    *,
+    window: float,
+    max_chars: int,
+) -> AsyncGenerator[Response, None]:
+    """Pass on the latest response at most every window seconds.
+
+    As every response holds the full state, responses in between can be
+    dropped. A response is passed on early once it grew by max_chars since
+    the last one, the first and the last response are never held back.
+    With a window of 0, every response is passed on.
+    """
+    queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for response in responses:
+                queue.put_nowait(response)
+        except Exception as e:
+            queue.put_nowait(e)
+        queue.put_nowait(_END)
+
+    task = asyncio.create_task(pump())
+    try:
+        pending = None
+        last_sent = None
+        sent_size = 0
+        while True:
+            timeout = None
+            if pending is not None:
+                timeout = max(0.0, window - (time.monotonic() - last_sent))
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+            else:
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                metrics.increment("llm_stream.chunks")
+                pending = item
+
+            if pending is None:
+                continue
+            now = time.monotonic()
+            if (
+                last_sent is None
+                or now - last_sent >= window
+                or _size(pending) - sent_size >= max_chars
+            ):
+                metrics.increment("llm_stream.frames")
+                last_sent = now
+                sent_size = _size(pending)
+                response, pending = pending, None
+                yield response
+
+        if pending is not None:
+            metrics.increment("llm_stream.frames")
+            yield pending
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
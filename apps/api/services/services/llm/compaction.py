@@ -0,0 +1,150 @@
+import functools
+import math
+from typing import Optional
+
+from services.llm.base import LLMException
+from services.llm.types import Message
+from services.utils import get_env_var
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# context windows of known models, matched by name or name followed by "-"
+# (e.g. "gpt-4-0613"), longest name first
+CONTEXT_WINDOWS = {
+    "gpt-4.1": 1_047_576,
+    "gpt-4o": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-4-32k": 32_768,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 16_385,
+}
+# tokens left for the functions, the answer and the message overhead
+RESPONSE_RESERVE = 4_096
+_MESSAGE_OVERHEAD = 4
+
+# context window of the model, e.g. for Azure deployments, 0 to look it up
+CONTEXT_WINDOW = int(get_env_var("LLM_CONTEXT_WINDOW", "0"))
+HISTORY_TOKENS = int(get_env_var("LLM_HISTORY_TOKENS", "0"))
+OLD_RESULT_CHARS = int(get_env_var("LLM_OLD_RESULT_CHARS", "2000"))
+RECENT_RESULTS = int(get_env_var("LLM_RECENT_RESULTS", "2"))
+
+
+def context_window(model: str) -> Optional[int]:
+    """Context window of model, None if it is not known."""
+    if CONTEXT_WINDOW > 0:
+        return CONTEXT_WINDOW
+    for name in sorted(CONTEXT_WINDOWS, key=len, reverse=True):
+        if model == name or model.startswith(f"{name}-"):
+            return CONTEXT_WINDOWS[name]
+    return None
+
+
+def token_budget(model: str) -> Optional[int]:
+    """Tokens the history of a request to model may use, None for no limit.
+
+    Without LLM_CONTEXT_WINDOW, the history to models which are not known,
+    like Azure deployments, is not limited. LLM_HISTORY_TOKENS sets the
+    budget, below the context window if it is known, e.g. to save cost."""
+    context = context_window(model)
+    budget = None if context is None else context - RESPONSE_RESERVE
+    if HISTORY_TOKENS > 0:
+        budget = HISTORY_TOKENS if budget is None else min(budget, HISTORY_TOKENS)
+    return budget
+
+
+def load_encoding(model: str):
+    """Load the tokenizer of model, which may download it. Call at startup,
+    so requests do not wait for it."""
+    _encoding(model)
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # e.g. the encoding cannot be downloaded
+        return None
+
+
+def count_tokens(text: Optional[str], model: str = "") -> int:
+    """Tokens of text, estimated as 2 characters per token without tiktoken,
+    which overestimates most text, so the history stays within the budget."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 2)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(msg: Message, model: str = "") -> int:
+    return _MESSAGE_OVERHEAD + sum(
+        count_tokens(value, model) for value in (msg.text, msg.code, msg.code_result)
+    )
+
+
+def truncate_middle(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    head = limit - limit // 2
+    tail = limit // 2
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n... [{omitted} characters omitted] ...\n{text[len(text) - tail:]}"
+
+
+def compact_history(history: list[Message], budget: int, model: str = "") -> list[Message]:
+    """Shorten history so it fits into budget tokens.
+
+    Interpreter outputs older than the last RECENT_RESULTS are cut to
+    OLD_RESULT_CHARS characters. If the history is still too long, whole
+    turns are dropped from the start, and at last all interpreter outputs
+    are cut further. Raises LLMException if even that does not fit.
+    """
+    history = list(history)
+    results = [i for i, msg in enumerate(history) if msg.role == "interpreter"]
+    old = results[: max(0, len(results) - RECENT_RESULTS)]
+    for i in old:
+        msg = history[i]
+        if msg.code_result and len(msg.code_result) > OLD_RESULT_CHARS:
+            history[i] = msg.copy(
+                update={"code_result": truncate_middle(msg.code_result, OLD_RESULT_CHARS)}
+            )
+
+    tokens = [message_tokens(msg, model) for msg in history]
+    total = sum(tokens)
+    # drop the oldest turns, a turn starts with a user message
+    turns = [i for i, msg in enumerate(history) if msg.role == "user"]
+    start = 0
+    for turn in turns[1:]:
+        if total <= budget:
+            break
+        total -= sum(tokens[start:turn])
+        start = turn
+    history = history[start:]
+    tokens = tokens[start:]
+
+    limit = OLD_RESULT_CHARS
+    while total > budget and limit > 100:
+        limit //= 2
+        for i, msg in enumerate(history):
+            if msg.role == "interpreter" and msg.code_result and len(msg.code_result) > limit:
+                history[i] = msg.copy(
+                    update={"code_result": truncate_middle(msg.code_result, limit)}
+                )
+                total -= tokens[i]
+                tokens[i] = message_tokens(history[i], model)
+                total += tokens[i]
+
+    if total > budget:
+        raise LLMException(
+            "The conversation is too long for the model, please start a new session."
+        )
+    return history
@@ -0,0 +1,62 @@
+import json
+from typing import Optional
+
+from services.llm.types import Response
+
+
+class DeltaEncoder:
+    """Turns the full responses of a chat stream into delta frames.
+
+    A "_delta_" frame holds what was appended to text and code since the
+    previous frame, and a sequence number. Every keyframe_interval frames,
+    whenever the new state does not extend the previous one, and at the end
+    of the stream, a "_success_" keyframe with the full state is sent
+    instead, so clients can always resynchronize.
+    """
+
+    def __init__(self, keyframe_interval: int = 50):
+        self._keyframe_interval = keyframe_interval
+        self._seq = 0
+        self._since_keyframe = 0
+        self._text = ""
+        self._code = ""
+        self._last = None
+
+    def encode(self, response: Response) -> Optional[str]:
+        """Return the frame for response, None if nothing changed."""
+        text = response.text or ""
+        code = response.code or ""
+        self._last = response
+        if text == self._text and code == self._code:
+            return None
+
+        self._seq += 1
+        if (
+            self._since_keyframe + 1 >= self._keyframe_interval
+            or not text.startswith(self._text)
+            or not code.startswith(self._code)
+        ):
+            return self._keyframe(response)
+
+        delta = {"seq": self._seq}
+        if len(text) > len(self._text):
+            delta["text"] = text[len(self._text) :]
+        if len(code) > len(self._code):
+            delta["code"] = code[len(self._code) :]
+        self._text, self._code = text, code
+        self._since_keyframe += 1
+        return "_delta_ " + json.dumps(delta)
+
+    def finish(self) -> Optional[str]:
+        """The final keyframe, None if the last frame already was one."""
+        if self._last is None or self._since_keyframe == 0:
+            return None
+        self._seq += 1
+        return self._keyframe(self._last)
+
+    def _keyframe(self, response: Response) -> str:
+        self._text, self._code = response.text or "", response.code or ""
+        self._since_keyframe = 0
+        frame = response.dict(exclude_none=True)
+        frame["seq"] = self._seq
+        return "_success_ " + json.dumps(frame)
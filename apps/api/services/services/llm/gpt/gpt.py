@@ -1,64 +1,144 @@
-from typing import Generator
+import asyncio
+from typing import AsyncGenerator, Generator
 
-from openai import OpenAIError
+import httpx
+from openai import APIConnectionError, APIStatusError, DefaultAsyncHttpxClient, OpenAIError
 
 from services.llm.base import BaseLLM, LLMException
+from services.llm.cache import StreamRecorder, cache_key, get_response_cache, replay
+from services.llm.compaction import compact_history, load_encoding, token_budget
+from services.llm.scheduler import RequestScheduler
 from services.llm.types import Message, Response
-from .parsing import msg_to_gpt_msg, lazy_parse_args, fill_dict
+from services.utils import get_env_var
+from .parsing import ArgumentsParser, msg_to_gpt_msg
 from .prompt import FUNCTIONS
 
+# connections to the API kept open by the async client, shared by all chats
+MAX_CONNECTIONS = int(get_env_var("LLM_MAX_CONNECTIONS", "100"))
+
+# answers are deterministic (temperature 0), so complete streams can be reused
+response_cache = get_response_cache()
+
+# limits and retries the requests of all chats, the async clients do not retry
+scheduler = RequestScheduler()
+
+
+def async_http_client() -> httpx.AsyncClient:
+    return DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+        )
+    )
+
+
+def retryable(e: Exception) -> bool:
+    """Rate limits, server errors and connection problems are worth a retry."""
+    if isinstance(e, APIStatusError):
+        return e.status_code in (408, 409, 429) or e.status_code >= 500
+    return isinstance(e, APIConnectionError)
+
+
+class _ResponseBuilder:
+    """Accumulates streamed chunks into the response so far."""
+
+    def __init__(self):
+        self._text = None
+        self._arguments = None
+
+    def add(self, chunk) -> Response:
+        delta = chunk.choices[0].delta
+
+        if getattr(delta, "content", None) is not None:
+            self._text = (self._text or "") + delta.content
+        function_call = getattr(delta, "function_call", None)
+        if function_call is not None:
+            if self._arguments is None:
+                self._arguments = ArgumentsParser("code")
+            if getattr(function_call, "arguments", None):
+                self._arguments.feed(function_call.arguments)
+
+        code = None if self._arguments is None else self._arguments.value
+        return Response(text=self._text, code=code)
+
 
 class GPT(BaseLLM):
+    """Subclasses set client and async_client, the async client should share
+    one connection pool between all concurrent chats."""
+
     def __init__(self, model_selection: dict):
         self._model_selection = model_selection
+        self._model = model_selection["model"]
+        self._token_budget = token_budget(self._model)
+
+    async def prepare(self):
+        await asyncio.to_thread(load_encoding, self._model)
+
+    def _request(self, history: list[Message]) -> dict:
+        if self._token_budget is not None:
+            history = compact_history(history, self._token_budget, self._model)
+        return dict(
+            **self._model_selection,
+            messages=[msg_to_gpt_msg(msg) for msg in history],
+            temperature=0,
+            functions=FUNCTIONS,
+            function_call="auto",
+            stream=True,
+        )
 
     def chat(self, history: list[Message]) -> Generator[Response, None, None]:
-        messages = [msg_to_gpt_msg(msg) for msg in history]
+        request = self._request(history)
+        key = cache_key(request) if response_cache is not None else None
+        frames = response_cache.get(key) if key is not None else None
+        if frames is not None:
+            yield from replay(frames)
+            return
 
         try:
-            stream = self.client.chat.completions.create(
-                **self._model_selection,
-                messages=messages,
-                temperature=0,
-                functions=FUNCTIONS,
-                function_call="auto",
-                stream=True,
-            )
-
-            response = {}
-            previous_code = None
+            stream = self.client.chat.completions.create(**request)
+            builder = _ResponseBuilder()
+            recorder = StreamRecorder()
             for chunk in stream:
-                delta = chunk.choices[0].delta
-                chunk_dict = {}
-                
-                if hasattr(delta, "content") and delta.content is not None:
-                    chunk_dict["content"] = delta.content
-                if hasattr(delta, "function_call"):
-                    if not "function_call" in response:
-                        response["function_call"] = {}
-                    if hasattr(delta.function_call, "arguments"):
-                        chunk_dict["function_call"] = {
-                            "arguments": delta.function_call.arguments
-                        }
-
-                fill_dict(response, chunk_dict)
-
-                text = None
-                if "content" in response:
-                    text = response["content"]
-
-                code = None
-                if (
-                    "function_call" in response
-                    and "arguments" in response["function_call"]
-                ):
-                    args = response["function_call"]["arguments"]
-                    code = lazy_parse_args(args)
-                if code is None:
-                    code = previous_code
-                previous_code = code
-
-                yield Response(text=text, code=code)
+                response = builder.add(chunk)
+                recorder.add(response)
+                yield response
+
+        except OpenAIError as e:
+            raise LLMException(str(e))
+        if key is not None:
+            response_cache.put(key, recorder.frames)
+
+    async def achat(self, history: list[Message]) -> AsyncGenerator[Response, None]:
+        # counting the tokens of a long history takes a while
+        request = await asyncio.to_thread(self._request, history)
+        key = cache_key(request) if response_cache is not None else None
+        if key is not None:
+            frames = await asyncio.to_thread(response_cache.get, key)
+            if frames is not None:
+                for response in replay(frames):
+                    yield response
+                    # let other connections run between frames, like a live stream
+                    await asyncio.sleep(0)
+                return
+
+        async def open_stream():
+            return await self.async_client.chat.completions.create(**request)
+
+        try:
+            stream = scheduler.stream(open_stream, retryable)
+            try:
+                builder = _ResponseBuilder()
+                recorder = StreamRecorder()
+                async for chunk in stream:
+                    response = builder.add(chunk)
+                    recorder.add(response)
+                    yield response
+            finally:
+                # hand the connection back to the pool if the client went away
+                await stream.aclose()
 
         except OpenAIError as e:
             raise LLMException(str(e))
+        # only complete streams are cached
+        if key is not None:
+            await asyncio.to_thread(response_cache.put, key, recorder.frames)
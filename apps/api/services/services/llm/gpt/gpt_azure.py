@@ -1,7 +1,7 @@
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI
 
 from services.utils import get_env_var
-from .gpt import GPT
+from .gpt import GPT, async_http_client
 
 
 class GPTAzure(GPT):
@@ -15,4 +15,11 @@ class GPTAzure(GPT):
             api_version=api_version,
             azure_endpoint=azure_endpoint
         )
+        self.async_client = AsyncAzureOpenAI(
+            api_key=api_key,
+            api_version=api_version,
+            azure_endpoint=azure_endpoint,
+            http_client=async_http_client(),
+            max_retries=0,
+        )
         super().__init__({"model": deployment_name})
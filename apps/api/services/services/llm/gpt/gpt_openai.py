@@ -1,7 +1,7 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 from services.utils import get_env_var
-from .gpt import GPT
+from .gpt import GPT, async_http_client
 
 
 class GPTOpenAI(GPT):
@@ -14,4 +14,7 @@ class GPTOpenAI(GPT):
             client_kwargs["base_url"] = api_base
             
         self.client = OpenAI(**client_kwargs)
+        self.async_client = AsyncOpenAI(
+            **client_kwargs, http_client=async_http_client(), max_retries=0
+        )
         super().__init__({"model": model_name})
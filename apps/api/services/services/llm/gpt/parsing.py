@@ -1,5 +1,6 @@
 import re
 import json
+from typing import Optional, Tuple
 
 from services.llm.types import Message
 
@@ -27,32 +28,164 @@ def msg_to_gpt_msg(msg: Message) -> dict:
     raise ValueError(f"Invalid message role {msg.role}")
 
 
-def lazy_parse_args(args_partial):
-    args = args_partial
-    if not re.sub(r"\s+", "", args).endswith('"}'):
-        args += '"}'
+_OBJECT, _KEY, _COLON, _VALUE, _STRING, _SKIP, _DONE = range(7)
 
-    try:
-        args = json.loads(args)
-        if "code" not in args:
+_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SKIP_SPECIAL = re.compile(r'["\\{}\[\],]')
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+
+
+class ArgumentsParser:
+    """Decodes one string value of a JSON object while it is streamed.
+
+    feed takes the new characters of the function call arguments and only
+    looks at those, so following a long code block costs linear time
+    instead of parsing the whole arguments on every chunk. Escapes split
+    between chunks are kept back until they are complete.
+    """
+
+    def __init__(self, key: str = "code"):
+        self._key = key
+        self._state = _OBJECT
+        self._pending = ""
+        self._current_key = []
+        self._in_value = False
+        self._parts = None
+        self._value = None
+        # nesting depth and string state of a skipped non-string value
+        self._depth = 0
+        self._skip_string = False
+
+    @property
+    def value(self) -> Optional[str]:
+        """The value decoded so far, None until its string started."""
+        if self._parts is None:
             return None
-    except json.JSONDecodeError:
-        return None
-
-    return args["code"]
-
-
-def fill_dict(dst: dict, chunk: dict):
-    for key in chunk:
-        if chunk[key] is None:
-            dst[key] = None
-        elif isinstance(chunk[key], dict):
-            if key not in dst:
-                dst[key] = {}
-            fill_dict(dst[key], chunk[key])
-        elif isinstance(chunk[key], str):
-            if key not in dst:
-                dst[key] = ""
-            dst[key] += chunk[key]
-        else:
-            raise ValueError(f"Unsupported type {type(chunk[key])}")
+        if self._value is None:
+            self._value = "".join(self._parts)
+            self._parts = [self._value]
+        return self._value
+
+    def feed(self, chunk: str) -> Optional[str]:
+        text = self._pending + chunk
+        self._pending = ""
+        pos = 0
+        while pos < len(text) and self._state != _DONE:
+            pos = self._step(text, pos)
+        return self.value
+
+    def _step(self, text: str, pos: int) -> int:
+        state = self._state
+        char = text[pos]
+        if state == _OBJECT:
+            if char == '"':
+                self._current_key = []
+                self._state = _KEY
+            elif char == "}":
+                self._state = _DONE
+            return pos + 1
+        if state == _KEY:
+            return self._string(text, pos, self._current_key)
+        if state == _COLON:
+            if char == ":":
+                self._state = _VALUE
+            return pos + 1
+        if state == _VALUE:
+            if char.isspace():
+                return pos + 1
+            if char == '"':
+                self._in_value = "".join(self._current_key) == self._key
+                if self._in_value and self._parts is None:
+                    self._parts = []
+                self._state = _STRING
+                return pos + 1
+            self._depth = 0
+            self._skip_string = False
+            self._state = _SKIP
+            return pos
+        if state == _STRING:
+            return self._string(text, pos, self._parts if self._in_value else None)
+        return self._skip(text, pos)
+
+    def _string(self, text: str, pos: int, parts: Optional[list]) -> int:
+        """Decode string characters into parts, up to the closing quote."""
+        while True:
+            match = _STRING_SPECIAL.search(text, pos)
+            end = len(text) if match is None else match.start()
+            if parts is not None and end > pos:
+                parts.append(text[pos:end])
+                self._value = None
+            if match is None:
+                return len(text)
+            if text[end] == '"':
+                self._state = _COLON if self._state == _KEY else _OBJECT
+                return end + 1
+
+            decoded, pos = self._escape(text, end)
+            if decoded is None:
+                self._pending = text[end:]
+                return len(text)
+            if parts is not None:
+                parts.append(decoded)
+                self._value = None
+
+    def _escape(self, text: str, pos: int) -> Tuple[Optional[str], int]:
+        """Decode the escape at pos, None if it is not complete yet."""
+        if pos + 1 >= len(text):
+            return None, pos
+        char = text[pos + 1]
+        if char != "u":
+            return _ESCAPES.get(char, char), pos + 2
+        if pos + 6 > len(text):
+            return None, pos
+        if not _HEX4.fullmatch(text, pos + 2, pos + 6):
+            # not valid JSON, kept as it is rather than ending the answer
+            return text[pos : pos + 2], pos + 2
+        code = int(text[pos + 2 : pos + 6], 16)
+        if 0xD800 <= code < 0xDC00:
+            # a high surrogate, combine it with the following low surrogate
+            rest = text[pos + 6 : pos + 12]
+            if len(rest) < 6 and "\\u".startswith(rest[:2]):
+                return None, pos
+            if rest.startswith("\\u") and _HEX4.fullmatch(rest, 2):
+                low = int(rest[2:], 16)
+                if 0xDC00 <= low < 0xE000:
+                    combined = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                    return chr(combined), pos + 12
+        return chr(code), pos + 6
+
+    def _skip(self, text: str, pos: int) -> int:
+        """Skip a value which is not a string, e.g. a number or an object."""
+        while True:
+            match = _SKIP_SPECIAL.search(text, pos)
+            if match is None:
+                return len(text)
+            char = text[match.start()]
+            pos = match.end()
+            if self._skip_string:
+                if char == "\\":
+                    if pos >= len(text):
+                        self._pending = "\\"
+                        return pos
+                    pos += 1
+                elif char == '"':
+                    self._skip_string = False
+            elif char == '"':
+                self._skip_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "]}" and self._depth > 0:
+                self._depth -= 1
+            elif self._depth == 0:
+                self._state = _OBJECT if char == "," else _DONE
+                return pos
@@ -1,3 +1,14 @@
+from services.utils import get_env_var
+
+# with the library shared by all R sessions, see services.interpreter.r_packages
+SHARED_PACKAGES = get_env_var("R_PACKAGE_DIR", "") != ""
+
+INSTALL_PACKAGES = (
+    "Install CRAN packages with install.packages('ggplot2'), without a repos argument, as the repository is configured. "
+)
+if SHARED_PACKAGES:
+    INSTALL_PACKAGES += "Packages installed once are shared by all sessions, installing them again is skipped. "
+
 FUNCTIONS = [
     {
         "name": "run_r_code",
@@ -6,7 +17,7 @@ FUNCTIONS = [
         + "The environment has internet and file system access. "
         + "The current working directory is shared with the user, so files can be exchanged. "
         + "Base R is available, with no preloaded packages. "
-        + "You can install packages from GitHub or CRAN like this: install.packages('ggplot2', repos='http://cran.r-project.org'). "
+        + INSTALL_PACKAGES
         + "You can use github-style markdown for formatting your messages."
         + "When creating files, provide download links using: [filename](sandbox:/workspace/filename). "
         + "You may display saved images using markdown, but you must also provide a link to the file. "
@@ -0,0 +1,78 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from pathlib import Path
+from typing import AsyncGenerator, Generator, Iterator
+
+from services.llm.base import BaseLLM, LLMException
+from services.llm.cache import replay
+from services.llm.types import Message, Response
+from services.utils import get_env_var
+
+TOKENS_PER_SECOND = float(get_env_var("LOCAL_LLM_TOKENS_PER_SECOND", "50"))
+LATENCY = float(get_env_var("LOCAL_LLM_LATENCY", "0.2"))  # seconds to the first token
+TEXT_TOKENS = int(get_env_var("LOCAL_LLM_TEXT_TOKENS", "100"))
+CODE_TOKENS = int(get_env_var("LOCAL_LLM_CODE_TOKENS", "20"))
+
+
+def synthetic_frames(text_tokens: int, code_tokens: int) -> list:
+    """A recording of an answer with text_tokens words and code_tokens lines.
+
+    The code prints numbers, which works in R and Python alike. Answers to an
+    interpreter result have no code, so agent loops end after one step."""
+    frames = [[f"word{i} ", None] for i in range(text_tokens)]
+    frames += [[None, f"print({i})\n"] for i in range(code_tokens)]
+    return frames
+
+
+class LocalLLM(BaseLLM):
+    """Streams recorded or synthetic answers without any remote API.
+
+    The setting "synthetic" generates answers, any other setting is a
+    recording or a directory of recordings, like the files of the disk
+    response cache, which are played in turn. Tokens are paced at
+    LOCAL_LLM_TOKENS_PER_SECOND after LOCAL_LLM_LATENCY seconds, which
+    makes throughput and latency benchmarks of the whole chat path
+    reproducible offline.
+    """
+
+    def __init__(self, setting: str):
+        self._synthetic = setting == "synthetic"
+        self._recordings = None
+        if not self._synthetic:
+            path = Path(setting)
+            files = sorted(path.glob("*.json")) if path.is_dir() else [path]
+            if not files:
+                raise ValueError(f"No recordings found in {setting}")
+            recordings = [json.loads(file.read_text(encoding="utf-8")) for file in files]
+            self._recordings = itertools.cycle(recordings)
+            self._lock = threading.Lock()
+
+    def _frames(self, history: list[Message]) -> list:
+        if self._recordings is not None:
+            with self._lock:
+                return next(self._recordings)
+        code_tokens = CODE_TOKENS if history and history[-1].role == "user" else 0
+        return synthetic_frames(TEXT_TOKENS, code_tokens)
+
+    def _paced(self, history: list[Message]) -> Iterator[tuple]:
+        """Responses with the seconds since the start at which they are due."""
+        if not history:
+            raise LLMException("Empty history")
+        interval = 1 / TOKENS_PER_SECOND if TOKENS_PER_SECOND > 0 else 0
+        for i, response in enumerate(replay(self._frames(history))):
+            yield LATENCY + i * interval, response
+
+    def chat(self, history: list[Message]) -> Generator[Response, None, None]:
+        start = time.monotonic()
+        for due, response in self._paced(history):
+            time.sleep(max(0.0, start + due - time.monotonic()))
+            yield response
+
+    async def achat(self, history: list[Message]) -> AsyncGenerator[Response, None]:
+        start = time.monotonic()
+        for due, response in self._paced(history):
+            await asyncio.sleep(max(0.0, start + due - time.monotonic()))
+            yield response
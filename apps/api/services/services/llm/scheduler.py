@@ -0,0 +1,248 @@
+import asyncio
+import random
+import time
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Optional
+
+from services.metrics import metrics
+from services.utils import get_env_var
+
+MAX_CONCURRENCY = int(get_env_var("LLM_MAX_CONCURRENCY", "100"))
+MAX_CONCURRENCY_PER_CLIENT = int(get_env_var("LLM_MAX_CONCURRENCY_PER_CLIENT", "8"))
+MAX_RETRIES = int(get_env_var("LLM_MAX_RETRIES", "3"))
+RETRY_BACKOFF = float(get_env_var("LLM_RETRY_BACKOFF", "0.5"))
+RETRY_MAX_BACKOFF = float(get_env_var("LLM_RETRY_MAX_BACKOFF", "8"))
+# seconds without a first token before a second request is sent, 0 disables
+HEDGE_DELAY = float(get_env_var("LLM_HEDGE_DELAY", "0"))
+
+# who a request is made for, requests of different clients are queued fairly
+llm_client: ContextVar[Optional[str]] = ContextVar("llm_client", default=None)
+
+_END = object()
+
+
+async def _close(stream):
+    close = getattr(stream, "aclose", None) or getattr(stream, "close")
+    await close()
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """The delay asked for by a Retry-After header of the error's response."""
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """Limits concurrent upstream requests and makes their start robust.
+
+    At most max_concurrency streams run at once, at most max_per_client for
+    each client. Waiting requests are granted round robin between clients,
+    so one busy client cannot starve the others. A request which fails
+    before its first chunk with a retryable error is retried with jittered
+    exponential backoff. With hedge_delay, a second request is raced against
+    one without a first chunk after that many seconds, if a slot is free.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_per_client: int = MAX_CONCURRENCY_PER_CLIENT,
+        max_retries: int = MAX_RETRIES,
+        backoff: float = RETRY_BACKOFF,
+        max_backoff: float = RETRY_MAX_BACKOFF,
+        hedge_delay: float = HEDGE_DELAY,
+    ):
+        self._max_concurrency = max_concurrency
+        self._max_per_client = max_per_client
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._hedge_delay = hedge_delay
+        self._running = 0
+        self._active = Counter()
+        # client -> futures of its waiting requests, in round robin order
+        self._waiting = OrderedDict()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._waiting.values())
+
+    def _can_run(self, client) -> bool:
+        return (
+            self._running < self._max_concurrency
+            and self._active[client] < self._max_per_client
+        )
+
+    def _grant(self, client):
+        self._running += 1
+        self._active[client] += 1
+
+    def _update_gauges(self):
+        metrics.set("llm_scheduler.running", self._running)
+        metrics.set("llm_scheduler.queue_depth", self.queue_depth)
+
+    def _try_acquire(self, client) -> bool:
+        if client in self._waiting or not self._can_run(client):
+            return False
+        self._grant(client)
+        self._update_gauges()
+        return True
+
+    async def _acquire(self, client):
+        if self._try_acquire(client):
+            metrics.observe("llm_scheduler.wait_seconds", 0.0)
+            return
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(client, deque()).append(future)
+        self._update_gauges()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # granted just before the cancellation
+                self._release(client)
+            else:
+                self._remove_waiter(client, future)
+            raise
+        metrics.observe("llm_scheduler.wait_seconds", time.monotonic() - start)
+
+    def _remove_waiter(self, client, future):
+        queue = self._waiting.get(client)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._waiting[client]
+        self._update_gauges()
+
+    def _release(self, client):
+        self._running -= 1
+        self._active[client] -= 1
+        if not self._active[client]:
+            del self._active[client]
+        self._dispatch()
+        self._update_gauges()
+
+    def _dispatch(self):
+        """Grant free slots to waiting clients, one request per client in turn."""
+        granted = True
+        while granted and self._running < self._max_concurrency:
+            granted = False
+            for client in list(self._waiting):
+                if not self._can_run(client):
+                    continue
+                queue = self._waiting.pop(client)
+                future = queue.popleft()
+                if queue:
+                    # the client goes to the back of the line
+                    self._waiting[client] = queue
+                self._grant(client)
+                future.set_result(None)
+                granted = True
+                if self._running >= self._max_concurrency:
+                    break
+
+    def _backoff_delay(self, attempt: int, e: Exception) -> float:
+        delay = random.uniform(0, min(self._max_backoff, self._backoff * 2**attempt))
+        asked = retry_after(e)
+        if asked is not None:
+            delay = max(delay, min(asked, self._max_backoff))
+        return delay
+
+    async def _first(self, open_stream: Callable[[], Awaitable[AsyncIterator]]):
+        """Open a stream and wait for its first chunk."""
+        stream = await open_stream()
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = _END
+        except BaseException:
+            await _close(stream)
+            raise
+        return stream, first
+
+    async def _start(self, open_stream, client):
+        """Like _first, but hedged with a second request if it is slow."""
+        primary = asyncio.create_task(self._first(open_stream))
+        tasks = [primary]
+        hedged = False
+        try:
+            if self._hedge_delay > 0:
+                await asyncio.wait(tasks, timeout=self._hedge_delay)
+                if not primary.done() and self._try_acquire(client):
+                    hedged = True
+                    metrics.increment("llm_scheduler.hedges")
+                    tasks.append(asyncio.create_task(self._first(open_stream)))
+
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winners = [task for task in tasks if task in done and not task.exception()]
+                if winners:
+                    if winners[0] is not primary:
+                        metrics.increment("llm_scheduler.hedge_wins")
+                    winner = winners[0]
+                    break
+                if not pending:
+                    # all failed, report the error of the last one
+                    raise [task for task in tasks if task in done][-1].exception()
+            tasks.remove(winner)
+            return winner.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                try:
+                    stream, _ = await task
+                except BaseException:
+                    continue
+                await _close(stream)
+            if hedged:
+                self._release(client)
+
+    async def stream(
+        self,
+        open_stream: Callable[[], Awaitable[AsyncIterator]],
+        retryable: Callable[[Exception], bool],
+    ) -> AsyncGenerator:
+        """Stream the chunks of the stream opened by open_stream.
+
+        open_stream is called again for every retry and hedge, the slot of
+        the request is held until the generator is exhausted or closed."""
+        client = llm_client.get()
+        await self._acquire(client)
+        try:
+            for attempt in range(self._max_retries + 1):
+                try:
+                    stream, first = await self._start(open_stream, client)
+                    break
+                except Exception as e:
+                    if attempt >= self._max_retries or not retryable(e):
+                        metrics.increment("llm_scheduler.failures")
+                        raise
+                    metrics.increment("llm_scheduler.retries")
+                    await asyncio.sleep(self._backoff_delay(attempt, e))
+
+            try:
+                if first is not _END:
+                    yield first
+                    async for chunk in stream:
+                        yield chunk
+            finally:
+                await _close(stream)
+        finally:
+            self._release(client)
@@ -1,16 +1,44 @@
+import logging
+from importlib.metadata import entry_points
+
 from services.llm.gpt import GPTAzure, GPTOpenAI
 from services.llm.base import BaseLLM
+from services.llm.local import LocalLLM
 
+# packages can add backends under this entry point group, the name of an
+# entry point is the prefix of the LLM setting, its object the BaseLLM class
+ENTRY_POINT_GROUP = "rpilot.llm"
 
 MAP_LLM = {
     "gpt-openai": GPTOpenAI,
     "gpt-azure": GPTAzure,
+    "local": LocalLLM,
 }
 
 
+def register_llm(prefix: str, llm_class: type):
+    MAP_LLM[prefix] = llm_class
+
+
+def _load_entry_points():
+    try:
+        points = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:  # Python 3.9
+        points = entry_points().get(ENTRY_POINT_GROUP, [])
+    for point in points:
+        if point.name in MAP_LLM:
+            continue
+        try:
+            register_llm(point.name, point.load())
+        except Exception as e:
+            logging.warning(f"Could not load LLM backend {point.name}: {e}")
+
+
 def get_llm(llm_setting: str) -> BaseLLM:
-    for prefix, llm_class in MAP_LLM.items():
-        if llm_setting.startswith(prefix):
-            return llm_class(llm_setting[len(prefix) + 1 :])
+    """Create the LLM for a setting like "gpt-openai:gpt-4o"."""
+    _load_entry_points()
+    prefix, _, rest = llm_setting.partition(":")
+    if prefix in MAP_LLM:
+        return MAP_LLM[prefix](rest)
 
     raise ValueError(f"Unknown LLM setting: {llm_setting}")
@@ -7,11 +7,19 @@ from websockets.exceptions import ConnectionClosedError
 
 from services.auth import verify_websocket
 from services.llm import LLMException, Message, get_llm
+from services.llm.coalesce import coalesce
+from services.llm.delta import DeltaEncoder
+from services.llm.scheduler import llm_client
 from services.utils import get_env_var
 from services.auth import AUTH_TOKEN
 
 
 LLM_SETTING = get_env_var("LLM", "gpt-openai:gpt-4o")
+KEYFRAME_INTERVAL = int(get_env_var("LLM_KEYFRAME_INTERVAL", "50"))
+COALESCE_WINDOW = float(get_env_var("LLM_COALESCE_WINDOW", "0.03"))
+COALESCE_CHARS = int(get_env_var("LLM_COALESCE_CHARS", "2048"))
+# addresses of reverse proxies whose X-Forwarded-For header is believed
+TRUSTED_PROXIES = set(get_env_var("TRUSTED_PROXIES", "").split())
 llm = get_llm(LLM_SETTING)
 
 
@@ -22,9 +30,30 @@ class Request(BaseModel):
     history: list[Message]
 
 
+def client_key(websocket: WebSocket):
+    """The client whose LLM requests are queued together, by address.
+
+    X-Forwarded-For is only used from TRUSTED_PROXIES, as clients can send
+    any value. The last address in it which is not a trusted proxy is the
+    one the proxies saw."""
+    host = websocket.client.host if websocket.client else None
+    if host not in TRUSTED_PROXIES:
+        return host
+    forwarded = websocket.headers.get("x-forwarded-for", "")
+    for address in reversed(forwarded.split(",")):
+        address = address.strip()
+        if address and address not in TRUSTED_PROXIES:
+            return address
+    return host
+
+
 @llm_router.websocket("/chat")
 async def chat(websocket: WebSocket):
     ws_exceptions = WebSocketDisconnect, ConnectionClosedError
+    # clients opting in with ?delta=true receive "_delta_" frames with only
+    # the new text and code, and a full "_success_" keyframe now and then
+    delta = websocket.query_params.get("delta", "").lower() == "true"
+    llm_client.set(client_key(websocket))
 
     await websocket.accept()
     try:
@@ -41,15 +70,26 @@ async def chat(websocket: WebSocket):
     try:
         history = json.loads(history)
         history = Request(history=history).history
-        response_generator = llm.chat(history)
+        # several chunks arriving within the window are sent as one frame
+        response_generator = coalesce(
+            llm.achat(history), window=COALESCE_WINDOW, max_chars=COALESCE_CHARS
+        )
         try:
-            for response in response_generator:
-                msg = "_success_ " + response.json(exclude_none=True)
+            encoder = DeltaEncoder(KEYFRAME_INTERVAL) if delta else None
+            async for response in response_generator:
+                if encoder is None:
+                    msg = "_success_ " + response.json(exclude_none=True)
+                else:
+                    msg = encoder.encode(response)
+                if msg is not None:
+                    await websocket.send_text(msg)
+            msg = encoder.finish() if encoder is not None else None
+            if msg is not None:
                 await websocket.send_text(msg)
             await websocket.close()
 
         except ws_exceptions:
-            response_generator.close()
+            await response_generator.aclose()
             return
 
     except Exception as e:
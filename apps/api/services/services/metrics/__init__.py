@@ -0,0 +1,2 @@
+from .registry import metrics
+from .service import metrics_router
@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Depends
+
+from services.auth import verify_token
+from .registry import metrics
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("", dependencies=[Depends(verify_token)])
+def get_metrics():
+    return metrics.snapshot()
@@ -0,0 +1,68 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.agent import agent_router
+from services.agent import service
+from services.auth import ALLOWED_HOSTS, AUTH_TOKEN
+from services.llm import BaseLLM, Response
+
+
+class ScriptedLLM(BaseLLM):
+    """Asks to run code once, then answers with the output it got."""
+
+    def __init__(self, code="print(6 * 7)"):
+        self.code = code
+
+    def chat(self, history):
+        if history[-1].role == "user":
+            yield Response(text="Running")
+            yield Response(text="Running", code=self.code)
+        else:
+            yield Response(text=f"The answer is {history[-1].code_result.strip()}")
+
+
+def _run(monkeypatch, history, llm=None, path="/api/agent/run"):
+    monkeypatch.setattr(service, "llm", llm or ScriptedLLM())
+    app = FastAPI()
+    app.include_router(agent_router, prefix="/api/agent")
+    headers = {"origin": f"http://{ALLOWED_HOSTS[0]}"}
+    frames = []
+    with TestClient(app).websocket_connect(path, headers=headers) as websocket:
+        websocket.send_text(AUTH_TOKEN)
+        websocket.send_text(json.dumps(history))
+        while True:
+            message = websocket.receive()
+            if message["type"] == "websocket.close":
+                break
+            frames.append(message["text"])
+    return frames
+
+
+def test_agent_runs_code(monkeypatch):
+    frames = _run(monkeypatch, [{"role": "user", "text": "What is 6 * 7?"}])
+    assert frames[-3] == '_success_ {"text":"Running","code":"print(6 * 7)"}'
+    assert frames[-2] == '_result_ {"code_result": "42\\n"}'
+    assert frames[-1] == '_success_ {"text":"The answer is 42"}'
+
+
+def test_agent_streamed_output(monkeypatch):
+    code = "import time\nfor i in range(5):\n    print(i, flush=True)\n    time.sleep(0.2)"
+    frames = _run(
+        monkeypatch,
+        [{"role": "user", "text": "Count"}],
+        llm=ScriptedLLM(code),
+        path="/api/agent/run?stream=true",
+    )
+    chunks = [frame[len("_chunk_ "):] for frame in frames if frame.startswith("_chunk_ ")]
+    assert len(chunks) > 1
+    output = "0\n1\n2\n3\n4\n"
+    assert "".join(chunks) == output[: len("".join(chunks))]
+    assert frames[-2] == "_result_ " + json.dumps({"code_result": output})
+    assert frames[-1] == '_success_ {"text":"The answer is 0\\n1\\n2\\n3\\n4"}'
+
+
+def test_agent_invalid_history(monkeypatch):
+    frames = _run(monkeypatch, [{"role": "nobody"}])
+    assert frames[0].startswith("_error_ ")
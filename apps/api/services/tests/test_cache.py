@@ -0,0 +1,96 @@
+import asyncio
+import json
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+from services.llm.cache import (
+    DiskCache,
+    MemoryCache,
+    ResponseCache,
+    StreamRecorder,
+    cache_key,
+    replay,
+)
+from services.llm.gpt import gpt
+from services.llm.gpt import GPTOpenAI
+from services.llm.types import Message, Response
+
+
+def test_cache_key_canonical():
+    a = {"model": "m", "messages": [{"role": "user"}], "stream": True}
+    b = {"messages": [{"role": "user"}], "model": "m"}
+    assert cache_key(a) == cache_key(b)
+    assert cache_key(a) != cache_key({**b, "model": "other"})
+
+
+def test_record_replay():
+    responses = [
+        Response(),
+        Response(text=""),
+        Response(text="ab"),
+        Response(text="abc", code="x"),
+        Response(text="abc", code="y"),
+    ]
+    recorder = StreamRecorder()
+    for response in responses:
+        recorder.add(response)
+    frames = json.loads(json.dumps(recorder.frames))
+    assert list(replay(frames)) == responses
+
+
+def test_memory_lru():
+    cache = MemoryCache(max_entries=2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    cache.get("a")
+    cache.put("c", [3])
+    assert cache.get("a") == [1]
+    assert cache.get("b") is None
+
+
+def test_memory_ttl():
+    cache = MemoryCache(ttl=0.01)
+    cache.put("a", [1])
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_disk(tmp_path):
+    cache = DiskCache(tmp_path, max_entries=2)
+    cache.put("a", [["x", None]])
+    assert DiskCache(tmp_path).get("a") == [["x", None]]
+    cache.put("b", [])
+    time.sleep(0.01)
+    cache.put("c", [])
+    assert len(list(tmp_path.glob("*.json"))) == 2
+
+
+def test_gpt_achat_cached(monkeypatch):
+    requests = []
+    body = (
+        'data: {"id": "1", "object": "chat.completion.chunk", "created": 0, "model": "m", '
+        '"choices": [{"index": 0, "delta": {"content": "Hi"}, "finish_reason": null}]}\n\n'
+        "data: [DONE]\n\n"
+    ).encode()
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, content=body, headers={"content-type": "text/event-stream"})
+
+    monkeypatch.setattr(gpt, "response_cache", ResponseCache(MemoryCache()))
+    llm = GPTOpenAI("test")
+    llm.async_client = AsyncOpenAI(
+        api_key="test",
+        base_url="http://test/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    history = [Message(role="user", text="Hello")]
+
+    async def run():
+        return [[r async for r in llm.achat(history)] for _ in range(2)]
+
+    first, second = asyncio.run(run())
+    assert first == second == [Response(text="Hi")]
+    assert len(requests) == 1
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from services.llm.coalesce import coalesce
+from services.llm.types import Response
+
+
+async def _stream(texts, delay):
+    for text in texts:
+        await asyncio.sleep(delay)
+        yield Response(text=text)
+
+
+def _collect(generator):
+    async def run():
+        return [response.text async for response in generator]
+
+    return asyncio.run(run())
+
+
+def test_coalesce_disabled():
+    texts = ["a", "ab", "abc"]
+    assert _collect(coalesce(_stream(texts, 0), window=0, max_chars=100)) == texts
+
+
+def test_coalesce_window():
+    texts = ["a" * i for i in range(1, 51)]
+    result = _collect(coalesce(_stream(texts, 0.001), window=10, max_chars=1000))
+    assert result == [texts[0], texts[-1]]
+
+
+def test_coalesce_max_chars():
+    texts = ["a" * i for i in range(1, 51)]
+    result = _collect(coalesce(_stream(texts, 0.001), window=10, max_chars=10))
+    assert result[0] == "a"
+    assert result[-1] == texts[-1]
+    assert all(len(b) - len(a) <= 10 for a, b in zip(result, result[1:]))
+
+
+def test_coalesce_flushes_on_stall():
+    async def stalling():
+        yield Response(text="a")
+        yield Response(text="ab")
+        await asyncio.sleep(0.3)
+        yield Response(text="abc")
+
+    async def run():
+        received = []
+        async for response in coalesce(stalling(), window=0.05, max_chars=1000):
+            received.append((response.text, asyncio.get_running_loop().time()))
+        return received
+
+    received = asyncio.run(run())
+    assert [text for text, _ in received] == ["a", "ab", "abc"]
+    # "ab" was sent after the window, not held back until "abc" arrived
+    assert received[2][1] - received[1][1] > 0.2
+
+
+def test_coalesce_error():
+    async def failing():
+        yield Response(text="a")
+        raise ValueError("upstream")
+
+    with pytest.raises(ValueError):
+        _collect(coalesce(failing(), window=0.05, max_chars=1000))
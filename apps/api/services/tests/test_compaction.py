@@ -0,0 +1,75 @@
+import pytest
+
+from services.llm import LLMException
+from services.llm import compaction
+from services.llm.compaction import compact_history, count_tokens, token_budget
+from services.llm.types import Message
+
+
+def _turn(i, result_size):
+    return [
+        Message(role="user", text=f"question {i}"),
+        Message(role="model", text="Let me check.", code=f"print({i})"),
+        Message(role="interpreter", code_result="x" * result_size),
+        Message(role="model", text=f"answer {i}"),
+    ]
+
+
+def test_token_budget(monkeypatch):
+    assert token_budget("gpt-4o-mini") > token_budget("gpt-4")
+    assert token_budget("gpt-4-0613") == token_budget("gpt-4")
+    assert token_budget("gpt-4.1") > token_budget("gpt-4")
+    # e.g. Azure deployment names
+    assert token_budget("my-deployment") is None
+
+    monkeypatch.setattr(compaction, "HISTORY_TOKENS", 50_000)
+    assert token_budget("my-deployment") == 50_000
+    assert token_budget("gpt-4") < 50_000
+    monkeypatch.setattr(compaction, "CONTEXT_WINDOW", 200_000)
+    assert token_budget("my-deployment") == 50_000
+    monkeypatch.setattr(compaction, "HISTORY_TOKENS", 0)
+    assert token_budget("my-deployment") > 50_000
+
+
+def test_short_history_unchanged():
+    history = _turn(0, 100) + _turn(1, 100)
+    assert compact_history(history, 100_000) == history
+
+
+def test_old_results_truncated():
+    history = [msg for i in range(4) for msg in _turn(i, 10_000)]
+    compacted = compact_history(history, 100_000)
+    results = [msg.code_result for msg in compacted if msg.role == "interpreter"]
+    assert all(len(result) < 3000 for result in results[:2])
+    assert results[2:] == ["x" * 10_000] * 2
+    assert "characters omitted" in results[0]
+
+
+def test_old_turns_dropped():
+    history = [msg for i in range(10) for msg in _turn(i, 2000)]
+    compacted = compact_history(history, 2000)
+    assert sum(count_tokens(msg.code_result) for msg in compacted) <= 2000
+    assert compacted[0].role == "user"
+    assert compacted[-1] == history[-1]
+    assert len(compacted) < len(history)
+
+
+def test_last_turn_truncated():
+    history = _turn(0, 100_000)
+    compacted = compact_history(history, 1000)
+    assert len(compacted) == len(history)
+    assert len(compacted[2].code_result) < 2000
+
+
+def test_too_long():
+    history = [Message(role="user", text="x" * 100_000)]
+    with pytest.raises(LLMException):
+        compact_history(history, 1000)
+
+
+def test_estimate_without_tiktoken(monkeypatch):
+    monkeypatch.setattr(compaction, "tiktoken", None)
+    compaction._encoding.cache_clear()
+    # tokenizers need more than one token per 4 characters for code and numbers
+    assert count_tokens("x <- c(1, 2, 3)", "unknown-model") == 8
+    compaction._encoding.cache_clear()
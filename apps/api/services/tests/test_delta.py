@@ -0,0 +1,54 @@
+import json
+
+from services.llm.delta import DeltaEncoder
+from services.llm.types import Response
+
+
+def _decode(frames):
+    """Rebuild the state like a client would."""
+    text, code = "", ""
+    for frame in frames:
+        kind, payload = frame.split(" ", 1)
+        payload = json.loads(payload)
+        if kind == "_success_":
+            text, code = payload.get("text", ""), payload.get("code", "")
+        else:
+            text += payload.get("text", "")
+            code += payload.get("code", "")
+    return text, code
+
+
+def _encode(encoder, responses):
+    frames = [encoder.encode(response) for response in responses]
+    frames.append(encoder.finish())
+    return [frame for frame in frames if frame is not None]
+
+
+def test_delta_appends():
+    responses = [Response(text="a"), Response(text="ab"), Response(text="ab", code="x")]
+    frames = _encode(DeltaEncoder(), responses)
+    assert frames[0] == '_delta_ {"seq": 1, "text": "a"}'
+    assert frames[2] == '_delta_ {"seq": 3, "code": "x"}'
+    assert frames[-1].startswith("_success_ ")
+    assert _decode(frames) == ("ab", "x")
+
+
+def test_delta_keyframes():
+    responses = [Response(text="a" * i) for i in range(1, 11)]
+    frames = _encode(DeltaEncoder(keyframe_interval=3), responses)
+    kinds = [frame.split(" ", 1)[0] for frame in frames]
+    assert kinds.count("_success_") == 4
+    assert _decode(frames) == ("a" * 10, "")
+
+
+def test_delta_rewrite():
+    responses = [Response(code="ab"), Response(code="ac")]
+    frames = _encode(DeltaEncoder(), responses)
+    assert frames[1].startswith("_success_ ")
+    assert _decode(frames) == ("", "ac")
+
+
+def test_delta_unchanged():
+    encoder = DeltaEncoder()
+    assert encoder.encode(Response(text="a")) is not None
+    assert encoder.encode(Response(text="a")) is None
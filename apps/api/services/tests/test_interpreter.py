@@ -1,6 +1,13 @@
+import asyncio
+import sys
+import time
 from pathlib import Path
 
+import pytest
+
 from services.interpreter import IPythonInterpreter
+from services.interpreter.resources import ResourceLimits
+from services.interpreter.snapshot import load_snapshot, save_snapshot
 
 
 def test_print():
@@ -89,6 +96,20 @@ def test_timeout_reset():
     result = interpreter.run_cell("import time\ntime.sleep(2)\n")
     assert result is None
 
+    # the timed out cell is interrupted, the session survives
+    result = interpreter.run_cell("print(a)\n")
+    assert result == "1\n"
+
+
+def test_timeout_uninterruptible():
+    interpreter = IPythonInterpreter(timeout=1)
+    interpreter._INTERRUPT_GRACE = 1
+    interpreter.run_cell("a = 1")
+    result = interpreter.run_cell(
+        "import signal, time\nsignal.signal(signal.SIGINT, signal.SIG_IGN)\ntime.sleep(5)\n"
+    )
+    assert result is None
+
     result = interpreter.run_cell("print(a)\n")
     assert "NameError" in result
 
@@ -97,3 +118,190 @@ def test_working_dir(tmpdir):
     interpreter = IPythonInterpreter(working_dir=Path(tmpdir))
     result = interpreter.run_cell("import os\nprint(os.getcwd())\n")
     assert result == f"{tmpdir}\n"
+
+
+def test_async():
+    interpreter = IPythonInterpreter()
+    result = asyncio.run(interpreter.arun_cell("print('Hello World')"))
+    assert result == "Hello World\n"
+
+
+def test_async_timeout():
+    interpreter = IPythonInterpreter(timeout=1)
+    result = asyncio.run(interpreter.arun_cell("import time\ntime.sleep(2)\n"))
+    assert result is None
+
+
+def test_async_concurrent():
+    interpreters = [IPythonInterpreter(), IPythonInterpreter()]
+
+    async def run_all():
+        cells = [i.arun_cell("import time\ntime.sleep(1)\n") for i in interpreters]
+        return await asyncio.gather(*cells)
+
+    start = time.time()
+    assert asyncio.run(run_all()) == ["", ""]
+    assert time.time() - start < 1.9
+
+
+def test_async_stream():
+    interpreter = IPythonInterpreter()
+    chunks = []
+
+    async def on_output(chunk):
+        chunks.append(chunk)
+
+    result = asyncio.run(
+        interpreter.arun_cell(
+            "import time\nfor i in range(3):\n    print(i, flush=True)\n    time.sleep(0.3)\n",
+            on_output=on_output,
+            flush_interval=0.1,
+        )
+    )
+    assert len(chunks) >= 2
+    assert "".join(chunks) + result == "0\n1\n2\n"
+
+
+def test_output_limit(tmpdir):
+    interpreter = IPythonInterpreter(working_dir=Path(tmpdir), output_limit=100)
+    result = interpreter.run_cell("for i in range(1000):\n    print(i)\n")
+    assert result.startswith("0\n1\n2\n")
+    assert "characters omitted" in result
+    assert "998\n999\n" in result
+
+    spilled = list(Path(tmpdir, "outputs").iterdir())
+    assert len(spilled) == 1
+    assert spilled[0].read_text() == "".join(f"{i}\n" for i in range(1000))
+
+
+def test_special_characters():
+    interpreter = IPythonInterpreter()
+    result = interpreter.run_cell("s = '''a \"quoted\"\\\\n 'line' é'''\nprint(s)")
+    assert result == "a \"quoted\"\\n 'line' é\n"
+
+
+def test_no_script_files(tmpdir):
+    interpreter = IPythonInterpreter(working_dir=Path(tmpdir))
+    interpreter.run_cell("print(1)")
+    assert list(Path(tmpdir).iterdir()) == []
+
+
+def test_interrupt():
+    interpreter = IPythonInterpreter()
+
+    async def run():
+        cell = asyncio.create_task(interpreter.arun_cell("import time\ntime.sleep(10)\n"))
+        await asyncio.sleep(0.5)
+        assert interpreter.interrupt()
+        return await cell
+
+    start = time.time()
+    result = asyncio.run(run())
+    assert "KeyboardInterrupt" in result
+    assert time.time() - start < 5
+    assert not interpreter.interrupt()
+
+
+def test_snapshot(tmpdir):
+    path = Path(tmpdir) / "session.snapshot"
+    interpreter = IPythonInterpreter()
+    interpreter.run_cell("import math\na = [1, 2]\nf = open('/dev/null')")
+    info = asyncio.run(save_snapshot(interpreter, path))
+    assert info.size > 0
+
+    restored = IPythonInterpreter()
+    asyncio.run(load_snapshot(restored, path))
+    assert restored.run_cell("print(a, math.pi > 3)") == "[1, 2] True\n"
+    assert "NameError" in restored.run_cell("f")
+
+
+def test_resource_limits():
+    interpreter = IPythonInterpreter(limits=ResourceLimits(memory=1024**3))
+    result = interpreter.run_cell("x = bytearray(2 * 1024**3)")
+    assert "MemoryError" in result
+    assert interpreter.run_cell("print('alive')") == "alive\n"
+
+
+def test_usage():
+    interpreter = IPythonInterpreter()
+    interpreter.run_cell("sum(range(10**6))")
+    usage = interpreter.last_usage
+    assert usage.wall_seconds > 0
+    if sys.platform == "linux":
+        assert usage.cpu_seconds is not None
+        assert usage.peak_rss > 0
+
+
+def test_process_exit():
+    interpreter = IPythonInterpreter(timeout=1)
+    pid = interpreter.pid
+    assert interpreter.run_cell("import os\nos._exit(0)") is None
+    # the dead process was restarted after the timeout
+    assert interpreter.pid != pid
+    assert interpreter.run_cell("print('alive')") == "alive\n"
+    interpreter.stop()
+
+
+def test_stream_beyond_limit():
+    interpreter = IPythonInterpreter(output_limit=1000)
+    received = []
+
+    async def on_output(chunk):
+        received.append((time.monotonic(), chunk))
+
+    cell = "import time\nfor i in range(30):\n    print(str(i) * 100, flush=True)\n    time.sleep(0.05)"
+    start = time.monotonic()
+    remainder = asyncio.run(interpreter.arun_cell(cell, on_output=on_output, flush_interval=0.05))
+    output = "".join(f"{str(i) * 100}\n" for i in range(30))
+    # chunks keep coming after the first 500 characters filled the head
+    assert received[-1][0] - start > 1.0
+    assert "".join(chunk for _, chunk in received) + remainder == output
+    assert "characters omitted" in interpreter.last_output
+    interpreter.stop()
+
+
+def test_tables_marker():
+    interpreter = IPythonInterpreter()
+    interpreter.run_cell("1", tables=True)
+    path = Path(interpreter._tables_dir) / "table.arrow"
+    result = interpreter.run_cell(
+        f"print('__ INTERPRETER TABLE 3 2 {path} __')\nprint('preview')",
+        tables=True,
+    )
+    assert result == "preview\n"
+    [table] = interpreter.last_tables
+    assert (table.rows, table.columns, table.path) == (3, 2, path.resolve())
+    interpreter.run_cell("1")
+    assert interpreter.last_tables == []
+    interpreter.stop()
+
+
+def test_tables_forged_marker(tmp_path):
+    victim = tmp_path / "victim.csv"
+    victim.write_text("secret")
+    interpreter = IPythonInterpreter()
+    marker = f"__ INTERPRETER TABLE 1 2 {victim} __"
+    # without tables, markers are output like any other
+    assert interpreter.run_cell(f"print('{marker}')") == marker + "\n"
+    assert interpreter.last_tables == []
+    # with tables, only files in the tables directory are taken
+    for forged in (victim, Path(interpreter._tables_arg(True)) / ".." / victim.name):
+        marker = f"__ INTERPRETER TABLE 1 2 {forged} __"
+        assert interpreter.run_cell(f"print('{marker}')", tables=True) == marker + "\n"
+        assert interpreter.last_tables == []
+    assert victim.read_text() == "secret"
+    interpreter.stop()
+
+
+def test_tables():
+    pa = pytest.importorskip("pyarrow")
+    interpreter = IPythonInterpreter()
+    cell = "import pyarrow as pa\npa.table({'x': list(range(1000)), 'y': ['a'] * 1000})"
+    assert len(interpreter.run_cell(cell)) > 0
+    assert interpreter.last_tables == []
+
+    result = interpreter.run_cell(cell, tables=True)
+    assert "[1000 rows x 2 columns, sent to the user as a table]" in result
+    [table] = interpreter.last_tables
+    with pa.ipc.open_stream(table.path.read_bytes()) as reader:
+        assert reader.read_all().num_rows == 1000
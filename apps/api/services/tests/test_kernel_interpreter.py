@@ -0,0 +1,97 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("jupyter_client")
+pytest.importorskip("ipykernel")
+
+from services.interpreter import KernelInterpreter
+
+
+def test_print():
+    interpreter = KernelInterpreter()
+    result = interpreter.run_cell("print('Hello World')")
+    assert result == "Hello World\n"
+    interpreter.stop()
+
+
+def test_statement():
+    interpreter = KernelInterpreter()
+    result = interpreter.run_cell("1\n2")
+    assert result == "2\n"
+    interpreter.stop()
+
+
+def test_output_order():
+    interpreter = KernelInterpreter()
+    result = interpreter.run_cell(
+        "import sys\nprint('a', flush=True)\n"
+        "print('b', file=sys.stderr, flush=True)\nprint('c', flush=True)"
+    )
+    assert result == "a\nb\nc\n"
+    interpreter.stop()
+
+
+def test_error():
+    interpreter = KernelInterpreter()
+    result = interpreter.run_cell("print(a)")
+    assert "NameError" in result
+    assert "\x1b[" not in result
+    interpreter.stop()
+
+
+def test_timeout_keeps_session():
+    interpreter = KernelInterpreter(timeout=1)
+    interpreter.run_cell("a = 1")
+    result = interpreter.run_cell("import time\ntime.sleep(5)\n")
+    assert result is None
+
+    result = interpreter.run_cell("print(a)\n")
+    assert result == "1\n"
+    interpreter.stop()
+
+
+def test_working_dir(tmpdir):
+    interpreter = KernelInterpreter(working_dir=Path(tmpdir))
+    result = interpreter.run_cell("import os\nprint(os.getcwd())\n")
+    assert result == f"{tmpdir}\n"
+    interpreter.stop()
+
+
+def test_async_stream():
+    interpreter = KernelInterpreter()
+    chunks = []
+
+    async def on_output(chunk):
+        chunks.append(chunk)
+
+    result = asyncio.run(
+        interpreter.arun_cell(
+            "import time\nfor i in range(3):\n    print(i, flush=True)\n    time.sleep(0.3)\n",
+            on_output=on_output,
+        )
+    )
+    assert len(chunks) >= 2
+    assert "".join(chunks) + result == "0\n1\n2\n"
+    interpreter.stop()
+
+
+def test_run_cell_in_event_loop():
+    interpreter = KernelInterpreter()
+
+    async def run():
+        return interpreter.run_cell("print(1)")
+
+    assert asyncio.run(run()) == "1\n"
+    interpreter.stop()
+
+
+def test_tables_rejected():
+    interpreter = KernelInterpreter()
+    with pytest.raises(ValueError):
+        interpreter.run_cell("1", tables=True)
+    with pytest.raises(ValueError):
+        asyncio.run(interpreter.arun_cell("1", tables=True))
+    assert not interpreter.supports_tables
+    interpreter.stop()
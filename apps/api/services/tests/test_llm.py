@@ -0,0 +1,100 @@
+import asyncio
+import importlib
+import json
+from types import SimpleNamespace
+
+import httpx
+from openai import AsyncOpenAI
+
+from services.llm import service
+from services.llm.base import BaseLLM
+from services.llm.gpt import GPTOpenAI
+from services.llm.types import Message, Response
+
+HISTORY = [Message(role="user", text="Hello")]
+
+
+class CountingLLM(BaseLLM):
+    def chat(self, history):
+        for i in range(3):
+            yield Response(text=str(i))
+
+
+def _collect(generator):
+    async def run():
+        return [response async for response in generator]
+
+    return asyncio.run(run())
+
+
+def _sse(*deltas) -> bytes:
+    events = []
+    for delta in deltas:
+        chunk = {
+            "id": "chatcmpl-test",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "test",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
+        events.append(f"data: {json.dumps(chunk)}\n\n")
+    events.append("data: [DONE]\n\n")
+    return "".join(events).encode()
+
+
+def test_achat_default():
+    responses = _collect(CountingLLM().achat(HISTORY))
+    assert [response.text for response in responses] == ["0", "1", "2"]
+
+
+def test_gpt_achat():
+    body = _sse(
+        {"role": "assistant", "content": "Let me "},
+        {"content": "check."},
+        {"function_call": {"name": "run_r_code", "arguments": '{"code": "pri'}},
+        {"function_call": {"arguments": 'nt(1)"}'}},
+    )
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(
+            200, content=body, headers={"content-type": "text/event-stream"}
+        )
+    )
+    llm = GPTOpenAI("test")
+    llm.async_client = AsyncOpenAI(
+        api_key="test",
+        base_url="http://test/v1",
+        http_client=httpx.AsyncClient(transport=transport),
+    )
+    responses = _collect(llm.achat(HISTORY))
+    assert responses[-1] == Response(text="Let me check.", code="print(1)")
+
+
+def test_client_key(monkeypatch):
+    def websocket(host, forwarded=None):
+        headers = {} if forwarded is None else {"x-forwarded-for": forwarded}
+        return SimpleNamespace(client=SimpleNamespace(host=host), headers=headers)
+
+    monkeypatch.setattr(service, "TRUSTED_PROXIES", {"10.0.0.1", "10.0.0.2"})
+    # clients cannot choose their key
+    assert service.client_key(websocket("1.2.3.4", "5.6.7.8")) == "1.2.3.4"
+    # behind proxies, the address the first proxy saw counts
+    assert service.client_key(websocket("10.0.0.1", "5.6.7.8, 1.2.3.4")) == "1.2.3.4"
+    assert service.client_key(websocket("10.0.0.1", "1.2.3.4, 10.0.0.2")) == "1.2.3.4"
+    assert service.client_key(websocket("10.0.0.1")) == "10.0.0.1"
+
+
+def test_prompt_shared_packages(monkeypatch):
+    from services.llm.gpt import prompt
+
+    try:
+        monkeypatch.delenv("R_PACKAGE_DIR", raising=False)
+        description = importlib.reload(prompt).FUNCTIONS[0]["description"]
+        assert "install.packages" in description
+        assert "shared by all sessions" not in description
+
+        monkeypatch.setenv("R_PACKAGE_DIR", "/var/lib/rpilot/r")
+        description = importlib.reload(prompt).FUNCTIONS[0]["description"]
+        assert "shared by all sessions" in description
+    finally:
+        monkeypatch.undo()
+        importlib.reload(prompt)
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from services.llm import get_llm, register_llm
+from services.llm import local
+from services.llm.cache import StreamRecorder
+from services.llm.local import LocalLLM
+from services.llm.types import Message, Response
+
+QUESTION = [Message(role="user", text="Hello")]
+
+
+@pytest.fixture(autouse=True)
+def no_pacing(monkeypatch):
+    monkeypatch.setattr(local, "TOKENS_PER_SECOND", 0)
+    monkeypatch.setattr(local, "LATENCY", 0)
+
+
+def _collect(llm, history):
+    async def run():
+        return [response async for response in llm.achat(history)]
+
+    return asyncio.run(run())
+
+
+def test_synthetic():
+    responses = _collect(get_llm("local:synthetic"), QUESTION)
+    assert responses[-1].text.startswith("word0 word1 ")
+    assert responses[-1].code.startswith("print(0)\nprint(1)\n")
+    assert list(LocalLLM("synthetic").chat(QUESTION)) == responses
+
+
+def test_synthetic_after_result():
+    history = QUESTION + [
+        Message(role="model", code="print(0)"),
+        Message(role="interpreter", code_result="0"),
+    ]
+    assert _collect(LocalLLM("synthetic"), history)[-1].code is None
+
+
+def test_recordings(tmp_path):
+    for name, text in (("a", "first"), ("b", "second")):
+        recorder = StreamRecorder()
+        recorder.add(Response(text=text[:2]))
+        recorder.add(Response(text=text))
+        (tmp_path / f"{name}.json").write_text(json.dumps(recorder.frames))
+
+    llm = LocalLLM(str(tmp_path))
+    answers = [_collect(llm, QUESTION)[-1].text for _ in range(3)]
+    assert answers == ["first", "second", "first"]
+
+
+def test_pacing(monkeypatch):
+    monkeypatch.setattr(local, "TOKENS_PER_SECOND", 100)
+    monkeypatch.setattr(local, "TEXT_TOKENS", 10)
+    monkeypatch.setattr(local, "CODE_TOKENS", 0)
+    start = time.monotonic()
+    _collect(LocalLLM("synthetic"), QUESTION)
+    assert time.monotonic() - start >= 0.09
+
+
+def test_register():
+    class Echo(LocalLLM):
+        pass
+
+    register_llm("echo-test", Echo)
+    assert isinstance(get_llm("echo-test:synthetic"), Echo)
+    with pytest.raises(ValueError):
+        get_llm("missing:model")
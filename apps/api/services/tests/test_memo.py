@@ -0,0 +1,160 @@
+import asyncio
+import os
+
+from services.interpreter import IPythonInterpreter
+from services.interpreter import service
+from services.interpreter.memo import CellMemo, MemoEntry
+from services.interpreter.session import Session
+
+
+def test_key_follows_workspace(tmp_path):
+    memo = CellMemo(tmp_path / "memo", max_bytes=1_000_000)
+    workspace = tmp_path / "workspace"
+    (workspace / "data").mkdir(parents=True)
+    (workspace / "data" / "a.csv").write_text("a,b\n1,2\n")
+    files = memo.workspace_files(workspace)
+    assert list(files) == ["data/a.csv"]
+    key = memo.cell_key("fresh", "r", "df <- read.csv(f)", files)
+
+    assert memo.cell_key("fresh", "r", "df <- read.csv(f)", files) == key
+    assert memo.cell_key("other", "r", "df <- read.csv(f)", files) != key
+    assert memo.cell_key("fresh", "python", "df <- read.csv(f)", files) != key
+    assert memo.cell_key("fresh", "r", "df <- read.csv(g)", files) != key
+
+    # files are read however the cell names them
+    (workspace / "data" / "a.csv").write_text("a,b\n1,3\n")
+    assert memo.workspace_files(workspace) != files
+    (workspace / ".hidden").write_text("x")
+    (workspace / "data" / "a.csv").write_text("a,b\n1,2\n")
+    assert memo.workspace_files(workspace) == files
+
+    # e.g. spilled outputs, only at the top
+    (workspace / "outputs").mkdir()
+    (workspace / "outputs" / "output.txt").write_text("x")
+    assert memo.workspace_files(workspace, exclude=("outputs",)) == files
+    (workspace / "data" / "outputs").mkdir()
+    (workspace / "data" / "outputs" / "b.csv").write_text("x")
+    assert memo.workspace_files(workspace, exclude=("outputs",)) != files
+
+
+def test_get_put(tmp_path):
+    memo = CellMemo(tmp_path, max_bytes=1_000_000)
+    assert memo.get("a") is None
+    memo.state_path("a").write_bytes(b"state")
+    memo.put("a", MemoEntry(output="[1] 2\n", wall_seconds=3.0))
+    assert memo.get("a") == MemoEntry(output="[1] 2\n", wall_seconds=3.0)
+    # without its state, an entry cannot be used
+    memo.state_path("a").unlink()
+    assert memo.get("a") is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    entry = MemoEntry(output="x" * 1000, wall_seconds=1.0)
+    memo = CellMemo(tmp_path, max_bytes=(len(entry.json()) + 1000) * 2)
+    for key in "ab":
+        memo.state_path(key).write_bytes(b"s" * 1000)
+        memo.put(key, entry)
+    for i, key in enumerate("ab"):
+        os.utime(tmp_path / f"{key}.json", (i + 1, i + 1))
+        os.utime(memo.state_path(key), (i + 1, i + 1))
+    assert memo.get("a") is not None
+
+    memo.state_path("c").write_bytes(b"s" * 1000)
+    memo.put("c", entry)
+    assert not memo.state_path("b").exists()
+    assert memo.get("b") is None
+    assert memo.get("a") is not None
+    assert memo.get("c") is not None
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+def test_hit_restores_state(tmp_path, monkeypatch):
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    (workspace / "n.txt").write_text("41")
+    monkeypatch.setattr(service, "memo", CellMemo(tmp_path / "memo", max_bytes=10**8))
+    monkeypatch.setattr(service, "MEMO_MIN_SECONDS", 0)
+    monkeypatch.setattr(service, "WORKING_DIRECTORY", workspace)
+    cells = ["x = int(open('n.txt').read())", "y = x + 1\nprint(y)"]
+
+    async def run(cells):
+        session = Session(
+            None,
+            IPythonInterpreter(working_dir=workspace),
+            service.run_cell,
+            replay_limit=10**6,
+        )
+        websocket = FakeWebSocket()
+        await session.attach(websocket, stream=False, memo=True)
+        for cell in cells:
+            await service.run_cell(session, cell)
+        await session.close()
+        return websocket.sent
+
+    assert asyncio.run(run(cells)) == ["_success_ ", "_success_ 42\n"]
+    sent = asyncio.run(run(cells + ["print(x + y)"]))
+    assert sent[0].startswith("_memo_ ") and sent[1] == "_success_ "
+    assert sent[2].startswith("_memo_ ") and sent[3] == "_success_ 42\n"
+    # the next cell runs with the values of the cells answered from the memo
+    assert sent[4:] == ["_success_ 83\n"]
+
+    (workspace / "n.txt").write_text("1")
+    assert asyncio.run(run(cells)) == ["_success_ ", "_success_ 2\n"]
+
+
+def test_cells_writing_files_are_not_kept(tmp_path, monkeypatch):
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    monkeypatch.setattr(service, "memo", CellMemo(tmp_path / "memo", max_bytes=10**8))
+    monkeypatch.setattr(service, "MEMO_MIN_SECONDS", 0)
+    monkeypatch.setattr(service, "WORKING_DIRECTORY", workspace)
+
+    async def run():
+        session = Session(
+            None,
+            IPythonInterpreter(working_dir=workspace),
+            service.run_cell,
+            replay_limit=10**6,
+        )
+        websocket = FakeWebSocket()
+        await session.attach(websocket, stream=False, memo=True)
+        await service.run_cell(session, "_ = open('out.txt', 'w').write('x')")
+        await session.close()
+        return websocket.sent
+
+    assert asyncio.run(run()) == ["_success_ "]
+    (workspace / "out.txt").unlink()
+    assert asyncio.run(run()) == ["_success_ "]
+    assert (workspace / "out.txt").exists()
+
+
+def test_cells_spilling_output_are_kept(tmp_path, monkeypatch):
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    monkeypatch.setattr(service, "memo", CellMemo(tmp_path / "memo", max_bytes=10**8))
+    monkeypatch.setattr(service, "MEMO_MIN_SECONDS", 0)
+    monkeypatch.setattr(service, "WORKING_DIRECTORY", workspace)
+
+    async def run():
+        session = Session(
+            None,
+            IPythonInterpreter(working_dir=workspace, output_limit=100),
+            service.run_cell,
+            replay_limit=10**6,
+        )
+        websocket = FakeWebSocket()
+        await session.attach(websocket, stream=False, memo=True)
+        await service.run_cell(session, "print('x' * 1000)")
+        await session.close()
+        return websocket.sent
+
+    assert asyncio.run(run())[0].startswith("_success_ ")
+    assert (workspace / "outputs").exists()
+    assert asyncio.run(run())[0].startswith("_memo_ ")
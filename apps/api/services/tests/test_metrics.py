@@ -0,0 +1,20 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.auth import AUTH_TOKEN
+from services.metrics import metrics, metrics_router
+
+
+def test_metrics_require_token():
+    app = FastAPI()
+    app.include_router(metrics_router, prefix="/api/metrics")
+    client = TestClient(app)
+    metrics.increment("test.requests")
+
+    assert client.get("/api/metrics").status_code == 401
+    headers = {"Authorization": "Bearer wrong"}
+    assert client.get("/api/metrics", headers=headers).status_code == 401
+    headers = {"Authorization": f"Bearer {AUTH_TOKEN}"}
+    response = client.get("/api/metrics", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["counters"]["test.requests"] >= 1
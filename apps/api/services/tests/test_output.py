@@ -0,0 +1,63 @@
+from services.interpreter.output import OutputCapture
+
+
+def test_unlimited():
+    capture = OutputCapture()
+    for i in range(100):
+        capture.write(f"{i}\n")
+    assert capture.getvalue() == "".join(f"{i}\n" for i in range(100))
+    assert not capture.truncated
+
+
+def test_within_limit():
+    capture = OutputCapture(10)
+    capture.write("12345")
+    capture.write("67890")
+    assert capture.getvalue() == "1234567890"
+
+
+def test_truncated():
+    capture = OutputCapture(10)
+    for c in "abcdefghijklmnopqrstuvwxyz":
+        capture.write(c)
+    assert capture.truncated
+    assert capture.getvalue() == "abcde\n... [16 characters omitted] ...\nvwxyz"
+
+
+def test_truncated_large_write():
+    capture = OutputCapture(4)
+    capture.write("a" * 10 + "b" * 10)
+    assert capture.getvalue() == "aa\n... [16 characters omitted] ...\nbb"
+
+
+def test_spill(tmp_path):
+    capture = OutputCapture(10, spill_dir=tmp_path, spill_link="sandbox:/workspace/outputs")
+    text = "".join(f"line {i}\n" for i in range(20))
+    for line in text.splitlines(keepends=True):
+        capture.write(line)
+    value = capture.getvalue()
+    capture.close()
+
+    assert capture.spill_path.read_text() == text
+    assert f"(sandbox:/workspace/outputs/{capture.spill_path.name})" in value
+
+
+def test_no_spill_within_limit(tmp_path):
+    capture = OutputCapture(100, spill_dir=tmp_path)
+    capture.write("short")
+    assert capture.getvalue() == "short"
+    assert capture.spill_path is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_read_new():
+    capture = OutputCapture(10, stream=True)
+    capture.write("abc")
+    assert capture.read_new() == "abc"
+    capture.write("defghijklmnop")
+    # output beyond the head is handed out too, only the value is elided
+    assert capture.read_new() == "defghijklmnop"
+    assert capture.read_new() == ""
+    capture.write("q")
+    assert capture.getvalue(skip_read=True) == "q"
+    assert capture.getvalue() == "abcde\n... [7 characters omitted] ...\nmnopq"
@@ -0,0 +1,69 @@
+import json
+import random
+
+from services.llm.gpt.parsing import ArgumentsParser
+
+CODE = 'x <- c(1, 2)\nprint("tab\\t", x)\n# ünïcode 😀 \\u00e9 /path\n\tcat("\\n")\n'
+
+
+def _feed(arguments, sizes):
+    parser = ArgumentsParser("code")
+    values = []
+    pos = 0
+    for size in sizes:
+        values.append(parser.feed(arguments[pos : pos + size]))
+        pos += size
+    values.append(parser.feed(arguments[pos:]))
+    return values
+
+
+def test_whole():
+    arguments = json.dumps({"code": CODE})
+    assert _feed(arguments, [])[-1] == CODE
+
+
+def test_every_split():
+    for ensure_ascii in (True, False):
+        arguments = json.dumps({"code": CODE}, ensure_ascii=ensure_ascii)
+        for i in range(len(arguments)):
+            values = _feed(arguments, [i])
+            assert values[-1] == CODE
+
+
+def test_single_characters():
+    arguments = json.dumps({"code": CODE})
+    values = _feed(arguments, [1] * len(arguments))
+    assert values[-1] == CODE
+    # the value only ever grows while it is streamed
+    decoded = [value for value in values if value is not None]
+    assert all(b.startswith(a) for a, b in zip(decoded, decoded[1:]))
+
+
+def test_random_chunks():
+    rng = random.Random(0)
+    arguments = json.dumps({"code": CODE * 20})
+    for _ in range(20):
+        sizes = [rng.randint(1, 40) for _ in range(len(arguments) // 10)]
+        assert _feed(arguments, sizes)[-1] == CODE * 20
+
+
+def test_other_keys():
+    arguments = json.dumps(
+        {"lang": "r\\\"", "options": {"a": [1, "}", {"b": "]"}]}, "n": 3, "code": CODE}
+    )
+    values = _feed(arguments, [1] * len(arguments))
+    assert values[-1] == CODE
+
+
+def test_missing():
+    parser = ArgumentsParser("code")
+    assert parser.feed('{"co') is None
+    assert parser.feed('de": "') == ""
+    assert parser.feed("a\\") == "a"
+    assert parser.feed('n"}') == "a\n"
+
+
+def test_invalid_escape():
+    arguments = '{"code": "a\\uzzzz\\ud83d\\u12g4 b"}'
+    for i in range(len(arguments)):
+        assert _feed(arguments, [i])[-1] == "a\\uzzzz\ud83d\\u12g4 b"
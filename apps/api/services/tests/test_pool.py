@@ -0,0 +1,67 @@
+import time
+
+from services.interpreter.pool import InterpreterPool
+
+
+class FakeInterpreter:
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def stop(self):
+        self.alive = False
+
+
+def wait_for(condition, timeout=5):
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout
+        time.sleep(0.01)
+
+
+def test_disabled():
+    pool = InterpreterPool(FakeInterpreter)
+    interpreter = pool.acquire()
+    assert interpreter.is_alive()
+    assert pool._thread is None
+    pool.close()
+
+
+def test_prewarmed():
+    pool = InterpreterPool(FakeInterpreter, min_size=2)
+    pool.start()
+    wait_for(lambda: len(pool._idle) == 2)
+    interpreter = pool._idle[0][1]
+    assert pool.acquire() is interpreter
+    wait_for(lambda: len(pool._idle) == 2)
+    pool.close()
+    assert len(pool._idle) == 0
+
+
+def test_grows_on_miss():
+    pool = InterpreterPool(FakeInterpreter, min_size=0, max_size=2)
+    pool.acquire()
+    wait_for(lambda: len(pool._idle) == 1)
+    pool.acquire()
+    pool.acquire()
+    assert pool._target == 2
+    pool.close()
+
+
+def test_dead_interpreter_skipped():
+    pool = InterpreterPool(FakeInterpreter, min_size=1)
+    pool.acquire()
+    wait_for(lambda: len(pool._idle) == 1)
+    dead = pool._idle[0][1]
+    dead.alive = False
+    assert pool.acquire() is not dead
+    pool.close()
+
+
+def test_idle_ttl():
+    pool = InterpreterPool(FakeInterpreter, min_size=0, max_size=1, idle_ttl=0)
+    pool.acquire()
+    wait_for(lambda: pool._target == 0 and len(pool._idle) == 0)
+    pool.close()
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+import pytest
+import websockets
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from services.interpreter import proxy
+from services.interpreter.proxy import interpreter_proxy_router, shard_url
+
+URLS = ["ws://a", "ws://b", "ws://c"]
+
+
+def test_shard_sticky():
+    for i in range(20):
+        assert shard_url(URLS, f"session{i}") == shard_url(URLS, f"session{i}")
+
+
+def test_shard_spread():
+    shards = {shard_url(URLS, f"session{i}") for i in range(100)}
+    assert shards == set(URLS)
+
+
+def test_shard_without_session():
+    assert shard_url(URLS, None) in URLS
+
+
+class StubSupervisor:
+    """Echoes every frame back and closes on "close", in a thread of its own."""
+
+    def __init__(self):
+        self.paths = []
+        self.closed = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), daemon=True)
+        self._thread.start()
+        assert started.wait(5)
+
+    def _serve(self, started):
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            websockets.serve(self._handle, "127.0.0.1", 0)
+        )
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"ws://127.0.0.1:{port}"
+        started.set()
+        self._loop.run_forever()
+
+    async def _handle(self, websocket):
+        self.paths.append(websocket.path)
+        try:
+            async for message in websocket:
+                if message == "close":
+                    break
+                await websocket.send(message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.closed.set()
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    supervisor = StubSupervisor()
+    monkeypatch.setattr(proxy, "SUPERVISOR_URLS", [supervisor.url])
+    yield supervisor
+    supervisor.stop()
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(interpreter_proxy_router)
+    return TestClient(app)
+
+
+def test_relay_frames(supervisor, client):
+    with client.websocket_connect("/run?session=abc&token=t") as websocket:
+        websocket.send_text("print(1)")
+        assert websocket.receive_text() == "print(1)"
+        websocket.send_bytes(b"\x00\xff")
+        assert websocket.receive_bytes() == b"\x00\xff"
+    assert supervisor.paths == ["/api/interpreter/run?session=abc&token=t"]
+
+
+def test_relay_upstream_close(supervisor, client):
+    with client.websocket_connect("/run?session=abc") as websocket:
+        websocket.send_text("close")
+        with pytest.raises(WebSocketDisconnect):
+            websocket.receive_text()
+
+
+def test_relay_client_close(supervisor, client):
+    with client.websocket_connect("/run?session=abc") as websocket:
+        websocket.send_text("x = 1")
+        assert websocket.receive_text() == "x = 1"
+        assert not supervisor.closed.is_set()
+    assert supervisor.closed.wait(5)
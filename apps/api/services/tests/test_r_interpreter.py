@@ -1,6 +1,10 @@
+import asyncio
 import pytest
 from pathlib import Path
+from services.interpreter.r_fork_server import RForkServer, frame_input
 from services.interpreter.r_interpreter import RInterpreter
+from services.interpreter.r_packages import RPackages
+from services.interpreter.snapshot import load_snapshot, save_snapshot
 
 
 def test_r_interpreter_basic():
@@ -62,6 +66,24 @@ def test_r_interpreter_timeout():
     interpreter.stop()
 
 
+def test_r_interpreter_timeout_keeps_session():
+    interpreter = RInterpreter(timeout=1)
+    interpreter.run_cell("x <- 42")
+
+    result = interpreter.run_cell("""
+    while(TRUE) {
+        Sys.sleep(0.1)
+    }
+    """)
+    assert result is None
+
+    # the cell is interrupted instead of restarting R
+    result = interpreter.run_cell("x")
+    assert "42" in result
+
+    interpreter.stop()
+
+
 def test_r_interpreter_working_dir():
     # Create a temporary working directory
     with pytest.raises(Exception):
@@ -89,5 +111,70 @@ def test_r_interpreter_packages():
     interpreter.stop()
 
 
+def test_r_fork_server(tmp_path):
+    server = RForkServer(packages=["tools"])
+    try:
+        first = RInterpreter(working_dir=tmp_path, fork_server=server)
+        second = RInterpreter(working_dir=tmp_path, fork_server=server)
+
+        # packages are attached before the fork, sessions are separate
+        assert "TRUE" in first.run_cell('"package:tools" %in% search()')
+        first.run_cell("x <- 42")
+        assert "42" in first.run_cell("x")
+        assert "Error" in second.run_cell("x")
+        assert str(tmp_path) in second.run_cell("getwd()")
+        slow = RInterpreter(working_dir=tmp_path, fork_server=server, timeout=1)
+        assert slow.run_cell("Sys.sleep(10)") is None
+        slow.stop()
+
+        first.stop()
+        assert second.run_cell('cat("alive\\n")') == "alive\n"
+        second.stop()
+    finally:
+        server.stop()
+
+
+def test_frame_input():
+    assert frame_input("x <- 1\ny <- 2") == "2\nx <- 1\ny <- 2\n"
+    assert frame_input("x <- 1\r\n") == "1\nx <- 1\n"
+
+
+def test_r_fork_server_large_cell(tmp_path):
+    server = RForkServer()
+    try:
+        # sent as thousands of lines, which the session parses once
+        interpreter = RInterpreter(working_dir=tmp_path, fork_server=server, timeout=30)
+        script = "x <- c(" + ",\n".join(str(i) for i in range(200_000)) + ")\nlength(x)"
+        assert "200000" in interpreter.run_cell(script)
+        assert "Error" in interpreter.run_cell("x <- (")
+        assert "42" in interpreter.run_cell("42")
+        interpreter.stop()
+    finally:
+        server.stop()
+
+
+def test_r_shared_packages(tmp_path):
+    packages = RPackages(directory=tmp_path / "r", offline=True)
+    interpreter = RInterpreter(working_dir=tmp_path, packages=packages)
+    assert str(packages.library) in interpreter.run_cell(".libPaths()[1]")
+    assert "already installed" in interpreter.run_cell("install.packages('stats')")
+    interpreter.stop()
+
+
+def test_r_snapshot_packages(tmp_path):
+    path = tmp_path / "session.snapshot"
+    interpreter = RInterpreter(working_dir=tmp_path)
+    interpreter.run_cell("library(tools)\nx <- 42")
+    asyncio.run(save_snapshot(interpreter, path))
+    interpreter.stop()
+
+    restored = RInterpreter(working_dir=tmp_path)
+    asyncio.run(load_snapshot(restored, path))
+    assert "42" in restored.run_cell("x")
+    assert "TRUE" in restored.run_cell('"package:tools" %in% search()')
+    assert "FALSE" in restored.run_cell('exists(".rpilot_snapshot_packages")')
+    restored.stop()
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
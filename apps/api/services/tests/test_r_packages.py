@@ -0,0 +1,19 @@
+from services.interpreter.r_packages import RPackages
+
+
+def test_default():
+    assert RPackages().setup_command() == (
+        'options(repos = c(CRAN = "https://cloud.r-project.org"))\n'
+    )
+
+
+def test_shared(tmp_path):
+    packages = RPackages(directory=tmp_path / "r", offline=True)
+    packages.prepare()
+    assert (tmp_path / "r" / "library").is_dir()
+    assert (tmp_path / "r" / "repository" / "src" / "contrib" / "PACKAGES").is_file()
+
+    command = packages.setup_command()
+    assert f'local = "{(tmp_path / "r" / "repository").as_uri()}"' in command
+    assert "CRAN" not in command
+    assert f'site_library <- "{tmp_path / "r" / "library"}"' in command
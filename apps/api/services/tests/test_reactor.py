@@ -0,0 +1,100 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from services.interpreter.channel import OutputChannel
+from services.interpreter.reactor import PipeReactor
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_lines():
+    reactor = PipeReactor()
+    read_fd, write_fd = os.pipe()
+    pipe = os.fdopen(read_fd)
+    channel = OutputChannel()
+    reactor.register(pipe, channel)
+
+    os.write(write_fd, "first\nsec".encode())
+    assert channel.get(timeout=5) == "first\n"
+    assert channel.get(timeout=0.1) is None
+    os.write(write_fd, "ond\r\nünïcode".encode()[:-3])
+    os.write(write_fd, "ünïcode".encode()[-3:] + b"\n")
+    assert channel.get(timeout=5) == "second\n"
+    assert channel.get(timeout=5) == "ünïcode\n"
+
+    # the last line is passed on at EOF, after which the pipe is dropped
+    os.write(write_fd, b"last")
+    os.close(write_fd)
+    assert channel.get(timeout=5) == "last"
+    _wait_for(lambda: reactor.registered == 0)
+    pipe.close()
+
+
+def test_unregister():
+    reactor = PipeReactor()
+    pipes = [os.pipe() for _ in range(50)]
+    channels = [OutputChannel() for _ in pipes]
+    files = [os.fdopen(read_fd) for read_fd, _ in pipes]
+    for file, channel in zip(files, channels):
+        reactor.register(file, channel)
+    for i, (_, write_fd) in enumerate(pipes):
+        os.write(write_fd, f"{i}\n".encode())
+    assert [channel.get(timeout=5) for channel in channels] == [f"{i}\n" for i in range(50)]
+
+    for file in files:
+        reactor.unregister(file)
+        file.close()
+    assert reactor.registered == 0
+    for _, write_fd in pipes:
+        os.close(write_fd)
+
+
+def test_no_thread_per_pipe():
+    reactor = PipeReactor()
+    threads = threading.active_count()
+    pipes = [os.pipe() for _ in range(20)]
+    files = [os.fdopen(read_fd) for read_fd, _ in pipes]
+    for file in files:
+        reactor.register(file, OutputChannel())
+    assert threading.active_count() == threads
+    for file, (_, write_fd) in zip(files, pipes):
+        reactor.unregister(file)
+        file.close()
+        os.close(write_fd)
+
+
+_UNREGISTER_AT_EXIT = """
+import os
+from services.interpreter.channel import OutputChannel
+from services.interpreter.reactor import get_reactor
+
+class Owner:
+    def __init__(self):
+        self.pipe = os.fdopen(os.pipe()[0])
+        get_reactor().register(self.pipe, OutputChannel())
+
+    def __del__(self):
+        get_reactor().unregister(self.pipe)
+
+owners = [Owner() for _ in range(3)]
+raise SystemExit
+"""
+
+
+def test_unregister_at_exit():
+    # the reactor thread stops before objects are collected at exit
+    subprocess.run(
+        [sys.executable, "-c", _UNREGISTER_AT_EXIT],
+        cwd=Path(__file__).parent.parent,
+        timeout=30,
+        check=True,
+    )
@@ -0,0 +1,177 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+from services.llm.gpt import GPTOpenAI, gpt
+from services.llm.scheduler import RequestScheduler, llm_client
+from services.llm.types import Message, Response
+
+
+class Retryable(Exception):
+    pass
+
+
+def _retryable(e):
+    return isinstance(e, Retryable)
+
+
+async def _chunks(*chunks, delay=0.0, closed=None):
+    try:
+        await asyncio.sleep(delay)
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(0)
+    finally:
+        if closed is not None:
+            closed.append(chunks)
+
+
+def test_fair_queue():
+    scheduler = RequestScheduler(max_concurrency=1, max_retries=0)
+    started = []
+
+    async def request(client, name):
+        llm_client.set(client)
+
+        async def open_stream():
+            started.append(name)
+            return _chunks(name, delay=0.01)
+
+        return [chunk async for chunk in scheduler.stream(open_stream, _retryable)]
+
+    async def run():
+        tasks = []
+        for client, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]:
+            tasks.append(asyncio.create_task(request(client, name)))
+            await asyncio.sleep(0)
+        assert scheduler.queue_depth == 3
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == [["a1"], ["a2"], ["a3"], ["b1"]]
+    # b does not wait for all of a's requests
+    assert started == ["a1", "a2", "b1", "a3"]
+    assert scheduler.running == 0 and scheduler.queue_depth == 0
+
+
+def test_per_client_limit():
+    scheduler = RequestScheduler(max_concurrency=10, max_per_client=2)
+    running = []
+
+    async def request():
+        async def open_stream():
+            running.append(scheduler.running)
+            return _chunks(1, delay=0.01)
+
+        return [chunk async for chunk in scheduler.stream(open_stream, _retryable)]
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(5)))
+
+    asyncio.run(run())
+    assert max(running) == 2
+
+
+def test_retry_before_first_chunk():
+    scheduler = RequestScheduler(max_retries=3, backoff=0)
+    attempts = []
+
+    async def open_stream():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Retryable()
+        return _chunks(1, 2)
+
+    async def run():
+        return [chunk async for chunk in scheduler.stream(open_stream, _retryable)]
+
+    assert asyncio.run(run()) == [1, 2]
+    assert len(attempts) == 3
+
+
+def test_no_retry_on_other_errors():
+    scheduler = RequestScheduler(max_retries=3, backoff=0)
+    attempts = []
+
+    async def open_stream():
+        attempts.append(1)
+        raise ValueError()
+
+    async def run():
+        return [chunk async for chunk in scheduler.stream(open_stream, _retryable)]
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+    assert len(attempts) == 1
+
+
+def test_no_retry_after_first_chunk():
+    scheduler = RequestScheduler(max_retries=3, backoff=0)
+    attempts = []
+
+    async def failing():
+        yield 1
+        raise Retryable()
+
+    async def open_stream():
+        attempts.append(1)
+        return failing()
+
+    async def run():
+        return [chunk async for chunk in scheduler.stream(open_stream, _retryable)]
+
+    with pytest.raises(Retryable):
+        asyncio.run(run())
+    assert len(attempts) == 1
+    assert scheduler.running == 0
+
+
+def test_hedge():
+    scheduler = RequestScheduler(hedge_delay=0.05)
+    closed = []
+    streams = iter([("slow", 1.0), ("fast", 0.0)])
+
+    async def open_stream():
+        name, delay = next(streams)
+        return _chunks(name, delay=delay, closed=closed)
+
+    async def run():
+        return [chunk async for chunk in scheduler.stream(open_stream, _retryable)]
+
+    assert asyncio.run(run()) == ["fast"]
+    assert ("slow",) in closed
+    assert scheduler.running == 0
+
+
+def test_gpt_retries_rate_limit(monkeypatch):
+    monkeypatch.setattr(gpt, "scheduler", RequestScheduler(backoff=0))
+    chunk = {
+        "id": "chatcmpl-test",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "test",
+        "choices": [{"index": 0, "delta": {"content": "Hi"}, "finish_reason": None}],
+    }
+    body = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode()
+    statuses = iter([429, 503, 200])
+
+    def handle(request):
+        status = next(statuses)
+        if status != 200:
+            return httpx.Response(status, json={"error": {"message": "busy"}})
+        return httpx.Response(200, content=body, headers={"content-type": "text/event-stream"})
+
+    llm = GPTOpenAI("test")
+    llm.async_client = AsyncOpenAI(
+        api_key="test",
+        base_url="http://test/v1",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handle)),
+    )
+
+    async def run():
+        return [response async for response in llm.achat([Message(role="user", text="Hi")])]
+
+    assert asyncio.run(run()) == [Response(text="Hi")]
@@ -0,0 +1,165 @@
+import asyncio
+
+from services.interpreter.session import SessionRegistry
+
+
+class FakeInterpreter:
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def stop(self):
+        self.alive = False
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+async def echo(session, script):
+    await session.send(f"_success_ {script}")
+
+
+def test_not_persistent():
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, echo)
+        session = await registry.open(None)
+        websocket = FakeWebSocket()
+        await session.attach(websocket, stream=False)
+        session.submit("a")
+        await asyncio.sleep(0.01)
+        await registry.release(session, websocket)
+        assert websocket.sent == ["_success_ a"]
+        assert not session.interpreter.alive
+
+    asyncio.run(run())
+
+
+def test_reattach_replays():
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, echo)
+        session = await registry.open("new")
+        websocket = FakeWebSocket()
+        await session.attach(websocket, stream=False)
+        await registry.release(session, websocket)
+
+        session.submit("a")
+        session.submit("b")
+        await asyncio.sleep(0.01)
+        assert session.interpreter.alive
+
+        reattached = await registry.open(session.id)
+        assert reattached is session
+        websocket = FakeWebSocket()
+        await session.attach(websocket, stream=False)
+        assert websocket.sent == ["_success_ a", "_success_ b"]
+
+    asyncio.run(run())
+
+
+def test_replays_binary():
+    async def send_table(session, script):
+        await session.send("_table_ {}")
+        await session.send(script.encode())
+
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, send_table)
+        session = await registry.open("new")
+        session.submit("a")
+        await asyncio.sleep(0.01)
+        websocket = FakeWebSocket()
+        await session.attach(websocket, stream=False, tables=True)
+        assert websocket.sent == ["_table_ {}", b"a"]
+        assert session.tables
+
+    asyncio.run(run())
+
+
+def test_takeover_closes_previous():
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, echo)
+        session = await registry.open("abc")
+        first, second = FakeWebSocket(), FakeWebSocket()
+        await session.attach(first, stream=False)
+        await session.attach(second, stream=False)
+        assert first.closed
+        assert session.is_attached(second)
+
+    asyncio.run(run())
+
+
+def test_replay_limit():
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, echo, replay_limit=25)
+        session = await registry.open("new")
+        for script in ["1", "2", "3"]:
+            await session.send(f"_success_ {script}")
+        websocket = FakeWebSocket()
+        await session.attach(websocket, stream=False)
+        assert websocket.sent == ["_success_ 2", "_success_ 3"]
+
+    asyncio.run(run())
+
+
+def test_expired():
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, echo, idle_ttl=0)
+        session = await registry.open("new")
+        await asyncio.sleep(1.1)
+        assert not session.interpreter.alive
+        assert (await registry.open(session.id)) is not session
+
+    asyncio.run(run())
+
+
+def test_running_cell_not_expired():
+    async def slow(session, script):
+        await asyncio.sleep(1.5)
+        await session.send(f"_success_ {script}")
+
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, slow, idle_ttl=0)
+        session = await registry.open("new")
+        session.submit("a")
+        await asyncio.sleep(1.2)
+        assert session.interpreter.alive
+        await asyncio.sleep(1.0)
+        assert not session.interpreter.alive
+
+    asyncio.run(run())
+
+
+def test_close():
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, echo)
+        first = await registry.open("new")
+        second = await registry.open("new")
+        await registry.close()
+        assert not first.interpreter.alive
+        assert not second.interpreter.alive
+
+    asyncio.run(run())
+
+
+def test_snapshot_path_hides_session_id(tmp_path):
+    async def run():
+        registry = SessionRegistry(FakeInterpreter, echo, snapshot_dir=tmp_path)
+        session = await registry.open("new")
+        path = registry._snapshot_path(session)
+        assert path.parent == tmp_path
+        assert session.id not in path.name
+
+    asyncio.run(run())